@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+Benchmarks for Gaphas. Run a benchmark by name::
+
+    python benchmark.py parallel
+
+Run without arguments to get a list of benchmarks.
+"""
+
+import sys
+import gc
+import time
+import random
+
+from gaphas.solver import Solver, Variable, WEAK
+from gaphas.constraint import EqualsConstraint, LessThanConstraint, \
+    LineConstraint, CenterConstraint, LineAlignConstraint
+
+
+def timed(func, *args, **kwargs):
+    """
+    Return the time (in seconds) it takes to run ``func``.
+    """
+    t = time.time()
+    func(*args, **kwargs)
+    return time.time() - t
+
+
+def synthetic_solver(groups=8, size=5000):
+    """
+    Create a solver with ``groups`` independent groups of constraints.
+    Each group is a chain of ``size`` points. Each point has a point
+    attached to the line to its predecessor.
+    """
+    solver = Solver()
+    solver.topological = True
+    for g in range(groups):
+        prev = None
+        for i in range(size):
+            x, y = Variable(i * 3), Variable(0, WEAK)
+            solver.add_constraint(EqualsConstraint(x, y, delta=g))
+            if prev:
+                point = Variable(i, WEAK), Variable(i, WEAK)
+                solver.add_constraint(LineConstraint(line=(prev, (x, y)), point=point))
+            prev = x, y
+    return solver
+
+
+def bench_parallel():
+    """
+    Solve synthetic canvases from scratch with an increasing number of
+    worker processes.
+    """
+    from multiprocessing import cpu_count, Pool
+    from gaphas.parallel import solve_parallel
+
+    solver = synthetic_solver()
+    print 'Constraints: %d, groups: %d' % (len(solver.constraints), len(solver.partition()))
+    print 'solve():                  %.3fs' % timed(solver.solve)
+
+    processes = 1
+    while processes <= cpu_count():
+        solver = synthetic_solver()
+        pool = Pool(processes)
+        try:
+            t = timed(solve_parallel, solver, pool=pool)
+        finally:
+            pool.close()
+            pool.join()
+        print 'solve_parallel(), %2d cpu: %.3fs' % (processes, t)
+        processes *= 2
+
+
+def diagram_solver(boxes=200, seed=0):
+    """
+    Create a solver with the kind of constraints a diagram has: ``boxes``
+    boxes with a minimal size and a centered label, each connected to the
+    next box by a line with an aligned label. The constraints are added in
+    random order. Returns the solver and the corner variables of the boxes.
+    """
+    rnd = random.Random(seed)
+    constraints = []
+    corners = []
+    for i in range(boxes):
+        x, y = rnd.uniform(0, 1000), rnd.uniform(0, 1000)
+        nw = Variable(x), Variable(y)
+        ne = Variable(x + 50), Variable(y)
+        se = Variable(x + 50), Variable(y + 30)
+        sw = Variable(x), Variable(y + 30)
+        label = Variable(0, WEAK), Variable(0, WEAK)
+        constraints.extend([
+            EqualsConstraint(nw[1], ne[1]),
+            EqualsConstraint(sw[1], se[1]),
+            EqualsConstraint(nw[0], sw[0]),
+            EqualsConstraint(ne[0], se[0]),
+            LessThanConstraint(nw[0], ne[0], delta=10),
+            LessThanConstraint(nw[1], sw[1], delta=10),
+            CenterConstraint(nw[0], ne[0], label[0]),
+            CenterConstraint(nw[1], sw[1], label[1])])
+        corners.append((nw, ne, se, sw))
+    for a, b in zip(corners[:-1], corners[1:]):
+        head = Variable(0, WEAK), Variable(0, WEAK)
+        tail = Variable(0, WEAK), Variable(0, WEAK)
+        label = Variable(0, WEAK), Variable(0, WEAK)
+        constraints.extend([
+            LineConstraint(line=(a[1], a[2]), point=head),
+            LineConstraint(line=(b[0], b[3]), point=tail),
+            LineAlignConstraint(line=(head, tail), point=label)])
+    rnd.shuffle(constraints)
+
+    solver = Solver()
+    for c in constraints:
+        solver.add_constraint(c)
+    return solver, corners
+
+
+def bench_priority(moves=500):
+    """
+    Count solve_for() calls needed to solve a diagram and to follow a
+    number of random moves, per scheduling mode.
+    """
+    print 'mode          initial    moves     time'
+    for mode in ('default', 'priority', 'topological'):
+        solver, corners = diagram_solver()
+        if mode != 'default':
+            setattr(solver, mode, True)
+        t = time.time()
+        solver.solve()
+        initial = solver.solved_count
+        rnd = random.Random(0)
+        for i in range(moves):
+            x, y = rnd.choice(rnd.choice(corners))
+            x.value += rnd.uniform(-20, 20)
+            y.value += rnd.uniform(-20, 20)
+            solver.solve()
+        print '%-12s %8d %8d %7.3fs' % (mode, initial,
+                solver.solved_count - initial, time.time() - t)
+
+
+def bench_compiled(moves=2000):
+    """
+    Drag a box corner of a diagram, solving with solve() and with a
+    compiled network.
+    """
+    for mode in ('solve', 'compiled'):
+        solver, corners = diagram_solver()
+        solver.solve()
+        x, y = corners[len(corners) // 2][0]
+        x.value += 1
+        y.value += 1
+        solve = solver.solve
+        if mode == 'compiled':
+            solve = solver.compile(list(solver.constraints_with_variable(x))
+                    + list(solver.constraints_with_variable(y)))
+        t = time.time()
+        for i in range(moves):
+            x.value += 1
+            y.value += 1
+            solve()
+        print '%-10s %7.3fs' % (mode, time.time() - t)
+
+
+def bench_batch(count=5000):
+    """
+    Add elements, each with a child element, to a canvas one by one and
+    with Canvas.add_many().
+    """
+    from gaphas.canvas import Canvas
+    from gaphas.item import Element
+
+    for mode in ('add', 'add_many'):
+        canvas = Canvas()
+        items = []
+        for i in range(count):
+            parent = Element()
+            parent.matrix.translate(i % 100 * 60, i // 100 * 40)
+            items.append((parent, None))
+            items.append((Element(), parent))
+        # Do not count the garbage of the previous run
+        gc.collect()
+        t = time.time()
+        if mode == 'add':
+            for item, parent in items:
+                canvas.add(item, parent)
+        else:
+            canvas.add_many(items)
+        canvas.update_now()
+        print '%-10s %7.3fs' % (mode, time.time() - t)
+
+
+BENCHMARKS = dict((name[6:], func) for name, func in globals().items()
+                  if name.startswith('bench_'))
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:]
+    if not names:
+        for name in sorted(BENCHMARKS):
+            print '%-12s %s' % (name, ' '.join(BENCHMARKS[name].__doc__.split()))
+    for name in names:
+        BENCHMARKS[name]()
+
+# vim: sw=4:et:
@@ -290,7 +290,7 @@ def create_window(canvas, title, zoom=1.0):
     b = gtk.Button('Dump QTree')
 
     def on_clicked(button, li):
-        view._qtree.dump()
+        view.canvas._get_spatial_index().dump()
 
     b.connect('clicked', on_clicked, [0])
     v.add(b)
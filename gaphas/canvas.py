@@ -31,12 +31,16 @@ __version__ = "$Revision$"
 # $HeadURL$
 
 from collections import namedtuple
+from contextlib import contextmanager
 import logging
 
 from cairo import Matrix
 from gaphas import tree
 from gaphas import solver
 from gaphas import table
+from gaphas import matrixstore
+from gaphas.geometry import rectangle_transform
+from gaphas.quadtree import SpatialIndex
 from gaphas.decorators import nonrecursive, async, PRIORITY_HIGH_IDLE
 from state import observed, reversible_method, reversible_pair
 
@@ -55,6 +59,18 @@ Connection = namedtuple('Connection',
         'item handle connected port constraint callback')
 
 
+#
+# Kinds of update requests (see Canvas.request_update()):
+#
+# - APPEARANCE: only the looks of the item changed, it's repainted
+# - MATRIX: the item's matrix changed
+# - GEOMETRY: the item's shape changed, it gets a full update
+#
+APPEARANCE = 1
+MATRIX = 2
+GEOMETRY = 4
+
+
 class ConnectionError(Exception):
     """
     Exception raised when there is an error when connecting an items with
@@ -86,15 +102,31 @@ class Context(object):
 class Canvas(object):
     """
     Container class for items.
+
+    If ``columnar_matrices`` is set (and NumPy is available), the item to
+    canvas matrices are calculated for whole subtrees at once and kept in
+    a `matrixstore.MatrixStore`. Matrix objects are created when they are
+    requested (see ``get_matrix_i2c()``).
+
+    Items can be looked up by position in canvas coordinates (see
+    ``find_intersect()``, ``find_inside()`` and ``find_nearest()``). The
+    spatial index is created on the first lookup and kept up to date on
+    each update from then on.
     """
 
+    columnar_matrices = False
+
     def __init__(self):
         self._tree = tree.Tree()
         self._solver = solver.Solver()
         self._connections = table.Table(Connection, range(4))
         self._dirty_items = set()
         self._dirty_matrix_items = set()
-        self._dirty_index = False
+        self._batch_level = 0
+        self._batch_items = []
+        self._matrix_store = None
+        self._spatial_index = None
+        self._item_bounds = {}
 
         self._registered_views = set()
     
@@ -115,15 +147,88 @@ class Canvas(object):
         >>> i._canvas is c
         True
         """
-        assert item not in self._tree.nodes, 'Adding already added node %s' % item
+        assert item not in self._tree.get_nodes_view(), 'Adding already added node %s' % item
         self._tree.add(item, parent, index)
-        self._dirty_index = True
 
-        self.update_matrix(item, parent)
+        if self._batch_level:
+            # Set up when the batch ends
+            self._batch_items.append(item)
+        else:
+            self.update_matrix(item, parent)
+            item._set_canvas(self)
+            self.request_update(item)
 
-        item._set_canvas(self)
 
-        self.request_update(item)
+    def add_many(self, items):
+        """
+        Add a lot of items at once. ``items`` is an iterable of
+        ``(item, parent)`` tuples. Parents should be added before their
+        children. The items are added in a ``batch()``, one event is
+        emitted for the undo system.
+
+        >>> c = Canvas()
+        >>> from gaphas import item
+        >>> i = item.Item()
+        >>> ii = item.Item()
+        >>> c.add_many([(i, None), (ii, i)])
+        >>> c.get_all_items() == [i, ii]
+        True
+        >>> ii._matrix_i2c
+        cairo.Matrix(1, 0, 0, 1, 0, 0)
+        """
+        items = list(items)
+        self._add_many([i for i, p in items], [p for i, p in items],
+                       [None] * len(items), ())
+
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager for bulk changes, e.g. when loading a diagram.
+        Within a batch, items are only put in the tree when they are added
+        and update requests are collected. When the (outer most) batch
+        ends, the canvas is updated: the added items are set up, matrices
+        are calculated, constraints are solved and views are notified, all
+        in one go.
+
+        Until then, the ``canvas`` of the items added in the batch is not
+        set (see `item.Item.setup_canvas()`).
+
+        >>> c = Canvas()
+        >>> from gaphas import item
+        >>> with c.batch():
+        ...     i = item.Item()
+        ...     c.add(i)
+        ...     len(c._dirty_items), i._matrix_i2c, i.canvas
+        (0, None, None)
+        >>> len(c._dirty_items), i._matrix_i2c, i.canvas is c
+        (0, cairo.Matrix(1, 0, 0, 1, 0, 0), True)
+        """
+        self._batch_level += 1
+        try:
+            yield self
+        finally:
+            self._batch_level -= 1
+            if not self._batch_level:
+                self._setup_batch_items()
+                self.update()
+
+
+    def _setup_batch_items(self):
+        """
+        Set up the items added in a batch that are still in the canvas, in
+        the order they were added, and request an update for all of them.
+        """
+        items = self._batch_items
+        if not items:
+            return
+        self._batch_items = []
+        nodes = self._tree.get_nodes_view()
+        items = [i for i in items if i in nodes]
+        for item in items:
+            item._set_canvas(self)
+        self._dirty_items.update(items)
+        self._dirty_matrix_items.update(items)
 
 
     @observed
@@ -137,6 +242,11 @@ class Canvas(object):
         self._update_views(removed_items=(item,))
         self._dirty_items.discard(item)
         self._dirty_matrix_items.discard(item)
+        if self._matrix_store is not None:
+            self._matrix_store.discard(item)
+        self._item_bounds.pop(item, None)
+        if self._spatial_index is not None:
+            self._spatial_index.remove(item)
 
 
     def remove(self, item):
@@ -162,6 +272,89 @@ class Canvas(object):
                            'index': lambda self, item: self._tree.get_siblings(item).index(item) })
 
 
+    def remove_many(self, items):
+        """
+        Remove a lot of items, e.g. a large selection, and their children
+        at once. Connections to and from the items are removed as well. One
+        event is emitted for the undo system and views are notified once.
+
+        >>> c = Canvas()
+        >>> from gaphas import item
+        >>> i = item.Item()
+        >>> ii = item.Item()
+        >>> iii = item.Item()
+        >>> c.add_many([(i, None), (ii, i), (iii, None)])
+        >>> c.remove_many([i])
+        >>> c.get_all_items() == [iii]
+        True
+        >>> ii._canvas
+        """
+        tree = self._tree
+        is_ancestor = tree.is_ancestor
+        closure = []
+        top = None
+        for item in tree.sort(set(items)):
+            if top is not None and is_ancestor(top, item):
+                continue
+            top = item
+            closure.append(item)
+            closure.extend(tree.get_all_children(item))
+        if closure:
+            self._remove_many(closure)
+
+
+    @observed
+    def _remove_many(self, items):
+        """
+        Remove ``items``, in depth-first order. The children of the items
+        should be part of ``items``.
+        """
+        disconnect_item = self._disconnect_item
+        for cinfo in self._get_connections_to_items(items):
+            disconnect_item(*cinfo)
+
+        for item in reversed(items):
+            item._set_canvas(None)
+
+        tree = self._tree
+        removed = set(items)
+        get_parent = tree.get_parent
+        for item in [i for i in items if get_parent(i) not in removed]:
+            tree.remove(item)
+
+        self._dirty_items.difference_update(removed)
+        self._dirty_matrix_items.difference_update(removed)
+        if self._matrix_store is not None:
+            for item in items:
+                self._matrix_store.discard(item)
+        self._update_views(removed_items=items)
+        for item in items:
+            self._item_bounds.pop(item, None)
+        if self._spatial_index is not None:
+            for item in items:
+                self._spatial_index.remove(item)
+
+
+    @observed
+    def _add_many(self, items, parents, indices, connections):
+        """
+        Inverse of `_remove_many()`: add ``items`` at their (old) position
+        and restore their ``connections``.
+        """
+        with self.batch():
+            add = self.add
+            for item, parent, index in zip(items, parents, indices):
+                add(item, parent, index)
+            connect_item = self.connect_item
+            for cinfo in connections:
+                connect_item(*cinfo)
+
+    reversible_pair(_add_many, _remove_many,
+                    bind1={'parents': lambda self, items: map(self.get_parent, items),
+                           'indices': lambda self, items: map(self._tree.get_sibling_index, items),
+                           'connections': lambda self, items: self._get_connections_to_items(items) })
+
+
     @observed
     def reparent(self, item, parent, index=None):
         """
@@ -169,8 +362,6 @@ class Canvas(object):
         """
         self._tree.reparent(item, parent, index)
 
-        self._dirty_index = True
-
     reversible_method(reparent, reverse=reparent,
                       bind={'parent': lambda self, item: self.get_parent(item),
                             'index': lambda self, item: self._tree.get_siblings(item).index(item) })
@@ -192,6 +383,33 @@ class Canvas(object):
         return self._tree.nodes
 
 
+    def get_all_items_view(self):
+        """
+        Get a read-only view on all items, without copying the list of
+        items (see `tree.NodesView`). The view can be used as long as no
+        items are added, removed or reparented.
+
+        >>> c = Canvas()
+        >>> from gaphas import item
+        >>> i = item.Item()
+        >>> c.add(i)
+        >>> items = c.get_all_items_view()
+        >>> len(items), i in items, items[0] is i
+        (1, True, True)
+        >>> items.changed
+        False
+        >>> c.remove(i)
+        >>> items.changed
+        True
+        """
+        return self._tree.get_nodes_view()
+
+
+    generation = property(lambda s: s._tree.generation,
+                          doc="Incremented each time items are added, removed "
+                              "or reparented.")
+
+
     def get_root_items(self):
         """
         Return the root items of the canvas.
@@ -249,6 +467,24 @@ class Canvas(object):
         return self._tree.get_ancestors(item)
 
 
+    def is_ancestor(self, ancestor, item):
+        """
+        See `tree.Tree.is_ancestor()`.
+
+        >>> c = Canvas()
+        >>> from gaphas import item
+        >>> i = item.Item()
+        >>> c.add(i)
+        >>> ii = item.Item()
+        >>> c.add(ii, i)
+        >>> c.is_ancestor(i, ii)
+        True
+        >>> c.is_ancestor(ii, i)
+        False
+        """
+        return self._tree.is_ancestor(ancestor, item)
+
+
     def get_children(self, item):
         """
         See `tree.Tree.get_children()`.
@@ -356,6 +592,25 @@ class Canvas(object):
     reversible_pair(connect_item, _disconnect_item)
 
 
+    def _get_connections_to_items(self, items):
+        """
+        Return the connections from and to ``items``.
+        """
+        query = self._connections.query
+        connections = []
+        seen = set()
+        for item in items:
+            for cinfo in query(item=item):
+                if cinfo not in seen:
+                    seen.add(cinfo)
+                    connections.append(cinfo)
+            for cinfo in query(connected=item):
+                if cinfo not in seen:
+                    seen.add(cinfo)
+                    connections.append(cinfo)
+        return connections
+
+
     def remove_connections_to_item(self, item):
         """
         Remove all connections (handles connected to and constraints)
@@ -509,14 +764,14 @@ class Canvas(object):
         >>> c.add(i2)
         >>> i3 = item.Line()
         >>> c.add (i3)
-        >>> c.update() # ensure items are indexed
-        >>> i1._canvas_index
-        0
         >>> s = c.sort([i2, i3, i1])
         >>> s[0] is i1 and s[1] is i2 and s[2] is i3
         True
+
+        The tree keeps track of the order of the items, no indexing is
+        needed.
         """
-        return self._tree.sort(items, index_key='_canvas_index', reverse=reverse)
+        return self._tree.sort(items, reverse=reverse)
 
 
     def get_matrix_i2c(self, item, calculate=False):
@@ -532,7 +787,11 @@ class Canvas(object):
             yet. Note that out-of-date matrices are not recalculated.
         """
         if item._matrix_i2c is None or calculate:
-            self.update_matrix(item)
+            store = self._matrix_store
+            if not calculate and store is not None and item in store:
+                item._matrix_i2c = store.get_i2c(item)
+            else:
+                self.update_matrix(item)
         return item._matrix_i2c
 
 
@@ -542,7 +801,11 @@ class Canvas(object):
         See `get_matrix_i2c()`.
         """
         if item._matrix_c2i is None or calculate:
-            self.update_matrix(item)
+            store = self._matrix_store
+            if not calculate and store is not None and item in store:
+                item._matrix_c2i = store.get_c2i(item)
+            else:
+                self.update_matrix(item)
         return item._matrix_c2i
 
     def get_matrix_i2i(self, from_item, to_item, calculate=False):
@@ -556,9 +819,12 @@ class Canvas(object):
         
 
     @observed
-    def request_update(self, item, update=True, matrix=True):
+    def request_update(self, item, update=True, matrix=True, kind=None):
         """
-        Set an update request for the item. 
+        Set an update request for the item. ``kind`` tells what has
+        changed: a combination of ``APPEARANCE``, ``MATRIX`` and
+        ``GEOMETRY``. If no ``kind`` is provided, ``update`` stands for
+        ``GEOMETRY`` and ``matrix`` for ``MATRIX``.
 
         >>> c = Canvas()
         >>> from gaphas import item
@@ -571,13 +837,28 @@ class Canvas(object):
         >>> c.update_now()
         >>> len(c._dirty_items)
         0
+
+        Appearance-only changes, like a different color, do not need a
+        canvas update. The item is just repainted by the views:
+
+        >>> with c.batch():
+        ...     c.request_update(i, kind=APPEARANCE)
+        ...     len(c._dirty_items), len(c._dirty_matrix_items)
+        (0, 0)
         """
-        if update:
+        if kind is None:
+            kind = (update and GEOMETRY or 0) | (matrix and MATRIX or 0)
+        if kind & GEOMETRY:
             self._dirty_items.add(item)
-        if matrix:
+        if kind & MATRIX:
             self._dirty_matrix_items.add(item)
 
-        self.update()
+        if kind & (GEOMETRY | MATRIX):
+            if not self._batch_level:
+                self.update()
+        elif kind & APPEARANCE:
+            for v in self._registered_views:
+                v.queue_draw_item(item)
 
     reversible_method(request_update, reverse=request_update)
 
@@ -630,9 +911,10 @@ class Canvas(object):
             item.post_update(c)
 
 
-    def _extend_dirty_items(self, dirty_items):
+    def _extend_dirty_items(self, dirty_items, requested_items):
         # item's can be marked dirty due to external constraints solving
         if self._dirty_items:
+            requested_items.update(self._dirty_items)
             dirty_items.extend(self._dirty_items)
             self._dirty_items.clear()
 
@@ -644,16 +926,13 @@ class Canvas(object):
         Peform an update of the items that requested an update.
         """
 
-        if self._dirty_index:
-            self.update_index()
-            self._dirty_index = False
-
         sort = self.sort
         extend_dirty_items = self._extend_dirty_items
 
         # perform update requests for parents of dirty items
         dirty_items = self._dirty_items
-        for item in set(dirty_items):
+        requested_items = set(dirty_items)
+        for item in requested_items:
             dirty_items.update(self._tree.get_ancestors(item))
 
         # order the dirty items, so they are updated bottom to top
@@ -678,7 +957,7 @@ class Canvas(object):
             assert not self._dirty_matrix_items, 'No matrices may have been marked dirty (%s)' % (self._dirty_matrix_items,)
 
             # item's can be marked dirty due to external constraints solving
-            extend_dirty_items(dirty_items)
+            extend_dirty_items(dirty_items, requested_items)
 
             assert not self._dirty_items, 'No items may have been marked dirty (%s)' % (self._dirty_items,)
 
@@ -693,7 +972,7 @@ class Canvas(object):
             self._solver.solve()
 
             # item's can be marked dirty due to normalization and solving
-            extend_dirty_items(dirty_items)
+            extend_dirty_items(dirty_items, requested_items)
 
             assert not self._dirty_items, 'No items may have been marked dirty (%s)' % (self._dirty_items,)
 
@@ -705,7 +984,18 @@ class Canvas(object):
         assert len(self._dirty_items) == 0 and len(self._dirty_matrix_items) == 0, \
                 'dirty: %s; matrix: %s' % (self._dirty_items, self._dirty_matrix_items)
 
-        self._update_views(dirty_items, dirty_matrix_items)
+        # Bounds reported by the views are out of date
+        item_bounds = self._item_bounds
+        for item in dirty_items:
+            item_bounds.pop(item, None)
+
+        # Views mark the old bounds of the items for redraw
+        self._update_views(dirty_items, dirty_matrix_items,
+                           requested_items=requested_items)
+
+        if self._spatial_index is not None:
+            self._update_spatial_index(dirty_items)
+            self._update_spatial_index(dirty_matrix_items)
 
 
     def update_matrices(self, items):
@@ -715,6 +1005,9 @@ class Canvas(object):
 
         Return items, which matrices were recalculated.
         """
+        if self.columnar_matrices and matrixstore.numpy is not None:
+            return self._update_matrices_columnar(items)
+
         changed = set()
         for item in items:
             parent = self._tree.get_parent(item)
@@ -732,6 +1025,51 @@ class Canvas(object):
         return changed
 
 
+    def _update_matrices_columnar(self, items):
+        """
+        Recalculate the matrices of the items and their children in the
+        matrix store. The matrices of the items are cleared, they're
+        created again when they are asked for.
+        """
+        tree = self._tree
+        is_ancestor = tree.is_ancestor
+        get_parent = tree.get_parent
+
+        # The dirty subtrees, each a slice of the depth-first nodes list
+        nodes = []
+        top = None
+        for item in tree.sort(items):
+            if top is not None and is_ancestor(top, item):
+                continue
+            top = item
+            nodes.append(item)
+            nodes.extend(tree.get_all_children(item))
+
+        positions = {}
+        parents = []
+        bases = {}
+        for i, item in enumerate(nodes):
+            positions[item] = i
+            parent = get_parent(item)
+            if parent is None:
+                parents.append(-1)
+            elif parent in positions:
+                parents.append(positions[parent])
+            else:
+                parents.append(-1)
+                bases[i] = self.get_matrix_i2c(parent)
+
+        store = self._matrix_store
+        if store is None:
+            store = self._matrix_store = matrixstore.MatrixStore(Matrix)
+        store.update(nodes, [tuple(item.matrix) for item in nodes], parents, bases)
+
+        for item in nodes:
+            item._matrix_i2c = None
+            item._matrix_c2i = None
+        return set(nodes)
+
+
     def update_matrix(self, item, parent=None):
         """
         Update matrices of an item.
@@ -744,11 +1082,12 @@ class Canvas(object):
         item._matrix_i2c = Matrix(*item.matrix)
 
         if parent is not None:
+            parent_i2c = self.get_matrix_i2c(parent)
             try:
-                item._matrix_i2c = item._matrix_i2c.multiply(parent._matrix_i2c)
+                item._matrix_i2c = item._matrix_i2c.multiply(parent_i2c)
             except AttributeError:
                 # Fall back to old behaviour
-                item._matrix_i2c *= parent._matrix_i2c
+                item._matrix_i2c *= parent_i2c
 
         if orig_matrix_i2c is None or orig_matrix_i2c != item._matrix_i2c:
             # calculate c2i matrix and view matrices
@@ -812,10 +1151,144 @@ class Canvas(object):
         return dirty_matrix_items
 
 
+    def _get_spatial_index(self):
+        """
+        Return the spatial index. It's created when it is asked for
+        the first time.
+        """
+        index = self._spatial_index
+        if index is None:
+            index = self._spatial_index = SpatialIndex()
+            self._update_spatial_index(self._tree.get_nodes_view())
+        return index
+
+
+    def _update_spatial_index(self, items):
+        """
+        Store the bounds of ``items``, in canvas coordinates, in the
+        spatial index.
+        """
+        add = self._spatial_index.add
+        item_bounds = self._item_bounds
+        get_matrix_i2c = self.get_matrix_i2c
+        for item in items:
+            try:
+                bounds = item_bounds[item]
+            except KeyError:
+                # Nothing painted yet: use the handles instead
+                bounds = self._get_handle_bounds(item)
+            add(item, rectangle_transform(get_matrix_i2c(item), bounds))
+
+
+    def _get_handle_bounds(self, item):
+        """
+        Return the rectangle around the handles of ``item``, in item
+        coordinates.
+        """
+        points = [map(float, h.pos) for h in item.handles()]
+        if not points:
+            return (0, 0, 0, 0)
+        xs, ys = zip(*points)
+        x0, y0 = min(xs), min(ys)
+        return (x0, y0, max(xs) - x0, max(ys) - y0)
+
+
+    def set_item_bounds(self, item, bounds):
+        """
+        Set the bounds of ``item``, in item coordinates. This method is
+        called by the views, with the bounds of what is actually painted.
+        Until then, the bounds of the item's handles are used.
+        """
+        self._item_bounds[item] = bounds
+        if self._spatial_index is not None:
+            self._update_spatial_index((item,))
+
+
+    def get_item_bounds(self, item):
+        """
+        Get the bounds of ``item`` in canvas coordinates.
+
+        >>> from gaphas.item import Element
+        >>> c = Canvas()
+        >>> e = Element()
+        >>> e.matrix.translate(10, 10)
+        >>> c.add(e)
+        >>> c.get_item_bounds(e)
+        (10.0, 10.0, 10.0, 10.0)
+        """
+        return self._get_spatial_index().get_bounds(item)
+
+
+    def get_bounds(self):
+        """
+        Get the bounds of all items in canvas coordinates.
+
+        >>> from gaphas.item import Element
+        >>> c = Canvas()
+        >>> e1, e2 = Element(), Element()
+        >>> e2.matrix.translate(100, 0)
+        >>> c.add_many([(e1, None), (e2, None)])
+        >>> c.get_bounds()
+        (0.0, 0.0, 110.0, 10.0)
+        """
+        return self._get_spatial_index().soft_bounds
+
+
+    def find_intersect(self, rect):
+        """
+        Find the items whose bounds intersect with rectangle ``rect``
+        ``(x, y, width, height)``, in canvas coordinates. Returns a set.
+
+        >>> from gaphas.item import Element
+        >>> c = Canvas()
+        >>> e = Element()
+        >>> e.matrix.translate(10, 10)
+        >>> c.add(e)
+        >>> c.find_intersect((0, 0, 15, 15)) == set([e])
+        True
+        >>> e.matrix.translate(10, 10)
+        >>> c.request_matrix_update(e)
+        >>> c.find_intersect((0, 0, 15, 15))
+        set([])
+        """
+        return self._get_spatial_index().find_intersect(rect)
+
+
+    def find_inside(self, rect):
+        """
+        Find the items whose bounds are inside rectangle ``rect``, in
+        canvas coordinates. Returns a set.
+        """
+        return self._get_spatial_index().find_inside(rect)
+
+
+    def find_nearest(self, pos, distance=None):
+        """
+        Find the item nearest to ``pos``, in canvas coordinates, by its
+        bounds. If several items are at the same distance, the topmost
+        item is returned. If ``distance`` is provided, only items within
+        that distance are considered. Returns ``None`` if no item is
+        found.
+
+        >>> from gaphas.item import Element
+        >>> c = Canvas()
+        >>> e1, e2 = Element(), Element()
+        >>> e2.matrix.translate(100, 0)
+        >>> c.add_many([(e1, None), (e2, None)])
+        >>> c.find_nearest((80, 0)) is e2
+        True
+        >>> c.find_nearest((80, 0), distance=5)
+        """
+        items = self._get_spatial_index().find_nearest(pos, distance)
+        if items:
+            return self.sort(items, reverse=True)[0]
+        return None
+
+
     def update_index(self):
         """
-        Provide each item in the canvas with an index attribute. This makes
-        for fast searching of items.
+        Provide each item in the canvas with an index attribute
+        (``_canvas_index``). Sorting does not depend on it (see ``sort()``).
         """
         self._tree.index_nodes('_canvas_index')
 
@@ -836,12 +1309,16 @@ class Canvas(object):
         self._registered_views.discard(view)
 
 
-    def _update_views(self, dirty_items=(), dirty_matrix_items=(), removed_items=()):
+    def _update_views(self, dirty_items=(), dirty_matrix_items=(), removed_items=(),
+                      requested_items=None):
         """
         Send an update notification to all registered views.
+        ``requested_items`` are the dirty items that requested an update
+        themselves, rather than being updated as ancestor of one.
         """
         for v in self._registered_views:
-            v.request_update(dirty_items, dirty_matrix_items, removed_items)
+            v.request_update(dirty_items, dirty_matrix_items, removed_items,
+                             requested_items)
 
 
     def _obtain_cairo_context(self):
@@ -873,7 +1350,9 @@ class Canvas(object):
         Persist canvas. Dirty item sets and views are not saved.
         """
         d = dict(self.__dict__)
-        for n in ('_dirty_items', '_dirty_matrix_items', '_dirty_index', '_registered_views'):
+        for n in ('_dirty_items', '_dirty_matrix_items', '_batch_level',
+                  '_batch_items', '_matrix_store', '_spatial_index', '_item_bounds',
+                  '_registered_views'):
             try:
                 del d[n]
             except KeyError:
@@ -890,7 +1369,11 @@ class Canvas(object):
         self.__dict__.update(state)
         self._dirty_items = set(self._tree.nodes)
         self._dirty_matrix_items = set(self._tree.nodes)
-        self._dirty_index = True
+        self._batch_level = 0
+        self._batch_items = []
+        self._matrix_store = None
+        self._spatial_index = None
+        self._item_bounds = {}
         self._registered_views = set()
         #self.update()
 
@@ -33,6 +33,11 @@ import operator
 import math
 from solver import Projection
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 __version__ = "$Revision$"
 # $HeadURL$
@@ -46,14 +51,45 @@ def _update(variable, value):
         variable.value = value
 
 
+def _values(variables):
+    """
+    Return the values of a list of variables as array.
+    """
+    return numpy.fromiter((v.value for v in variables), float, len(variables))
+
+
+def _update_all(variables, values):
+    """
+    Batch version of `_update()`.
+    """
+    current = _values(variables)
+    for i in numpy.flatnonzero(numpy.abs(current - values) > EPSILON):
+        variables[i].value = float(values[i])
+
+
+def batch_kernel(func):
+    """
+    Decorator for `Constraint.solve_batch()` implementations. Batch kernels
+    depend on NumPy. If NumPy is not available, no kernel is defined.
+    """
+    if numpy is None:
+        return None
+    return staticmethod(func)
+
+
 class Constraint(object):
     """
     Constraint base class.
 
     - _variables - list of all variables
     - _weakest   - list of weakest variables
+
+    Constraint classes can provide a batch kernel ``solve_batch(constraints)``,
+    that solves a list of independent constraints of that class in one go.
     """
-    disabled = False
+    _disabled = False
+
+    solve_batch = None
 
     def __init__(self, *variables):
         """
@@ -68,6 +104,18 @@ class Constraint(object):
 
         # Used by the Solver for efficiency
         self._solver_has_projections = False 
+        self._solver_variables = ()
+
+
+    def _set_disabled(self, disabled):
+        self._disabled = disabled
+        # Compiled constraint networks have to leave it out (or in)
+        for v in self._solver_variables:
+            if v._solver:
+                v._solver._revision += 1
+                break
+
+    disabled = property(lambda s: s._disabled, _set_disabled)
 
 
     def create_weakest_list(self):
@@ -95,6 +143,18 @@ class Constraint(object):
         return self._weakest[0]
 
 
+    def outputs(self):
+        """
+        Return the variables that may be changed when the constraint is
+        solved. The solver uses this to find out which constraints depend
+        on each other.
+
+        By default all variables are considered, subclasses can narrow
+        this down.
+        """
+        return self._variables
+
+
     def mark_dirty(self, v):
         """
         Mark variable v dirty and if possible move it to the end of
@@ -151,6 +211,10 @@ class EqualsConstraint(Constraint):
         self._delta = delta
 
 
+    def outputs(self):
+        return self._weakest
+
+
     def solve_for(self, var):
         assert var in (self.a, self.b)
 
@@ -159,6 +223,28 @@ class EqualsConstraint(Constraint):
                 (self.b, self.a.value + self._delta)))
 
 
+    @batch_kernel
+    def solve_batch(constraints):
+        """
+        >>> from solver import Variable
+        >>> a, b, c, d = Variable(1.0), Variable(2.0), Variable(3.0), Variable(4.0)
+        >>> EqualsConstraint.solve_batch([EqualsConstraint(a, b), EqualsConstraint(c, d, 1.0)])
+        >>> a, b, c, d
+        (Variable(2, 20), Variable(2, 20), Variable(5, 20), Variable(4, 20))
+        """
+        targets = []
+        sources = []
+        for c in constraints:
+            if c.weakest() is c.a:
+                targets.append(c.a)
+                sources.append(c.b)
+            else:
+                targets.append(c.b)
+                sources.append(c.a)
+        deltas = numpy.fromiter((c._delta for c in constraints), float, len(constraints))
+        _update_all(targets, _values(sources) + deltas)
+
+
 
 class CenterConstraint(Constraint):
     """
@@ -189,6 +275,10 @@ class CenterConstraint(Constraint):
         self.center = center
 
 
+    def outputs(self):
+        return (self.center,)
+
+
     def solve_for(self, var):
         assert var in (self.a, self.b, self.center)
 
@@ -238,6 +328,27 @@ class LessThanConstraint(Constraint):
                 self.smaller.value = self.bigger.value - self.delta
 
 
+    @batch_kernel
+    def solve_batch(constraints):
+        """
+        >>> from solver import Variable
+        >>> a, b, c, d = Variable(3.0), Variable(2.0), Variable(1.0), Variable(4.0)
+        >>> LessThanConstraint.solve_batch([LessThanConstraint(a, b), LessThanConstraint(c, d)])
+        >>> a, b, c, d
+        (Variable(3, 20), Variable(3, 20), Variable(1, 20), Variable(4, 20))
+        """
+        smaller = _values([c.smaller for c in constraints])
+        bigger = _values([c.bigger for c in constraints])
+        delta = numpy.fromiter((c.delta for c in constraints), float, len(constraints))
+        for i in numpy.flatnonzero(smaller > bigger - delta):
+            c = constraints[i]
+            var = c.weakest()
+            if var is c.smaller:
+                c.bigger.value = float(smaller[i] + delta[i])
+            elif var is c.bigger:
+                c.smaller.value = float(bigger[i] - delta[i])
+
+
 
 # Constants for the EquationConstraint
 ITERLIMIT = 1000        # iteration limit
@@ -261,15 +372,41 @@ class EquationConstraint(Constraint):
     >>> b
     Variable(1.6, 20)
 
+    The equation is solved with Newton's method. The slope found for an
+    argument is kept as starting point for the next time. Arguments the
+    equation is linear in are detected the first time they are solved for;
+    from then on they are solved in one step with the kept slope, without
+    probing the equation. The total number of steps taken is kept in
+    ``iterations``:
+
+    >>> cons.iterations
+    2
+    >>> b.value = 2
+    >>> cons.solve_for(b)
+    >>> b
+    Variable(1.6, 20)
+    >>> cons.iterations
+    3
+
+    An analytic derivative (see `set_derivative()`) or an inverse function
+    (see `set_inverse()`) can be provided per argument.
+
     From: http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/303396
     """
     
     def __init__(self, f, **args):
         super(EquationConstraint, self).__init__(*args.values())
         self._f = f
+        self._names = f.func_code.co_varnames[0:f.func_code.co_argcount]
+        # argument name -> derivative, inverse, last slope and linearity
+        self._derivatives = {}
+        self._inverses = {}
+        self._slopes = {}
+        self._linear = {}
+        self.iterations = 0
         self._args = {}
         # see important note on order of operations in __setattr__ below.
-        for arg in f.func_code.co_varnames[0:f.func_code.co_argcount]:
+        for arg in self._names:
             self._args[arg] = None
         self._set(**args)
 
@@ -287,6 +424,9 @@ class EquationConstraint(Constraint):
         """
         Used to extract function argument values.
         """
+        if name.startswith('__'):
+            # Special methods, e.g. looked up by pickle
+            raise AttributeError, name
         self._args[name]
         return self.solve_for(name)
 
@@ -319,67 +459,125 @@ class EquationConstraint(Constraint):
             setattr(self, arg, args[arg])
 
 
+    def set_derivative(self, arg, df):
+        """
+        Set the derivative of the equation to argument ``arg``. ``df``
+        takes the same arguments as the equation.
+
+        >>> from solver import Variable
+        >>> a, b = Variable(1), Variable(2)
+        >>> cons = EquationConstraint(lambda a, b: a * a - b, a=a, b=b)
+        >>> cons.set_derivative('a', lambda a, b: 2 * a)
+        >>> cons.solve_for(a)
+        >>> a
+        Variable(1.41421, 20)
+        """
+        self._args[arg]  # raise exception if arg not in _args
+        self._derivatives[arg] = df
+
+
+    def set_inverse(self, arg, inverse):
+        """
+        Set the inverse of the equation for argument ``arg``: ``inverse``
+        takes the same arguments as the equation and returns the value for
+        ``arg`` that solves the equation.
+
+        >>> from solver import Variable
+        >>> a, b = Variable(), Variable(2)
+        >>> cons = EquationConstraint(lambda a, b: a * a - b, a=a, b=b)
+        >>> cons.set_inverse('a', lambda a, b: -b ** .5)
+        >>> cons.solve_for(a)
+        >>> a
+        Variable(-1.41421, 20)
+        >>> cons.iterations
+        1
+        """
+        self._args[arg]  # raise exception if arg not in _args
+        self._inverses[arg] = inverse
+
+
+    def outputs(self):
+        return self._weakest
+
+
     def solve_for(self, var):
         """
         Solve this constraint for the variable named 'arg' in the
         constraint.
         """
-        args = {}
-        for nm, v in self._args.items():
-            args[nm] = v.value
-            if v is var: arg = nm
-        v = self._solve_for(arg, args) 
+        args = self._args
+        values = []
+        for nm in self._names:
+            v = args[nm]
+            if v is var:
+                i = len(values)
+            values.append(v.value)
+        v = self._solve_for(i, values)
         if var.value != v:
             var.value = v
 
 
-    def _solve_for(self, arg, args):
+    def _solve_for(self, i, values):
         """
-        Newton's method solver
+        Newton's method solver. Find the value for argument ``i`` of the
+        equation that makes it 0, the other arguments are taken from
+        ``values``.
         """
-        #args = self._args
-        close_runs = 10   # after getting close, do more passes
-        if args[arg]:
-            x0 = args[arg]
-        else:
-            x0 = 1
-        if x0 == 0:
-            x1 = 1
-        else:
-            x1 = x0*1.1
+        arg = self._names[i]
+        func = self._f
+        inverse = self._inverses.get(arg)
+        if inverse:
+            self.iterations += 1
+            return inverse(*values)
+
         def f(x):
             """function to solve"""
-            args[arg] = x
-            return self._f(**args)
+            values[i] = x
+            return func(*values)
+
+        df = self._derivatives.get(arg)
+        linear = self._linear.get(arg)
+        x0 = values[i]
         fx0 = f(x0)
+        if abs(fx0) < EPSILON:
+            return x0
+
+        if df:
+            slope = df(*values)
+        elif arg in self._slopes:
+            # The exact slope for linear equations, a warm start from the
+            # previous solution otherwise
+            slope = self._slopes[arg]
+        else:
+            # Probe the slope, use a power of two step to limit rounding
+            x1 = x0 + math.ldexp(1.0, max(0, math.frexp(x0)[1]) - 4)
+            slope = (f(x1) - fx0) / (x1 - x0)
+
         n = 0
+        x1, fx1 = x0, fx0
         while 1:                    # Newton's method loop here
+            if slope == 0:
+                print 'Zero slope and not close enough to solution'
+                break
+            x1 = x0 - fx0 / slope
             fx1 = f(x1)
-            if fx1 == 0 or x1 == x0:  # managed to nail it exactly
+            n += 1
+            if abs(fx1) < EPSILON or abs(x1 - x0) < EPSILON:
                 break
-            if abs(fx1-fx0) < EPSILON:    # very close
-                close_flag = True
-                if close_runs == 0:       # been close several times
-                    break
-                else:
-                    close_runs -= 1       # try some more
-            else:
-                close_flag = False
             if n > ITERLIMIT:
                 print "Failed to converge; exceeded iteration limit"
                 break
-            slope = (fx1 - fx0) / (x1 - x0)
-            if slope == 0:
-                if close_flag:  # we're close but have zero slope, finish
-                    break
-                else:
-                    print 'Zero slope and not close enough to solution'
-                    break
-            x2 = x0 - fx0 / slope           # New 'x1'
-            fx0 = fx1
-            x0 = x1
-            x1 = x2
-            n += 1
+            if df:
+                slope = df(*values)
+            else:
+                slope = (fx1 - fx0) / (x1 - x0)
+            x0, fx0 = x1, fx1
+
+        if linear is None and not df:
+            # A single step from a probed slope nails linear equations
+            self._linear[arg] = n == 1 and abs(fx1) < EPSILON
+        self._slopes[arg] = slope
+        self.iterations += n
         return x1
 
 
@@ -432,6 +630,10 @@ class BalanceConstraint(Constraint):
             self.balance = 0
 
 
+    def outputs(self):
+        return self._weakest
+
+
     def solve_for(self, var):
         b1, b2 = self.band
         w = b2.value - b1.value
@@ -487,6 +689,10 @@ class LineConstraint(Constraint):
         except ZeroDivisionError:
             self.ratio_y = 0.0
 
+
+    def outputs(self):
+        return self._point
+
         
     def solve_for(self, var=None):
         self._solve()
@@ -521,6 +727,29 @@ class LineConstraint(Constraint):
         _update(py, y)
 
 
+    @batch_kernel
+    def solve_batch(constraints):
+        """
+        Batch version of `LineConstraint._solve()`.
+
+        >>> from gaphas.solver import Variable
+        >>> line = (Variable(0), Variable(0)), (Variable(30), Variable(20))
+        >>> point = (Variable(15), Variable(4))
+        >>> lc = LineConstraint(line=line, point=point)
+        >>> line[1][0].value = 40
+        >>> line[1][1].value =  30
+        >>> LineConstraint.solve_batch([lc])
+        >>> point
+        (Variable(20, 20), Variable(6, 20))
+        """
+        sx, sy, ex, ey = _line_values(constraints)
+        ratio_x = numpy.fromiter((c.ratio_x for c in constraints), float, len(constraints))
+        ratio_y = numpy.fromiter((c.ratio_y for c in constraints), float, len(constraints))
+
+        _update_all([c._point[0] for c in constraints], sx + (ex - sx) * ratio_x)
+        _update_all([c._point[1] for c in constraints], sy + (ey - sy) * ratio_y)
+
+
 
 class PositionConstraint(Constraint):
     """
@@ -538,6 +767,10 @@ class PositionConstraint(Constraint):
         self._origin = origin
         self._point = point
 
+
+    def outputs(self):
+        return self._point
+
         
     def solve_for(self, var=None):
         """
@@ -585,6 +818,10 @@ class LineAlignConstraint(Constraint):
         self._align = align
         self._delta = delta
 
+
+    def outputs(self):
+        return self._point
+
         
     def solve_for(self, var=None):
         sx, sy = self._line[0]
@@ -599,4 +836,39 @@ class LineAlignConstraint(Constraint):
         _update(py, y)
 
 
+    @batch_kernel
+    def solve_batch(constraints):
+        """
+        >>> from gaphas.solver import Variable
+        >>> line = (Variable(0), Variable(0)), (Variable(30), Variable(20))
+        >>> point = (Variable(15), Variable(4))
+        >>> lac = LineAlignConstraint(line=line, point=point, align=0.5)
+        >>> LineAlignConstraint.solve_batch([lac])
+        >>> point
+        (Variable(15, 20), Variable(10, 20))
+        """
+        n = len(constraints)
+        sx, sy, ex, ey = _line_values(constraints)
+        align = numpy.fromiter((c._align for c in constraints), float, n)
+        delta = numpy.fromiter((c._delta for c in constraints), float, n)
+        a = numpy.arctan2(ey - sy, ex - sx)
+
+        _update_all([c._point[0] for c in constraints],
+                sx + (ex - sx) * align + delta * numpy.cos(a))
+        _update_all([c._point[1] for c in constraints],
+                sy + (ey - sy) * align + delta * numpy.sin(a))
+
+
+def _line_values(constraints):
+    """
+    Return the coordinates of the lines of a list of line based constraints
+    as arrays (sx, sy, ex, ey).
+    """
+    lines = [c._line for c in constraints]
+    return (_values([l[0][0] for l in lines]),
+            _values([l[0][1] for l in lines]),
+            _values([l[1][0] for l in lines]),
+            _values([l[1][1] for l in lines]))
+
+
 # vim:sw=4:et:ai
@@ -14,7 +14,7 @@ See: http://stevehanov.ca/blog/index.php?id=33 and
 
 from math import sqrt
 from random import Random
-from painter import Context
+from painter import Context, invalidate
 
 
 class FreeHandCairoContext(object):
@@ -166,5 +166,8 @@ class FreeHandPainter(object):
         subcontext = Context(cairo=FreeHandCairoContext(context.cairo, self.sloppiness), items=context.items, area=context.area)
         self.subpainter.paint(subcontext)
 
+    def invalidate(self, items):
+        invalidate(self.subpainter, items)
+
 
 # vi:sw=4:et:ai
@@ -587,4 +587,58 @@ def rectangle_clip(recta, rectb):
     return (x, y, w, h)
 
 
+def rectangle_transform(matrix, rect):
+    """
+    Return the bounding box of rectangle ``rect``, transformed by
+    ``matrix`` (e.g. a ``cairo.Matrix``).
+
+    >>> class Matrix(object):
+    ...     def transform_point(self, x, y):
+    ...         return -y, x * 2
+    >>> rectangle_transform(Matrix(), (0, 0, 10, 20))
+    (-20, 0, 20, 20)
+    """
+    transform_point = matrix.transform_point
+    x, y, w, h = rect
+    xs, ys = zip(transform_point(x, y), transform_point(x + w, y),
+                 transform_point(x, y + h), transform_point(x + w, y + h))
+    x0, y0 = min(xs), min(ys)
+    return (x0, y0, max(xs) - x0, max(ys) - y0)
+
+
+def rectangle_merge(rects, max_count=16):
+    """
+    Return a list of rectangles covering the rectangles ``rects``. Two
+    rectangles are merged if their union is not larger than their areas
+    together, e.g. if they overlap. At most ``max_count`` rectangles are
+    returned: beyond that, the rectangles whose union grows the least are
+    merged.
+
+    >>> rects = [(0, 0, 10, 10), (0, 5, 10, 10), (100, 100, 10, 10)]
+    >>> rectangle_merge(rects)
+    [(0, 0, 10, 15), (100, 100, 10, 10)]
+    >>> rectangle_merge(rects, max_count=1)
+    [(0, 0, 110, 110)]
+    """
+    result = []
+    for rect in rects:
+        x, y, w, h = rect
+        merged = True
+        while merged and result:
+            merged = False
+            best = None
+            for i, (ox, oy, ow, oh) in enumerate(result):
+                ux, uy = min(x, ox), min(y, oy)
+                uw, uh = max(x + w, ox + ow) - ux, max(y + h, oy + oh) - uy
+                growth = uw * uh - w * h - ow * oh
+                if best is None or growth < best[0]:
+                    best = growth, i, (ux, uy, uw, uh)
+            if best[0] <= 0 or len(result) >= max_count:
+                del result[best[1]]
+                x, y, w, h = best[2]
+                merged = True
+        result.append((x, y, w, h))
+    return result
+
+
 # vim:sw=4:et:ai
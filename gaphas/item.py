@@ -113,9 +113,14 @@ class Item(object):
     matrix = reversible_property(lambda s: s._matrix, _set_matrix)
 
 
-    def request_update(self, update=True, matrix=True):
+    def request_update(self, update=True, matrix=True, kind=None):
+        """
+        Request an update from the canvas. See
+        `canvas.Canvas.request_update()`.
+        """
         if self._canvas:
-            self._canvas.request_update(self, update=update, matrix=matrix)
+            self._canvas.request_update(self, update=update, matrix=matrix,
+                                        kind=kind)
 
 
     def pre_update(self, context):
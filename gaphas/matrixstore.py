@@ -0,0 +1,226 @@
+"""
+Columnar storage for the item to canvas matrices of a canvas.
+
+The matrices are kept in two N x 6 NumPy arrays: one for the item to canvas
+(``i2c``) matrices and one for their inverses (``c2i``). Each item has a
+row in both arrays. The values are ordered like the arguments of
+``cairo.Matrix``: ``(xx, yx, xy, yy, x0, y0)``.
+
+Matrices of whole subtrees of items are composed in a few vectorized
+steps: one for each level in the subtree. All inverses are calculated in
+one go. Matrix objects are only created when they are asked for.
+
+NumPy is required to use a `MatrixStore`.
+"""
+
+__version__ = "$Revision$"
+# $HeadURL$
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+
+def multiply(a, b):
+    """
+    Multiply the rows of two N x 6 arrays of affine matrices, like
+    ``cairo.Matrix.multiply()``: the transformation of ``a`` is applied
+    first, then the transformation of ``b``.
+
+    >>> a = numpy.array([[2.0, 0.0, 0.0, 2.0, 1.0, 0.0]])
+    >>> b = numpy.array([[1.0, 0.0, 0.0, 1.0, 0.0, 5.0]])
+    >>> multiply(a, b).tolist()
+    [[2.0, 0.0, 0.0, 2.0, 1.0, 5.0]]
+    >>> multiply(b, a).tolist()
+    [[2.0, 0.0, 0.0, 2.0, 1.0, 10.0]]
+    """
+    axx, ayx, axy, ayy, ax0, ay0 = a.T
+    bxx, byx, bxy, byy, bx0, by0 = b.T
+    return numpy.column_stack((
+        axx * bxx + ayx * bxy,
+        axx * byx + ayx * byy,
+        axy * bxx + ayy * bxy,
+        axy * byx + ayy * byy,
+        ax0 * bxx + ay0 * bxy + bx0,
+        ax0 * byx + ay0 * byy + by0))
+
+
+def invert(m):
+    """
+    Invert the rows of an N x 6 array of affine matrices. Rows that can
+    not be inverted end up as ``nan`` or ``inf`` values.
+
+    >>> m = numpy.array([[2.0, 0.0, 0.0, 4.0, 2.0, 4.0]])
+    >>> invert(m).tolist()
+    [[0.5, -0.0, -0.0, 0.25, -1.0, -1.0]]
+    >>> multiply(m, invert(m)).tolist()
+    [[1.0, 0.0, 0.0, 1.0, 0.0, 0.0]]
+    """
+    xx, yx, xy, yy, x0, y0 = m.T
+    old = numpy.seterr(divide='ignore', invalid='ignore')
+    try:
+        det = xx * yy - yx * xy
+        return numpy.column_stack((
+            yy / det,
+            -yx / det,
+            -xy / det,
+            xx / det,
+            (xy * y0 - yy * x0) / det,
+            (yx * x0 - xx * y0) / det))
+    finally:
+        numpy.seterr(**old)
+
+
+class MatrixStore(object):
+    """
+    Item to canvas matrices, and their inverses, of a set of items.
+    Matrix objects are created by ``factory``, that is called with the six
+    matrix values (e.g. ``cairo.Matrix``). By default tuples are returned.
+
+    >>> store = MatrixStore()
+    >>> store.update(['a', 'b', 'c'],
+    ...              [(1, 0, 0, 1, 10, 0), (2, 0, 0, 2, 0, 0), (1, 0, 0, 1, 1, 1)],
+    ...              [-1, 0, 1])
+    >>> store.get_i2c('b')
+    (2.0, 0.0, 0.0, 2.0, 10.0, 0.0)
+    >>> store.get_i2c('c')
+    (2.0, 0.0, 0.0, 2.0, 12.0, 2.0)
+    >>> store.get_c2i('c')
+    (0.5, -0.0, -0.0, 0.5, -6.0, -1.0)
+
+    Item ``b`` is moved. Only ``b`` and its child are updated, the item to
+    canvas matrix of ``a`` is provided:
+
+    >>> store.update(['b', 'c'], [(2, 0, 0, 2, 0, 5), (1, 0, 0, 1, 1, 1)],
+    ...              [-1, 0], {0: store.get_i2c('a')})
+    >>> store.get_i2c('c')
+    (2.0, 0.0, 0.0, 2.0, 12.0, 7.0)
+    >>> 'c' in store, len(store)
+    (True, 3)
+    >>> store.discard('c')
+    >>> 'c' in store, len(store)
+    (False, 2)
+    """
+
+    def __init__(self, factory=None, size=64):
+        if numpy is None:
+            raise ImportError('NumPy is required for a MatrixStore')
+        self._factory = factory
+        self._slots = {}
+        # Free rows, lowest row last
+        self._free = range(size - 1, -1, -1)
+        self._i2c = numpy.empty((size, 6))
+        self._c2i = numpy.empty((size, 6))
+
+    def __contains__(self, item):
+        return item in self._slots
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _allocate(self, items):
+        """
+        Return the rows of ``items``. Rows are assigned to new items.
+        """
+        slots = self._slots
+        free = self._free
+        rows = []
+        for item in items:
+            try:
+                rows.append(slots[item])
+            except KeyError:
+                if not free:
+                    self._grow()
+                slots[item] = row = free.pop()
+                rows.append(row)
+        return rows
+
+    def _grow(self):
+        """
+        Double the size of the arrays.
+        """
+        size = len(self._i2c)
+        self._i2c = numpy.concatenate((self._i2c, numpy.empty((size, 6))))
+        self._c2i = numpy.concatenate((self._c2i, numpy.empty((size, 6))))
+        self._free.extend(range(2 * size - 1, size - 1, -1))
+
+    def discard(self, item):
+        """
+        Forget the matrices of ``item``.
+        """
+        try:
+            row = self._slots.pop(item)
+        except KeyError:
+            pass
+        else:
+            self._free.append(row)
+
+    def update(self, items, matrices, parents, bases=None):
+        """
+        Calculate the item to canvas matrices of ``items``. ``items``
+        should be ordered parents first (e.g. depth-first).
+
+        ``matrices`` are the item to parent matrices of the items, as
+        sequences of six values. ``parents`` holds for each item the
+        position of its parent in ``items``, or -1 if the parent is not
+        part of ``items``. In that case ``bases`` can map the position of
+        the item to the item to canvas matrix of its parent. Otherwise the
+        item is a root item.
+        """
+        n = len(items)
+        if not n:
+            return
+        local = numpy.array(matrices, dtype=float).reshape(n, 6)
+        parent = numpy.array(parents, dtype=int)
+
+        depth = [0] * n
+        for i, p in enumerate(parents):
+            if p >= 0:
+                depth[i] = depth[p] + 1
+        depth = numpy.array(depth)
+
+        base = numpy.empty((n, 6))
+        base[:] = IDENTITY
+        if bases:
+            for i, m in bases.iteritems():
+                base[i] = tuple(m)
+
+        i2c = numpy.empty((n, 6))
+        level = numpy.flatnonzero(depth == 0)
+        d = 0
+        while len(level):
+            if d:
+                i2c[level] = multiply(local[level], i2c[parent[level]])
+            else:
+                i2c[level] = multiply(local[level], base[level])
+            d += 1
+            level = numpy.flatnonzero(depth == d)
+
+        rows = self._allocate(items)
+        self._i2c[rows] = i2c
+        self._c2i[rows] = invert(i2c)
+
+    def _create(self, row):
+        values = row.tolist()
+        if self._factory:
+            return self._factory(*values)
+        return tuple(values)
+
+    def get_i2c(self, item):
+        """
+        Return the item to canvas matrix of ``item``.
+        """
+        return self._create(self._i2c[self._slots[item]])
+
+    def get_c2i(self, item):
+        """
+        Return the canvas to item matrix of ``item``.
+        """
+        return self._create(self._c2i[self._slots[item]])
+
+
+# vim:sw=4:et:ai
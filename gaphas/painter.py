@@ -10,12 +10,15 @@ and handles).
 __version__ = "$Revision$"
 # $HeadURL$
 
-from cairo import Matrix, ANTIALIAS_NONE, LINE_JOIN_ROUND
+from math import floor, ceil
+from cairo import Matrix, ImageSurface, Context as CairoContext, \
+        ANTIALIAS_NONE, LINE_JOIN_ROUND, FORMAT_ARGB32
 
 from gaphas.canvas import Context
 from gaphas.geometry import Rectangle
 from gaphas.item import Line
 from gaphas.aspect import PaintFocused
+from gaphas.tilecache import SurfaceCache
 
 
 DEBUG_DRAW_BOUNDING_BOX = False
@@ -41,6 +44,23 @@ class Painter(object):
         """
         pass
 
+    def invalidate(self, items):
+        """
+        Drop anything cached for ``items``, since they're about to be
+        redrawn (called from the View). Optional, see `invalidate()`.
+        """
+        pass
+
+
+def invalidate(painter, items):
+    """
+    Call ``painter.invalidate(items)``. Painters that only implement
+    ``paint()`` and ``set_view()`` are left alone.
+    """
+    method = getattr(painter, 'invalidate', None)
+    if method is not None:
+        method(items)
+
 
 class PainterChain(Painter):
     """
@@ -78,6 +98,13 @@ class PainterChain(Painter):
         for painter in self._painters:
             painter.paint(context)
 
+    def invalidate(self, items):
+        """
+        See Painter.invalidate().
+        """
+        for painter in self._painters:
+            invalidate(painter, items)
+
 
 class DrawContext(Context):
     """
@@ -93,14 +120,28 @@ class DrawContext(Context):
 
 
 class ItemPainter(Painter):
+    """
+    Draw the items.
+
+    If ``cache_size`` is set, the items are rendered in image surfaces at
+    the current zoom level. The surfaces are reused until the item is
+    redrawn by the view (see ``invalidate()``), except for items that are
+    only moved. The least recently used surfaces are dropped when
+    ``cache_size`` bytes are used.
+    """
 
     draw_all = False
 
+    cache_size = 0
+
+    _cache = None
+
     def _draw_item(self, item, cairo, area=None):
         view = self.view
         cairo.save()
         try:
-            cairo.set_matrix(view.matrix)
+            # The context may be transformed already, e.g. to render a tile
+            cairo.transform(view.matrix)
             cairo.transform(view.canvas.get_matrix_i2c(item))
 
             item.draw(DrawContext(painter=self,
@@ -116,16 +157,69 @@ class ItemPainter(Painter):
         finally:
             cairo.restore()
 
+    def _draw_cached_item(self, item, cairo):
+        """
+        Draw the item from its cached surface. The surface is rendered if
+        the item is not cached, or if the item to view matrix changed other
+        than by whole pixels. Returns ``False`` if the item can not be
+        cached, e.g. because ``cairo`` is not a plain Cairo context.
+        """
+        if not isinstance(cairo, CairoContext):
+            return False
+        cache = self._cache
+        if cache is None or cache.max_size != self.cache_size:
+            cache = self._cache = SurfaceCache(self.cache_size)
+
+        view = self.view
+        try:
+            bounds = view.get_item_bounding_box(item)
+        except KeyError:
+            return False
+        x, y = int(floor(bounds.x)), int(floor(bounds.y))
+        w, h = int(ceil(bounds.x1)) - x, int(ceil(bounds.y1)) - y
+        size = w * h * 4
+        if w <= 0 or h <= 0 or size > cache.max_size / 4:
+            return False
+
+        xx, yx, xy, yy, x0, y0 = view.get_matrix_i2v(item)
+        key = (xx, yx, xy, yy, round(x0 - x, 3), round(y0 - y, 3), w, h)
+        surface = cache.get(item, key)
+        if surface is None:
+            surface = ImageSurface(FORMAT_ARGB32, w, h)
+            cr = CairoContext(surface)
+            cr.set_tolerance(TOLERANCE)
+            cr.set_line_join(LINE_JOIN_ROUND)
+            cr.translate(-x, -y)
+            self._draw_item(item, cr, area=Rectangle(x, y, w, h))
+            cache.put(item, key, surface, size)
+
+        cairo.save()
+        cairo.set_source_surface(surface, x, y)
+        cairo.paint()
+        cairo.restore()
+        return True
+
     def _draw_items(self, items, cairo, area=None):
         """
         Draw the items.
         """
+        cache_size = self.cache_size
         for item in items:
             #if not area or area - view.get_item_bounding_box(item):
-            self._draw_item(item, cairo, area=area)
+            if not (cache_size and self._draw_cached_item(item, cairo)):
+                self._draw_item(item, cairo, area=area)
             if DEBUG_DRAW_BOUNDING_BOX:
                 self._draw_bounds(item, cairo)
 
+    def invalidate(self, items):
+        """
+        Drop the cached surfaces of ``items``.
+        """
+        cache = self._cache
+        if cache:
+            for item in items:
+                cache.discard(item)
+
     def _draw_bounds(self, item, cairo):
         view = self.view
         try:
@@ -251,6 +345,8 @@ class BoundingBoxPainter(ItemPainter):
 
     draw_all = True
 
+    cache_size = 0
+
     def _draw_item(self, item, cairo, area=None):
         cairo = CairoBoundingBoxContext(cairo)
         super(BoundingBoxPainter, self)._draw_item(item, cairo)
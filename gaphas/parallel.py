@@ -0,0 +1,162 @@
+"""
+Solve the constraints of a solver using a pool of processes.
+
+This is meant for headless bulk jobs, like imports, batch re-layouts and
+server side rendering, where whole canvases are solved from scratch.
+
+The constraints are partitioned in independent groups (see
+`solver.Solver.partition()`). Large groups are shipped to worker
+processes: constraints are pickled without their variables, the variable
+values and strengths are sent along as plain arrays. The workers solve the
+groups and send back the new values, that are merged into the solver's
+variable store.
+
+Groups that can not be pickled (e.g. constraints with canvas projections or
+lambda functions) and small groups are solved in the current process.
+
+Values are merged without notifying the state observers (see
+`gaphas.state`), so no undo information is recorded for them.
+"""
+
+__version__ = "$Revision$"
+# $HeadURL$
+
+from array import array
+from cPickle import Pickler, Unpickler, PicklingError
+from cStringIO import StringIO
+from multiprocessing import Pool
+
+from gaphas.solver import Solver, Variable, DirtyQueue
+
+
+# Groups with less constraints are solved in the current process.
+MIN_GROUP_SIZE = 500
+
+
+def solve_parallel(solver, processes=None, min_size=MIN_GROUP_SIZE, pool=None):
+    """
+    Solve the marked constraints of ``solver``. Large independent groups
+    of constraints are solved in a ``multiprocessing`` pool of
+    ``processes`` worker processes. An existing ``pool`` can be provided
+    as well.
+
+    Returns the number of groups solved by the pool.
+    """
+    marked_cons = solver._marked_cons
+    if not marked_cons:
+        return 0
+
+    groups = solver.partition()
+    group_of = {}
+    for i, group in enumerate(groups):
+        for c in group:
+            group_of[c] = i
+
+    # Marked constraints per group, in the order they are marked
+    marked = {}
+    for c in marked_cons:
+        marked.setdefault(group_of[c], []).append(c)
+
+    jobs = []
+    payloads = []
+    for i, group_marked in marked.iteritems():
+        group = groups[i]
+        if len(group) < min_size:
+            continue
+        if [c for c in group if c._solver_has_projections]:
+            continue
+        try:
+            data, variables = _dumps((group, group_marked))
+        except (PicklingError, TypeError, AttributeError):
+            continue
+        jobs.append((variables, set(group_marked)))
+        payloads.append((data,
+                         solver.get_values(variables),
+                         array('d', (v.strength for v in variables)),
+                         solver.topological, solver.batch,
+                         solver.priority, solver.relaxation))
+
+    if not jobs:
+        solver.solve()
+        return 0
+
+    own_pool = pool is None
+    if own_pool:
+        pool = Pool(processes)
+    try:
+        results = pool.map(_solve_group, payloads)
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+
+    solved = set()
+    for (variables, group_marked), (values, solved_count) in zip(jobs, results):
+        for v, value in zip(variables, values):
+            v._value = value
+        solved.update(group_marked)
+        solver.solved_count += solved_count
+
+    for c in solved:
+        solver._marked_cons.discard(c)
+    solver.solve()
+    return len(jobs)
+
+
+def _dumps(obj):
+    """
+    Pickle ``obj``, leaving out all Variables. Returns the pickled data and
+    the list of variables left out. The variables are referred to by their
+    index in that list.
+    """
+    variables = []
+    index = {}
+    def persistent_id(obj):
+        if isinstance(obj, Variable):
+            try:
+                return index[obj]
+            except KeyError:
+                index[obj] = len(variables)
+                variables.append(obj)
+                return index[obj]
+        return None
+
+    f = StringIO()
+    pickler = Pickler(f, 2)
+    pickler.persistent_id = persistent_id
+    pickler.dump(obj)
+    return f.getvalue(), variables
+
+
+def _loads(data, variables):
+    """
+    Inverse of `_dumps()`.
+    """
+    unpickler = Unpickler(StringIO(data))
+    unpickler.persistent_load = variables.__getitem__
+    return unpickler.load()
+
+
+def _solve_group(payload):
+    """
+    Solve a group of constraints. This function is run by the worker
+    processes. The new values of the variables and the number of
+    constraints solved are returned.
+    """
+    data, values, strengths, topological, batch, priority, relaxation = payload
+    variables = map(Variable, values, strengths)
+    group, group_marked = _loads(data, variables)
+
+    solver = Solver()
+    solver.topological = topological
+    solver.batch = batch
+    solver.priority = priority
+    solver.relaxation = relaxation
+    for c in group:
+        solver.add_constraint(c)
+    solver._marked_cons = DirtyQueue(group_marked)
+    solver.solve()
+    return solver.get_values(variables), solver.solved_count
+
+
+# vim:sw=4:et:ai
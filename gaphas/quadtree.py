@@ -22,7 +22,8 @@ __version__ = "$Revision$"
 # $HeadURL$
 
 import operator
-from geometry import rectangle_contains, rectangle_intersects, rectangle_clip
+from geometry import rectangle_contains, rectangle_intersects, rectangle_clip, \
+        distance_rectangle_point
 
 
 class Quadtree(object):
@@ -267,6 +268,93 @@ class Quadtree(object):
         self._bucket.dump()
 
 
+class SpatialIndex(Quadtree):
+    """
+    A quadtree that grows with its contents: when an item is added outside
+    the bounds of the tree, the tree is resized to twice the size needed.
+    Items are never clipped, so they can always be found.
+
+    >>> index = SpatialIndex()
+    >>> index.add('a', (0, 0, 10, 10))
+    >>> index.add('b', (1000, -500, 10, 10))
+    >>> rectangle_contains((1000, -500, 10, 10), index.bounds)
+    True
+    >>> sorted(index.find_intersect((5, 5, 1000, 1)))
+    ['a']
+    >>> sorted(index.find_inside((-10, -1000, 2000, 2000)))
+    ['a', 'b']
+
+    Items near a point can be found as well:
+
+    >>> sorted(index.find_nearest((20, 20)))
+    ['a']
+    >>> sorted(index.find_nearest((20, 20), distance=10))
+    []
+    """
+
+    def add(self, item, bounds, data=None):
+        """
+        Add an item to the tree, or update its bounds. If the item does not
+        fit in the tree, the tree is resized.
+        """
+        if not rectangle_contains(bounds, self.bounds):
+            self._grow(bounds)
+        super(SpatialIndex, self).add(item, bounds, data)
+
+    def _grow(self, bounds):
+        """
+        Resize the tree, so it fits ``bounds`` and the items in it with
+        room to spare.
+        """
+        x0, y0, w, h = bounds
+        x1, y1 = x0 + w, y0 + h
+        if self._ids:
+            sx, sy, sw, sh = self.soft_bounds
+            x0, y0 = min(x0, sx), min(y0, sy)
+            x1, y1 = max(x1, sx + sw), max(y1, sy + sh)
+        w = max(x1 - x0, 1)
+        h = max(y1 - y0, 1)
+        self.resize((x0 - w / 2.0, y0 - h / 2.0, w * 2, h * 2))
+
+    def find_nearest(self, pos, distance=None):
+        """
+        Find the items with a bounding box nearest to ``pos`` (x, y).
+        Only items within ``distance`` are considered. Several items are
+        found if they are at the same distance, e.g. if ``pos`` lies
+        inside their bounding boxes. Returns a set.
+        """
+        x, y = pos
+        get_bounds = self.get_bounds
+        if distance is None:
+            if not self._ids:
+                return set()
+            # Widen the search until something is found
+            tx, ty, tw, th = self.bounds
+            size = max(abs(x - tx), abs(x - tx - tw), abs(y - ty), abs(y - ty - th))
+            distance = 1
+            candidates = ()
+            while not candidates and distance < size:
+                distance *= 2
+                candidates = self.find_intersect((x - distance, y - distance,
+                                                  2 * distance, 2 * distance))
+            # Items nearer than the nearest candidate may lie outside of
+            # the square searched
+            distance = min(distance_rectangle_point(get_bounds(item), pos)
+                           for item in candidates or self._ids)
+        candidates = self.find_intersect((x - distance, y - distance,
+                                          2 * distance, 2 * distance))
+        nearest = set()
+        best = distance
+        for item in candidates:
+            d = distance_rectangle_point(get_bounds(item), pos)
+            if d < best:
+                best = d
+                nearest = set([item])
+            elif d == best:
+                nearest.add(item)
+        return nearest
+
+
 class QuadtreeBucket(object):
     """
     A node in a Quadtree structure.
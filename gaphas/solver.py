@@ -36,9 +36,18 @@ from __future__ import division
 __version__ = "$Revision$"
 # $HeadURL$
 
+from array import array
+from collections import deque
+from heapq import heappush, heappop
+from timeit import default_timer
 from operator import isCallable
 from state import observed, reversible_pair, reversible_property
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # epsilon for float comparison
 # is simple abs(x - y) > EPSILON enough for canvas needs?
 EPSILON = 1e-6
@@ -51,6 +60,12 @@ STRONG = 30
 VERY_STRONG = 40
 REQUIRED = 100
 
+# Minimal number of constraints to use a batch kernel for
+MIN_BATCH_SIZE = 16
+
+# Constraints of a variable that is not used by a solver
+_NO_CONSTRAINTS = frozenset()
+
 
 class Variable(object):
     """
@@ -60,21 +75,70 @@ class Variable(object):
     
     You can even do some calculating with it. The Variable always represents
     a float variable.
+
+    Once a variable is used by a solver, its value and strength are kept in
+    the solver's `VariableStore`.
     """
 
+    __slots__ = ('_v', '_s', '_solver', '_constraints', '_store', '_index',
+                 '__weakref__')
+
     def __init__(self, value=0.0, strength=NORMAL):
-        self._value = float(value)
-        self._strength = strength
+        self._v = float(value)
+        self._s = strength
 
         # These variables are set by the Solver:
         self._solver = None
-        self._constraints = set()
+        self._constraints = _NO_CONSTRAINTS
+        self._store = None
+        self._index = -1
+
+    def _get_raw_value(self):
+        store = self._store
+        if store is None:
+            return self._v
+        return store.values[self._index]
+
+    def _set_raw_value(self, value):
+        store = self._store
+        if store is None:
+            self._v = value
+        else:
+            store.values[self._index] = value
+
+    _value = property(_get_raw_value, _set_raw_value)
+
+    def _get_raw_strength(self):
+        store = self._store
+        if store is None:
+            return self._s
+        return store.strengths[self._index]
+
+    def _set_raw_strength(self, strength):
+        store = self._store
+        if store is None:
+            self._s = strength
+        else:
+            store.strengths[self._index] = strength
+
+    _strength = property(_get_raw_strength, _set_raw_strength)
+
+    def __getstate__(self):
+        return { '_v': self._v, '_s': self._s,
+                 '_solver': self._solver, '_constraints': self._constraints,
+                 '_store': self._store, '_index': self._index }
+
+    def __setstate__(self, state):
+        for k, v in state.iteritems():
+            setattr(self, k, v)
 
     @observed
     def _set_strength(self, strength):
         self._strength = strength
         for c in self._constraints:
             c.create_weakest_list()
+        if self._solver:
+            self._solver._revision += 1
 
     strength = reversible_property(lambda s: s._strength, _set_strength)
 
@@ -93,15 +157,33 @@ class Variable(object):
 
         solver.request_resolve(self)
 
-    @observed
-    def set_value(self, value):
+    def _update_value(self, value):
         oldval = self._value
         if abs(oldval - value) > EPSILON:
             #print id(self), oldval, value
+            solver = self._solver
+            if solver is not None and solver._preview is not None:
+                solver._preview.changed(self, oldval)
             self._value = float(value)
             self.dirty()
 
+    @observed
+    def set_value(self, value):
+        self._update_value(value)
+
+    def _set_value(self, value):
+        """
+        Set the value. No state change event is emitted while the solver
+        of the variable is previewing (see `Preview`).
+        """
+        solver = self._solver
+        if solver is not None and solver._preview is not None:
+            self._update_value(value)
+        else:
+            self.set_value(value)
+
     value = reversible_property(lambda s: s._value, set_value)
+    value = property(value.fget, _set_value)
 
     def __str__(self):
         return 'Variable(%g, %d)' % (self._value, self._strength)
@@ -364,20 +446,406 @@ class Projection(object):
     __repr__ = __str__
 
 
+def _is_indices(obj):
+    """
+    Tell if ``obj`` is an index array returned by `VariableStore.indices()`.
+    """
+    if numpy is not None:
+        return isinstance(obj, numpy.ndarray)
+    return isinstance(obj, array)
+
+
+class VariableStore(object):
+    """
+    Columnar storage for the values and strengths of the variables used by a
+    solver. Values and strengths are kept in contiguous arrays, the
+    variables only hold their index. Both are stored as floats, so
+    strengths should be numbers.
+
+    >>> store = VariableStore()
+    >>> a, b = Variable(1.0), Variable(2.0, STRONG)
+    >>> store.add(a)
+    >>> store.add(b)
+    >>> store.values
+    array('d', [1.0, 2.0])
+    >>> a.value = 3
+    >>> store.values
+    array('d', [3.0, 2.0])
+    >>> i = store.indices([b, a])
+    >>> list(store.get_values(i))
+    [2.0, 3.0]
+    >>> store.set_values(i, [4.0, 5.0])
+    >>> a, b
+    (Variable(5, 20), Variable(4, 30))
+
+    The arrays are kept dense, when a variable is removed the last variable
+    takes its place:
+
+    >>> store.remove(a)
+    >>> store.values, store.strengths
+    (array('d', [4.0]), array('d', [30.0]))
+    >>> a, b
+    (Variable(5, 20), Variable(4, 30))
+
+    Since the arrays provide the buffer interface, NumPy can use them
+    without copying (see `asarray()`). Note that such a view, as well as
+    the indices returned by `indices()`, is only valid as long as no
+    variables are added or removed.
+    """
+
+    def __init__(self):
+        self.values = array('d')
+        self.strengths = array('d')
+        self.variables = []
+
+    def __len__(self):
+        return len(self.variables)
+
+    def __contains__(self, variable):
+        return variable._store is self
+
+    def add(self, variable):
+        """
+        Move the value and strength of ``variable`` in the store.
+        """
+        if variable._store is self:
+            return
+        value, strength = variable._value, variable._strength
+        if variable._store is not None:
+            variable._store.remove(variable)
+        variable._index = len(self.variables)
+        self.values.append(value)
+        self.strengths.append(strength)
+        self.variables.append(variable)
+        variable._store = self
+
+    def remove(self, variable):
+        """
+        Move the value and strength of ``variable`` back in the variable.
+        """
+        assert variable._store is self
+        index = variable._index
+        variable._v = self.values[index]
+        variable._s = self.strengths[index]
+        variable._store = None
+        variable._index = -1
+
+        last = self.variables.pop()
+        value = self.values.pop()
+        strength = self.strengths.pop()
+        if last is not variable:
+            self.variables[index] = last
+            self.values[index] = value
+            self.strengths[index] = strength
+            last._index = index
+
+    def asarray(self):
+        """
+        Return the values as NumPy array sharing its memory with the
+        store. Returns None if NumPy is not available.
+        """
+        if numpy is None or not self.values:
+            return None
+        return numpy.frombuffer(self.values)
+
+    def indices(self, variables):
+        """
+        Return the indices of ``variables`` in the store, as NumPy array
+        if NumPy is available. Keep the indices to access the values of
+        the same variables more than once.
+        """
+        if numpy is not None:
+            return numpy.fromiter((v._index for v in variables), int)
+        return array('l', (v._index for v in variables))
+
+    def get_values(self, indices, out=None):
+        """
+        Return the values at ``indices`` as array. If NumPy is available,
+        the values can be written to the array ``out``.
+        """
+        values = self.asarray()
+        if values is not None:
+            return values.take(indices, out=out)
+        return array('d', map(self.values.__getitem__, indices))
+
+    def set_values(self, indices, values):
+        """
+        Write ``values`` at ``indices`` in the store, in place. Values
+        assigned this way are neither observed nor marked dirty.
+        """
+        store_values = self.asarray()
+        if store_values is not None:
+            store_values.put(indices, values)
+        else:
+            store_values = self.values
+            for i, value in zip(indices, values):
+                store_values[i] = value
+
+
+
+class DirtyQueue(object):
+    """
+    Queue of constraints that should be (re)solved. Each constraint is
+    queued at most once. Membership tests, pushing and removal take
+    constant time.
+
+    >>> q = DirtyQueue()
+    >>> q.push('a'); q.push('b'); q.push('c')
+    >>> q.push('a')
+    >>> list(q)
+    ['b', 'c', 'a']
+    >>> 'b' in q, len(q)
+    (True, 3)
+    >>> q.discard('c')
+    >>> q.pop()
+    'b'
+    >>> list(q)
+    ['a']
+
+    The number of times a constraint is requeued is counted, so juggling
+    constraints can be detected:
+
+    >>> q.requeue('b')
+    1
+    >>> q.requeue('b')
+    2
+    >>> list(q)
+    ['a', 'b']
+    >>> q.clear()
+    >>> len(q), q.requeue('b')
+    (0, 1)
+    """
+
+    def __init__(self, constraints=()):
+        # Constraints are appended to the queue each time they are pushed,
+        # only the last entry of a constraint counts. ``_entries`` holds
+        # the number of entries per constraint, ``_queued`` the constraints
+        # that are queued. No objects are created per push, which keeps
+        # the garbage collector out of the way for large queues.
+        self._queue = deque()
+        self._entries = {}
+        self._queued = set()
+        self._requeued = {}
+        for c in constraints:
+            self.push(c)
+
+    def __len__(self):
+        return len(self._queued)
+
+    def __contains__(self, c):
+        return c in self._queued
+
+    def __iter__(self):
+        entries = dict(self._entries)
+        queued = self._queued
+        for c in list(self._queue):
+            n = entries[c] = entries[c] - 1
+            if not n and c in queued:
+                yield c
+
+    def push(self, c):
+        """
+        Queue ``c``. A constraint that is queued already is moved to the
+        end of the queue.
+        """
+        self._queue.append(c)
+        entries = self._entries
+        entries[c] = entries.get(c, 0) + 1
+        self._queued.add(c)
+
+    def requeue(self, c):
+        """
+        Queue ``c`` and return the number of times it has been requeued
+        since the queue was cleared.
+        """
+        self.push(c)
+        requeued = self._requeued
+        n = requeued[c] = requeued.get(c, 0) + 1
+        return n
+
+    def pop(self):
+        """
+        Remove and return the first constraint in the queue.
+        """
+        popleft = self._queue.popleft
+        entries = self._entries
+        queued = self._queued
+        while 1:
+            c = popleft()
+            n = entries[c] - 1
+            if n:
+                # Queued again later on
+                entries[c] = n
+                continue
+            del entries[c]
+            if c in queued:
+                queued.remove(c)
+                return c
+
+    def discard(self, c):
+        """
+        Remove ``c`` from the queue, if it is queued.
+        """
+        self._queued.discard(c)
+
+    def reset(self):
+        """
+        Reset the requeue counters.
+        """
+        self._requeued.clear()
+
+    def clear(self):
+        """
+        Empty the queue and reset the requeue counters.
+        """
+        self._queue.clear()
+        self._entries.clear()
+        self._queued.clear()
+        self._requeued.clear()
+
+
 class Solver(object):
     """
     Solve constraints. A constraint should have accompanying
     variables.
+
+    If ``topological`` is set, marked constraints are solved in the order
+    of their dependencies (see `Solver.solve()`). If ``batch`` is set as
+    well, independent constraints of the same class are solved in one go.
+
+    If ``priority`` is set, marked constraints are solved in order of
+    their dependencies and the strength of their weakest variable (see
+    `Solver._solve_priority()`).
+
+    If ``relaxation`` is set, constraints that keep marking each other
+    dirty are solved by relaxation (see `Solver._solve_relaxation()`),
+    instead of raising a `JuggleError`. Solving stops once the changes drop
+    below ``tolerance`` or after ``max_iterations`` sweeps.
     """
 
+    topological = False
+    batch = False
+    priority = False
+
+    relaxation = False
+    tolerance = EPSILON
+    max_iterations = 100
+
+    # Set to an `Instrumentation` instance to record what is solved
+    instrumentation = None
+
+    # The active `Preview`, if any
+    _preview = None
+
     def __init__(self):
         # a dict of constraint -> name/variable mappings
         self._constraints = set()
-        self._marked_cons = []
+        self._marked_cons = DirtyQueue()
         self._solving = False
 
+        # Values and strengths of the variables used by the constraints
+        self._store = VariableStore()
+
+        # Bookkeeping for a topological solve, see _solve_topological()
+        self._schedule = None
+
+        # Changes when constraints are added or removed, see compile()
+        self._generation = 0
+
+        # Changes when variable strengths change or constraints are
+        # disabled or enabled, see compile()
+        self._revision = 0
+
+        # Number of solve_for() calls performed and saved
+        self.solved_count = 0
+        self.saved_count = 0
+
+        # Largest change per relaxation sweep of the last solve
+        self.residuals = []
+
     constraints = property(lambda s: s._constraints)
 
+    store = property(lambda s: s._store)
+
+
+    def get_values(self, variables):
+        """
+        Return the values of ``variables`` as array. Instead of variables,
+        indices in the solver's store can be provided (see
+        `VariableStore.indices()`). The values are then taken from the
+        store in bulk.
+
+        >>> from constraint import EqualsConstraint
+        >>> s = Solver()
+        >>> a, b = Variable(1.0), Variable(2.0)
+        >>> s.get_values([a, b])
+        array('d', [1.0, 2.0])
+        >>> eq = s.add_constraint(EqualsConstraint(a, b))
+        >>> list(s.get_values(s.store.indices([b, a])))
+        [2.0, 1.0]
+        """
+        if _is_indices(variables):
+            return self._store.get_values(variables)
+        return array('d', (v._value for v in variables))
+
+
+    def set_values(self, variables, values):
+        """
+        Assign ``values`` to ``variables`` in bulk. Changed variables are
+        marked dirty. As with `get_values()`, indices in the solver's store
+        can be provided instead of variables.
+
+        Values of variables in the solver's store are written to the store
+        directly, those assignments are not observed (see `gaphas.state`).
+
+        >>> from constraint import EqualsConstraint
+        >>> s = Solver()
+        >>> a, b, c = Variable(1.0), Variable(2.0), Variable(3.0)
+        >>> eq = s.add_constraint(EqualsConstraint(a, b))
+        >>> s.solve()
+        >>> s.set_values([a, c], [4.0, 5.0])
+        >>> s.solve()
+        >>> a, b, c
+        (Variable(4, 20), Variable(4, 20), Variable(5, 20))
+        >>> s.set_values(s.store.indices([b]), [6.0])
+        >>> s.solve()
+        >>> a, b
+        (Variable(6, 20), Variable(6, 20))
+        """
+        store = self._store
+        preview = self._preview
+        if _is_indices(variables):
+            indices = variables
+            old = store.get_values(indices)
+            if numpy is not None:
+                values = numpy.asarray(values, dtype=float)
+                changed = numpy.flatnonzero(numpy.abs(old - values) > EPSILON)
+                store.set_values(indices[changed], values[changed])
+            else:
+                changed = [j for j in xrange(len(indices))
+                           if abs(old[j] - values[j]) > EPSILON]
+                store.set_values([indices[j] for j in changed],
+                                 [values[j] for j in changed])
+            variables = store.variables
+            for j in changed:
+                v = variables[indices[j]]
+                if preview is not None:
+                    preview.changed(v, float(old[j]))
+                self.request_resolve(v)
+            return
+
+        store_values = store.values
+        for v, value in zip(variables, values):
+            if v._store is store:
+                i = v._index
+                if abs(store_values[i] - value) > EPSILON:
+                    if preview is not None:
+                        preview.changed(v, store_values[i])
+                    store_values[i] = value
+                    self.request_resolve(v)
+            else:
+                v.value = value
+
 
     def request_resolve(self, variable, projections_only=False):
         """
@@ -398,7 +866,7 @@ class Solver(object):
         EquationConstraint(<lambda>, a=Variable(1, 20), b=Variable(2, 20))
         >>> c_eq._weakest
         [Variable(1, 20), Variable(2, 20)]
-        >>> s._marked_cons
+        >>> list(s._marked_cons)
         [EquationConstraint(<lambda>, a=Variable(1, 20), b=Variable(2, 20))]
         >>> a.value=5.0
         >>> c_eq.weakest()
@@ -415,17 +883,18 @@ class Solver(object):
             variable = variable.variable()
         for c in variable._constraints:
             if not projections_only or c._solver_has_projections:
+                c.mark_dirty(variable)
                 if not self._solving:
-                    if c in self._marked_cons:
-                        self._marked_cons.remove(c)
-                    c.mark_dirty(variable)
-                    self._marked_cons.append(c)
+                    self._marked_cons.push(c)
                 else:
-                    c.mark_dirty(variable)
-                    self._marked_cons.append(c)
-                    if __debug__:
-                        if self._marked_cons.count(c) > 100:
-                            raise JuggleError, 'Variable juggling detected, constraint %s resolved %d times out of %d' % (c, self._marked_cons.count(c), len(self._marked_cons))
+                    if self.instrumentation is not None:
+                        self.instrumentation.marked(c, variable)
+                    if self._schedule is not None \
+                            and self._schedule.request_resolve(c):
+                        continue
+                    n = self._marked_cons.requeue(c)
+                    if n > self.max_iterations and not self.relaxation:
+                        raise JuggleError, 'Variable juggling detected, constraint %s resolved %d times' % (c, n)
 
 
     @observed
@@ -453,14 +922,30 @@ class Solver(object):
         """
         assert constraint, 'No constraint (%s)' % (constraint,)
         self._constraints.add(constraint)
-        self._marked_cons.append(constraint)
-        constraint._solver_has_projections = False
+        self._marked_cons.push(constraint)
+        self._generation += 1
+
+        # Resolve projections once
+        has_projections = False
+        variables = []
+        seen = set()
         for v in constraint.variables():
             while isinstance(v, Projection):
                 v = v.variable()
-                constraint._solver_has_projections = True
+                has_projections = True
+            if v not in seen:
+                seen.add(v)
+                variables.append(v)
+        constraint._solver_has_projections = has_projections
+        constraint._solver_variables = tuple(variables)
+
+        store = self._store
+        for v in variables:
+            if v._constraints is _NO_CONSTRAINTS:
+                v._constraints = set()
             v._constraints.add(constraint)
             v._solver = self
+            store.add(v)
         #print 'added constraint', constraint
         return constraint
 
@@ -476,7 +961,7 @@ class Solver(object):
         >>> c
         EquationConstraint(<lambda>, a=Variable(0, 20), b=Variable(2, 20))
         >>> s.remove_constraint(c)
-        >>> s._marked_cons
+        >>> list(s._marked_cons)
         []
         >>> s._constraints
         set([])
@@ -486,13 +971,19 @@ class Solver(object):
         >>> s.remove_constraint(c)
         """
         assert constraint, 'No constraint (%s)' % (constraint,)
-        for v in constraint.variables():
-            while isinstance(v, Projection):
-                v = v.variable()
-            v._constraints.discard(constraint)
+        store = self._store
+        for v in constraint._solver_variables:
+            constraints = v._constraints
+            if constraint in constraints:
+                constraints.remove(constraint)
+                if not constraints:
+                    # Variable is no longer used by this solver
+                    v._constraints = _NO_CONSTRAINTS
+                    if v._store is store:
+                        store.remove(v)
         self._constraints.discard(constraint)
-        while constraint in self._marked_cons:
-            self._marked_cons.remove(constraint)
+        self._marked_cons.discard(constraint)
+        self._generation += 1
 
     reversible_pair(add_constraint, remove_constraint)
 
@@ -501,14 +992,19 @@ class Solver(object):
         """
         Request resolving a constraint.
         """
-        self._marked_cons.append(c)
+        self._marked_cons.push(c)
 
 
     def constraints_with_variable(self, *variables):
         """
-        Return an iterator of constraints that work with variable.
-        The variable in question should be exposed by the constraints
-        `constraint.Constraint.variables()` method.
+        Return an iterator of constraints that work with all of the
+        variables. The variables in question should be exposed by the
+        constraints `constraint.Constraint.variables()` method, directly
+        or through a projection.
+
+        The constraints are looked up through the variables themselves
+        (each variable knows its constraints), so the time taken depends
+        on the number of constraints found, not on the size of the solver.
 
         >>> from constraint import EquationConstraint
         >>> s = Solver()
@@ -545,35 +1041,79 @@ class Solver(object):
 
         >>> eq_pr_a_b in s.constraints_with_variable(a, b)
         True
+        >>> eq_pr_a_b in s.constraints_with_variable(a)
+        True
+        >>> eq_pr_a_b in s.constraints_with_variable(Projection(b))
+        True
         >>> eq_pr_a_b in s.constraints_with_variable(a, c)
         False
         >>> eq_pr_a_b in s.constraints_with_variable(a, d)
         False
         """
-        # Use a copy of the original set, so constraints may be
-        # deleted in the meantime.
-        variables = set(variables)
-        for c in set(self._constraints):
-            if variables.issubset(set(c.variables())):
-                yield c
-            elif c._solver_has_projections:
-                found = True
-                for v in c.variables():
-                    if v in variables:
-                        continue
-                    while isinstance(v, Projection):
-                        v = v.variable()
-                        if v in variables:
-                            break
-                    else:
-                        found = False
-                    if not found:
-                        break # quit for loop, variable not in constraint
-                else:
-                    # All iteration have completed succesfully,
-                    # so all variables are in the constraint
-                    yield c
-                    
+        # Return a copy, so constraints may be deleted in the meantime.
+        sets = []
+        for v in variables:
+            while isinstance(v, Projection):
+                v = v.variable()
+            sets.append(v._constraints)
+        if not sets:
+            return iter(())
+        sets.sort(key=len)
+        smallest, others = sets[0], sets[1:]
+        return iter([c for c in smallest if c in self._constraints
+                     and all(c in o for o in others)])
+
+
+    def partition(self, constraints=None):
+        """
+        Split ``constraints`` (by default all constraints) in independent
+        groups: constraints in different groups do not share variables.
+        Each group can be solved on its own.
+
+        >>> from constraint import EqualsConstraint
+        >>> a, b, c, d = Variable(1.0), Variable(2.0), Variable(3.0), Variable(4.0)
+        >>> s = Solver()
+        >>> eq_a_b = s.add_constraint(EqualsConstraint(a, b))
+        >>> eq_c_d = s.add_constraint(EqualsConstraint(c, d))
+        >>> eq_b_a = s.add_constraint(EqualsConstraint(Projection(b), a))
+        >>> s.partition([eq_a_b, eq_c_d, eq_b_a]) == [[eq_a_b, eq_b_a], [eq_c_d]]
+        True
+        """
+        if constraints is None:
+            constraints = self._constraints
+        constraints = list(constraints)
+
+        # Union-find: constraints sharing a variable are joined
+        parent = {}
+        owner = {}
+        def find(c):
+            root = c
+            while parent[root] is not root:
+                root = parent[root]
+            while parent[c] is not root:
+                parent[c], c = root, parent[c]
+            return root
+
+        for c in constraints:
+            parent[c] = c
+            for v in c._solver_variables:
+                other = owner.setdefault(v, c)
+                if other is not c:
+                    r1, r2 = find(other), find(c)
+                    if r1 is not r2:
+                        parent[r2] = r1
+
+        groups = {}
+        partition = []
+        for c in constraints:
+            root = find(c)
+            try:
+                groups[root].append(c)
+            except KeyError:
+                groups[root] = [c]
+                partition.append(groups[root])
+        return partition
+
 
     def solve(self):
         """
@@ -606,24 +1146,949 @@ class Solver(object):
         >>> c._value
         10.0
         """
-        marked_cons = self._marked_cons
+        instrumentation = self.instrumentation
+        if instrumentation is not None:
+            instrumentation.start()
+            self._solve_one = instrumentation.solve
         try:
             self._solving = True
+            self.residuals = []
 
-            # Solve each constraint. Using a counter makes it
-            # possible to also solve constraints that are marked as
-            # a result of other variabled being solved.
-            n = 0
-            while n < len(marked_cons):
-                c = marked_cons[n]
-                if not c.disabled:
-                    wvar = c.weakest()
-                    c.solve_for(wvar)
-                n += 1
+            if self.topological:
+                self._solve_topological()
 
-            self._marked_cons = []
+            if self.priority:
+                self._solve_priority()
+
+            if self.relaxation:
+                self._solve_relaxation()
+
+            # Solve each constraint. Constraints that are marked as
+            # a result of other variables being solved are queued
+            # again.
+            marked_cons = self._marked_cons
+            solve = self._solve_one
+            while marked_cons:
+                c = marked_cons.pop()
+                if not c.disabled:
+                    solve(c)
+                    self.solved_count += 1
         finally:
             self._solving = False
+            self._marked_cons.reset()
+            if instrumentation is not None:
+                del self._solve_one
+                instrumentation.stop()
+            if self._schedule is not None:
+                self.saved_count += self._schedule.saved
+                self._schedule = None
+
+
+    def preview(self):
+        """
+        Start a dry run. See `Preview`.
+        """
+        return Preview(self)
+
+
+    def compile(self, constraints):
+        """
+        Compile ``constraints`` and all constraints that depend on them
+        in a single function. See `CompiledNetwork`.
+        """
+        return CompiledNetwork(self, constraints)
+
+
+    # Solve a single constraint, replaced while instrumented
+    _solve_one = staticmethod(lambda c: c.solve_for(c.weakest()))
+
+
+    def dependency_graph(self, constraints):
+        """
+        Return the dependency graph of ``constraints`` and all constraints
+        that may be affected by solving them.
+
+        The graph is returned as a tuple (nodes, edges). ``nodes`` is a list
+        of constraints, ``edges`` maps each constraint to a list of
+        constraints that hold one of its outputs
+        (`constraint.Constraint.outputs()`) and hence should be solved
+        after it.
+
+        >>> from constraint import EqualsConstraint
+        >>> a, b, c = Variable(1.0), Variable(2.0, WEAK), Variable(3.0, WEAK)
+        >>> s = Solver()
+        >>> eq_a_b = s.add_constraint(EqualsConstraint(a, b))
+        >>> eq_b_c = s.add_constraint(EqualsConstraint(b, c))
+        >>> nodes, edges = s.dependency_graph([eq_a_b])
+        >>> nodes == [eq_a_b, eq_b_c]
+        True
+        >>> edges[eq_a_b] == [eq_b_c], edges[eq_b_c] == [eq_a_b]
+        (True, True)
+        """
+        nodes = []
+        edges = {}
+        queue = list(constraints)
+        queue.reverse()
+        while queue:
+            c = queue.pop()
+            if c in edges:
+                continue
+            nodes.append(c)
+            dependents = []
+            for v in c.outputs():
+                while isinstance(v, Projection):
+                    v = v.variable()
+                for d in v._constraints:
+                    if d is not c and d not in dependents:
+                        dependents.append(d)
+            edges[c] = dependents
+            queue.extend(reversed(dependents))
+        return nodes, edges
+
+
+    def _solve_topological(self):
+        """
+        Solve the marked constraints in topological order.
+
+        The dependency graph of the marked constraints is split in strongly
+        connected components. Each component is solved once, in topological
+        order. Constraints marked while solving are not appended to the
+        marked constraints list if they are scheduled for later anyway.
+        Only inside cyclic components constraints are juggled until they
+        settle down.
+
+        If ``batch`` is set, independent constraints of the same class are
+        solved in one go by the class' batch kernel
+        (`constraint.Constraint.solve_batch`).
+
+        Constraints that are marked after their turn are left in the marked
+        constraints list and are solved the normal way.
+        """
+        marked_cons = list(self._marked_cons)
+        self._marked_cons.clear()
+        schedule = self._schedule = _Schedule(*self.dependency_graph(marked_cons))
+        pending = schedule.pending
+        pending.update(marked_cons)
+
+        solve = self._solve_one
+        instrumentation = self.instrumentation
+        for level in schedule:
+            batches = {}
+            for component in level:
+                if len(component) > 1:
+                    self._solve_cyclic(component)
+                    continue
+                c = component[0]
+                if c not in pending:
+                    continue
+                if self.batch and not c.disabled \
+                        and getattr(c, 'solve_batch', None):
+                    batches.setdefault(type(c), []).append(c)
+                    continue
+                if not c.disabled:
+                    solve(c)
+                    self.solved_count += 1
+                pending.discard(c)
+
+            for cls, batch in batches.iteritems():
+                if len(batch) < MIN_BATCH_SIZE:
+                    for c in batch:
+                        solve(c)
+                elif instrumentation is not None:
+                    instrumentation.solve_batch(cls, batch)
+                else:
+                    cls.solve_batch(batch)
+                self.solved_count += len(batch)
+                pending.difference_update(batch)
+
+
+    def _solve_cyclic(self, component):
+        """
+        Solve a cyclic component of the dependency graph: constraints
+        are resolved until none of them are marked anymore.
+
+        If ``relaxation`` is set, resolving also stops when the changes
+        drop below ``tolerance`` or after ``max_iterations`` sweeps.
+        """
+        pending = self._schedule.pending
+        n = 0
+        while True:
+            todo = [c for c in component if c in pending]
+            if not todo:
+                break
+            n += 1
+            if n > self.max_iterations:
+                if self.relaxation:
+                    pending.difference_update(todo)
+                    break
+                raise JuggleError, 'Variable juggling detected, constraints %s resolved %d times' % (todo, n)
+            if self.relaxation:
+                pending.difference_update(todo)
+                residual = self._relax(todo)
+                self.residuals.append(residual)
+                if residual < self.tolerance:
+                    pending.difference_update(component)
+                    break
+                continue
+            for c in todo:
+                if not c.disabled:
+                    self._solve_one(c)
+                    self.solved_count += 1
+                pending.discard(c)
+
+
+    def _solve_relaxation(self):
+        """
+        Solve the marked constraints by relaxation (Gauss-Seidel).
+
+        The marked constraints are solved in sweeps, in the order they are
+        marked. Each constraint is solved once per sweep; constraints
+        marked during a sweep are solved in the next sweep. Solving stops
+        if the largest change of a sweep drops below ``tolerance``, or
+        after ``max_iterations`` sweeps. Constraints still marked by then
+        are dropped.
+
+        The largest change of each sweep is appended to ``residuals``.
+
+        >>> from constraint import EqualsConstraint
+        >>> a, b = Variable(1.0), Variable(2.0)
+        >>> s = Solver()
+        >>> s.relaxation = True
+        >>> eq = s.add_constraint(EqualsConstraint(a, b))
+        >>> ne = s.add_constraint(EqualsConstraint(a, b, delta=1.0))
+        >>> s.solve()
+        >>> len(s.residuals)
+        100
+        >>> s.residuals[-1]
+        1.0
+        """
+        marked_cons = self._marked_cons
+        residuals = self.residuals
+        while marked_cons and len(residuals) < self.max_iterations:
+            sweep = list(marked_cons)
+            marked_cons.clear()
+            residual = self._relax(sweep)
+            residuals.append(residual)
+            if residual < self.tolerance:
+                break
+        marked_cons.clear()
+
+
+    def _relax(self, constraints):
+        """
+        Solve ``constraints`` once. Return the largest change of the
+        variables changed by the constraints (see
+        `constraint.Constraint.outputs()`).
+        """
+        residual = 0.0
+        solve = self._solve_one
+        for c in constraints:
+            if c.disabled:
+                continue
+            before = [(v, v.value) for v in c.outputs()]
+            solve(c)
+            self.solved_count += 1
+            for v, value in before:
+                residual = max(residual, abs(v.value - value))
+        return residual
+
+
+    def _solve_priority(self):
+        """
+        Solve the marked constraints from a priority queue.
+
+        Constraints are ordered by their position in the dependency graph
+        (see `Solver.dependency_graph()`): constraints that change
+        variables of other constraints go first. Constraints in a cycle
+        share a position; they are ordered by the strength of their weakest
+        variable, strongest first, so weak constraints are not solved
+        before a strong neighbour overrides them. Ties are solved in
+        marking order.
+
+        Constraints marked while solving are queued again. A constraint is
+        queued only once. A constraint marking itself while it is solved is
+        not queued again.
+        """
+        if self._schedule is not None:
+            self.saved_count += self._schedule.saved
+        marked_cons = list(self._marked_cons)
+        self._marked_cons.clear()
+        schedule = self._schedule = _PrioritySchedule(*self.dependency_graph(marked_cons))
+        for c in marked_cons:
+            schedule.push(c)
+
+        solve = self._solve_one
+        while schedule:
+            c = schedule.pop()
+            if not c.disabled:
+                solve(c)
+                self.solved_count += 1
+            n = schedule.solved(c)
+            if n > self.max_iterations and not self.relaxation:
+                raise JuggleError, 'Variable juggling detected, constraint %s resolved %d times' % (c, n)
+
+
+class Preview(object):
+    """
+    A dry run of the solver: variables can be changed and constraints
+    solved, after which the changes are either committed or discarded.
+
+    The value of a variable is recorded when it changes for the first
+    time during the preview, the values of other variables are not
+    copied. No state change events (see
+    `gaphas.state`) are emitted for the variables of the solver during a
+    preview, so no undo information is recorded for intermediate values.
+    Other changes, e.g. to variables of other solvers, are not part of the
+    preview: they emit events as usual and are kept on discard.
+
+    >>> from constraint import EqualsConstraint
+    >>> a, b = Variable(1.0), Variable(2.0, WEAK)
+    >>> s = Solver()
+    >>> eq = s.add_constraint(EqualsConstraint(a, b))
+    >>> s.solve()
+    >>> preview = s.preview()
+    >>> a.value = 3.0
+    >>> preview.solve()
+    >>> sorted(preview.diff().values())
+    [(1.0, 3.0), (1.0, 3.0)]
+    >>> preview.discard()
+    >>> a.value, b.value
+    (1.0, 1.0)
+
+    `Preview.commit()` keeps the changes and emits the state change events
+    in one go. Previews can be used as context manager; unless the
+    preview is committed, it is discarded at the end of the block:
+
+    >>> with s.preview() as preview:
+    ...     a.value = 4.0
+    ...     preview.solve()
+    ...     diff = preview.commit()
+    >>> a.value, b.value
+    (4.0, 4.0)
+
+    Constraints can not be added or removed during a preview.
+    """
+
+    def __init__(self, solver):
+        assert not solver._solving, 'Can not preview while solving'
+        assert solver._preview is None, 'A preview is active already'
+        self._solver = solver
+        self._marked_cons = list(solver._marked_cons)
+        self._generation = solver._generation
+        # variable -> value at the start of the preview
+        self._changed = {}
+        solver._preview = self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._solver._preview is self:
+            self.discard()
+
+    def changed(self, variable, old):
+        """
+        Called when ``variable`` is about to change. ``old`` is the
+        current value of the variable.
+        """
+        if variable not in self._changed:
+            self._changed[variable] = old
+
+    def solve(self):
+        """
+        Solve the constraints.
+        """
+        assert self._solver._preview is self
+        assert self._solver._generation == self._generation, \
+                'Constraints were added or removed during preview'
+        self._solver.solve()
+
+    def diff(self):
+        """
+        Return the changed variables, as a dict variable -> (old value,
+        new value).
+        """
+        diff = {}
+        for v, old in self._changed.iteritems():
+            new = v._value
+            if abs(new - old) > EPSILON:
+                diff[v] = (old, new)
+        return diff
+
+    def _set_marked(self, constraints):
+        marked_cons = self._solver._marked_cons
+        marked_cons.clear()
+        for c in constraints:
+            marked_cons.push(c)
+
+    def discard(self):
+        """
+        Restore the variables to their values at the start of the
+        preview, as well as the list of marked constraints.
+        """
+        for v, old in self._changed.iteritems():
+            v._value = old
+        self._set_marked(self._marked_cons)
+        self._solver._preview = None
+
+    def commit(self):
+        """
+        Keep the changes. State change events are emitted for the changed
+        variables. Returns the diff (see `Preview.diff()`).
+        """
+        diff = self.diff()
+        for v, (old, new) in diff.iteritems():
+            v._value = old
+        self._solver._preview = None
+
+        marked = list(self._solver._marked_cons)
+        try:
+            for v, (old, new) in diff.iteritems():
+                v.value = new
+        finally:
+            # Constraints marked while committing are solved already
+            self._set_marked(marked)
+        return diff
+
+
+class CompiledNetwork(object):
+    """
+    A network of constraints compiled in a single Python function, for
+    constraints that are solved over and over again while the topology
+    stays the same, e.g. everything that depends on a handle that is being
+    dragged.
+
+    The network consists of the given constraints and all constraints
+    that depend on them (see `Solver.dependency_graph()`). The function
+    calls ``solve_for()`` for each of them in topological order, like
+    `Solver.solve()` does. The bound ``solve_for()`` method and the list of
+    weakest variables of each constraint are looked up when the network is
+    compiled, disabled constraints are left out. Cycles are solved until
+    they settle down.
+
+    Calling the network solves it. Constraints of the network are not
+    marked while it is solved, constraints outside the network are solved
+    by the next `Solver.solve()`. When constraints are added to or removed
+    from the solver, a variable strength changes or a constraint is
+    disabled or enabled, the network is compiled again on the next call.
+
+    >>> from constraint import EqualsConstraint
+    >>> a, b, c = Variable(1.0), Variable(2.0, WEAK), Variable(3.0, VERY_WEAK)
+    >>> s = Solver()
+    >>> eq_a_b = s.add_constraint(EqualsConstraint(a, b))
+    >>> eq_b_c = s.add_constraint(EqualsConstraint(b, c))
+    >>> s.solve()
+    >>> a.value = 4.0
+    >>> network = s.compile([eq_a_b])
+    >>> network()
+    >>> b.value, c.value, len(s._marked_cons)
+    (4.0, 4.0, 0)
+    >>> print network.source
+    def solve():
+        solve_0(weakest_0[0])
+        solve_1(weakest_1[0])
+    """
+
+    def __init__(self, solver, constraints):
+        self._solver = solver
+        self._seeds = list(constraints)
+        self._version = None
+        self._function = None
+        self._cycle_members = ()
+        self._cycle_changed = False
+        self.constraints = frozenset()
+        self.source = None
+
+    def compile(self):
+        """
+        (Re)compile the network.
+        """
+        solver = self._solver
+        seeds = [c for c in self._seeds if c in solver.constraints]
+        nodes, edges = solver.dependency_graph(seeds)
+        namespace = {}
+        source = ['def solve():']
+        components = strongly_connected_components(nodes, edges)
+        for i, component in enumerate(components):
+            component = [c for c in component if not c.disabled]
+            if len(component) > 1:
+                namespace['cycle_%d' % i] = self._cycle(component)
+                source.append('    cycle_%d()' % i)
+            elif component:
+                c = component[0]
+                # The weakest variable is the first one of the list
+                namespace['solve_%d' % i] = c.solve_for
+                namespace['weakest_%d' % i] = c._weakest
+                source.append('    solve_%d(weakest_%d[0])' % (i, i))
+        if len(source) == 1:
+            source.append('    pass')
+        self.source = '\n'.join(source)
+        exec self.source in namespace
+        self._function = namespace['solve']
+        self.constraints = frozenset(nodes)
+        self._version = solver._generation, solver._revision
+
+    def _cycle(self, component):
+        """
+        Return a function that solves the constraints in ``component``
+        until they settle down.
+        """
+        max_iterations = self._solver.max_iterations
+        members = frozenset(component)
+        solvers = [(c.solve_for, c._weakest) for c in component]
+        def cycle():
+            self._cycle_members = members
+            try:
+                for i in xrange(max_iterations):
+                    self._cycle_changed = False
+                    for solve_for, weakest in solvers:
+                        solve_for(weakest[0])
+                    if not self._cycle_changed:
+                        break
+            finally:
+                self._cycle_members = ()
+        return cycle
+
+    def __call__(self):
+        solver = self._solver
+        assert not solver._solving, 'Solver is solving already'
+        if self._version != (solver._generation, solver._revision):
+            self.compile()
+        marked_cons = solver._marked_cons
+        for c in self.constraints:
+            marked_cons.discard(c)
+        solver._solving = True
+        solver._schedule = self
+        try:
+            self._function()
+        finally:
+            solver._solving = False
+            solver._schedule = None
+            marked_cons.reset()
+        solver.solved_count += len(self.constraints)
+
+    def request_resolve(self, c):
+        """
+        Constraints in the network are solved by the network. If a
+        constraint of the cycle being solved is marked, the cycle has not
+        settled down yet.
+        """
+        if c in self._cycle_members:
+            self._cycle_changed = True
+        return c in self.constraints
+
+
+class Instrumentation(object):
+    """
+    Record what a solver does while solving: per constraint the number of
+    `constraint.Constraint.solve_for()` calls, the time spent and the
+    number of variables changed, and which constraints re-mark each other.
+
+    Assign an instance to `Solver.instrumentation` to start recording. By
+    default the records are reset at the start of each `Solver.solve()`,
+    unless ``cumulative`` is set.
+
+    >>> from constraint import EqualsConstraint
+    >>> a, b, c = Variable(1.0), Variable(2.0, WEAK), Variable(3.0, WEAK)
+    >>> s = Solver()
+    >>> s.instrumentation = Instrumentation()
+    >>> eq_a_b = s.add_constraint(EqualsConstraint(a, b))
+    >>> eq_b_c = s.add_constraint(EqualsConstraint(b, c))
+    >>> s.solve()
+    >>> report = s.instrumentation.report()
+    >>> report['solves'], report['calls']
+    (1, 4)
+    >>> [(r['constraint'] is eq_b_c, r['calls'], r['changed'], r['remarks'], r['depth'])
+    ...     for r in s.instrumentation.top(key='remarks')]
+    [(True, 2, 1, 1, 1), (False, 2, 1, 0, 0)]
+    >>> report['classes']['EqualsConstraint']['calls']
+    4
+    >>> s.instrumentation.chain(eq_b_c) == [eq_a_b, eq_b_c]
+    True
+    """
+
+    # Columns of `Instrumentation.to_csv()`
+    COLUMNS = ('class', 'constraint', 'calls', 'time', 'changed', 'remarks', 'depth')
+
+    def __init__(self, cumulative=False):
+        self.cumulative = cumulative
+        self.reset()
+
+    def reset(self):
+        """
+        Clear all records.
+        """
+        self.calls = {}
+        self.time = {}
+        self.changed = {}
+        # (marking constraint, marked constraint) -> count
+        self.remarks = {}
+        # Length of the longest re-mark chain leading to a constraint
+        self.depth = {}
+        self._origin = {}
+        self._current = None
+        self._start = 0.0
+        self.solves = 0
+        self.solve_time = 0.0
+
+    def start(self):
+        """
+        Called by the solver when solving starts.
+        """
+        if not self.cumulative:
+            self.reset()
+        self._start = default_timer()
+
+    def stop(self):
+        """
+        Called by the solver when solving is done.
+        """
+        self.solve_time += default_timer() - self._start
+        self.solves += 1
+
+    def solve(self, c):
+        """
+        Solve constraint ``c`` for its weakest variable and record it.
+        """
+        self._current = c
+        t = default_timer()
+        try:
+            c.solve_for(c.weakest())
+        finally:
+            self.time[c] = self.time.get(c, 0.0) + default_timer() - t
+            self.calls[c] = self.calls.get(c, 0) + 1
+            self._current = None
+
+    def solve_batch(self, cls, batch):
+        """
+        Solve ``batch`` with the batch kernel of ``cls``. The time spent is
+        divided evenly over the constraints.
+        """
+        t = default_timer()
+        cls.solve_batch(batch)
+        t = (default_timer() - t) / len(batch)
+        time, calls = self.time, self.calls
+        for c in batch:
+            time[c] = time.get(c, 0.0) + t
+            calls[c] = calls.get(c, 0) + 1
+
+    def marked(self, c, variable):
+        """
+        Called by the solver when ``variable`` changed while solving and
+        constraint ``c``, that uses the variable, is marked.
+        """
+        current = self._current
+        if current is None:
+            return
+        if c is current:
+            self.changed[c] = self.changed.get(c, 0) + 1
+        else:
+            key = (current, c)
+            self.remarks[key] = self.remarks.get(key, 0) + 1
+            depth = self.depth.get(current, 0) + 1
+            if depth > self.depth.get(c, 0):
+                self.depth[c] = depth
+            self._origin[c] = current
+
+    def chain(self, c):
+        """
+        Return the last chain of re-marks that led to ``c``, starting with
+        a constraint that was not re-marked.
+        """
+        chain = [c]
+        seen = set(chain)
+        origin = self._origin
+        while c in origin and origin[c] not in seen:
+            c = origin[c]
+            seen.add(c)
+            chain.append(c)
+        chain.reverse()
+        return chain
+
+    def _records(self):
+        remarked = {}
+        for (marker, c), n in self.remarks.iteritems():
+            remarked[c] = remarked.get(c, 0) + n
+        return [{
+                'constraint': c,
+                'class': type(c).__name__,
+                'calls': n,
+                'time': self.time.get(c, 0.0),
+                'changed': self.changed.get(c, 0),
+                'remarks': remarked.get(c, 0),
+                'depth': self.depth.get(c, 0),
+            } for c, n in self.calls.iteritems()]
+
+    def report(self):
+        """
+        Return the records as a dict, with the records per constraint
+        (``constraints``), the totals per constraint class (``classes``) and
+        re-marks (``remarks``, a list of (marker, marked, count) tuples,
+        most frequent first).
+        """
+        records = self._records()
+        classes = {}
+        for r in records:
+            try:
+                total = classes[r['class']]
+            except KeyError:
+                total = classes[r['class']] = dict(constraints=0, calls=0,
+                        time=0.0, changed=0, remarks=0)
+            total['constraints'] += 1
+            for key in ('calls', 'time', 'changed', 'remarks'):
+                total[key] += r[key]
+        remarks = [(marker, c, n) for (marker, c), n in self.remarks.iteritems()]
+        remarks.sort(key=lambda r: -r[2])
+        return {
+            'solves': self.solves,
+            'solve_time': self.solve_time,
+            'calls': sum(self.calls.itervalues()),
+            'constraints': records,
+            'classes': classes,
+            'remarks': remarks,
+        }
+
+    def top(self, n=10, key='time'):
+        """
+        Return the records of the ``n`` constraints with the highest value
+        for ``key`` (one of ``calls``, ``time``, ``changed``, ``remarks``
+        or ``depth``).
+        """
+        records = self._records()
+        records.sort(key=lambda r: r[key], reverse=True)
+        return records[:n]
+
+    def to_csv(self, f):
+        """
+        Write the records per constraint to file ``f`` in CSV format.
+        """
+        import csv
+        writer = csv.writer(f)
+        writer.writerow(self.COLUMNS)
+        for r in self.top(len(self.calls)):
+            writer.writerow([r[col] for col in self.COLUMNS])
+
+    def summary(self, n=10, key='time'):
+        """
+        Return a printable summary of the top ``n`` constraints.
+        """
+        lines = ['%d solve(s), %d calls, %.3fs' % (self.solves,
+                 sum(self.calls.itervalues()), self.solve_time),
+                 '%8s %10s %8s %8s %6s  %s' % ('calls', 'time', 'changed',
+                 'remarks', 'depth', 'constraint')]
+        for r in self.top(n, key):
+            lines.append('%8d %10.6f %8d %8d %6d  %s' % (r['calls'],
+                    r['time'], r['changed'], r['remarks'], r['depth'],
+                    r['constraint']))
+        return '\n'.join(lines)
+
+
+class _PrioritySchedule(object):
+    """
+    Priority queue of constraints, used by the solver while solving in
+    priority mode.
+
+    Constraints are ordered by the topological order of the strongly
+    connected component they are in, then by the strength of their weakest
+    variable (strongest first), then in order of arrival.
+
+    >>> from constraint import EqualsConstraint
+    >>> a, b = Variable(1.0, STRONG), Variable(2.0, STRONG)
+    >>> c, d = Variable(3.0, WEAK), Variable(4.0, WEAK)
+    >>> eq_a_b, eq_c_d = EqualsConstraint(a, b), EqualsConstraint(c, d)
+    >>> s = _PrioritySchedule([eq_c_d, eq_a_b], { eq_c_d: [], eq_a_b: [] })
+    >>> s.push(eq_c_d); s.push(eq_a_b); s.push(eq_c_d)
+    >>> s.pop() is eq_a_b, s.pop() is eq_c_d, bool(s)
+    (True, True, False)
+    >>> s.saved
+    1
+    """
+
+    def __init__(self, nodes, edges):
+        self._order = {}
+        for i, component in enumerate(strongly_connected_components(nodes, edges)):
+            for c in component:
+                self._order[c] = i
+        self._heap = []
+        self._queued = set()
+        self._solved = {}
+        self._count = 0
+        self._current = None
+        self.saved = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, c):
+        """
+        Queue ``c``, unless it is queued already.
+        """
+        if c in self._queued:
+            self.saved += 1
+            return
+        self._queued.add(c)
+        self._count += 1
+        order = self._order.get(c, len(self._order))
+        heappush(self._heap, (order, -c.weakest().strength, self._count, c))
+
+    def pop(self):
+        """
+        Remove and return the constraint with the highest priority.
+        """
+        c = self._current = heappop(self._heap)[-1]
+        self._queued.discard(c)
+        return c
+
+    def solved(self, c):
+        """
+        Register ``c`` is solved. Returns the number of times it has been
+        solved.
+        """
+        self._current = None
+        n = self._solved[c] = self._solved.get(c, 0) + 1
+        return n
+
+    def request_resolve(self, c):
+        """
+        Schedule ``c`` to be (re)solved. All constraints are handled by the
+        schedule. Requests for the constraint being solved are counted in
+        ``saved``.
+        """
+        if c is self._current:
+            self.saved += 1
+        else:
+            self.push(c)
+        return True
+
+
+class _Schedule(object):
+    """
+    Topological schedule of constraints, used by the solver while
+    solving in topological mode.
+
+    The strongly connected components of the dependency graph are grouped
+    in levels: a component is placed one level after the last component it
+    depends on. Components on the same level do not depend on each other.
+    Iterating a schedule yields the levels, in topological order.
+
+    Constraints are solved if they are in the ``pending`` set by the time
+    their level is handled.
+
+    >>> a, b, c, d, e = 'a', 'b', 'c', 'd', 'e'
+    >>> s = _Schedule([a, b, c, d, e], { a: [b], b: [c], c: [b], d: [a], e: [] })
+    >>> list(s)
+    [[['e'], ['d']], [['a']], [['b', 'c']]]
+    """
+
+    def __init__(self, nodes, edges):
+        components = strongly_connected_components(nodes, edges)
+        index = {}
+        for i, component in enumerate(components):
+            for c in component:
+                index[c] = i
+        depth = [0] * len(components)
+
+        self.levels = []
+        self.pending = set()
+        self.saved = 0
+        self._level = {}
+        self._cyclic = set()
+        self._current = -1
+
+        for i, component in enumerate(components):
+            d = depth[i]
+            for c in component:
+                for succ in edges[c]:
+                    j = index[succ]
+                    if j != i and depth[j] <= d:
+                        depth[j] = d + 1
+                self._level[c] = d
+            if len(component) > 1:
+                self._cyclic.update(component)
+            if d == len(self.levels):
+                self.levels.append([])
+            self.levels[d].append(component)
+
+    def __iter__(self):
+        for i, level in enumerate(self.levels):
+            self._current = i
+            yield level
+
+    def request_resolve(self, c):
+        """
+        Schedule ``c`` to be (re)solved. Return ``False`` if the constraint
+        is not part of the schedule or its turn has passed, so it should be
+        solved the normal way.
+
+        Constraints remain pending while they are solved. Requests for
+        constraints that are pending already are counted in ``saved``.
+        """
+        pending = self.pending
+        if c in pending:
+            self.saved += 1
+            return True
+        level = self._level.get(c, -1)
+        if level > self._current or \
+                (level == self._current and c in self._cyclic):
+            pending.add(c)
+            return True
+        return False
+
+
+def strongly_connected_components(nodes, edges):
+    """
+    Find the strongly connected components in the graph (nodes, edges) using
+    Tarjan's algorithm. The components are returned in topological order:
+    for each edge the component of its source comes first, except for
+    edges within a component.
+
+    >>> strongly_connected_components([1, 2, 3, 4],
+    ...         { 1: [2], 2: [3], 3: [2, 4], 4: [] })
+    [[1], [2, 3], [4]]
+    """
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+    counter = 0
+    for root in nodes:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(edges[root]))]
+        while work:
+            node, successors = work[-1]
+            for succ in successors:
+                if succ not in index:
+                    index[succ] = lowlink[succ] = counter
+                    counter += 1
+                    stack.append(succ)
+                    on_stack.add(succ)
+                    work.append((succ, iter(edges[succ])))
+                    break
+                elif succ in on_stack:
+                    lowlink[node] = min(lowlink[node], index[succ])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        w = stack.pop()
+                        on_stack.discard(w)
+                        component.append(w)
+                        if w is node:
+                            break
+                    component.reverse()
+                    components.append(component)
+    components.reverse()
+    return components
 
 
 class solvable(object):
@@ -31,6 +31,29 @@ class MatricesTestCase(unittest.TestCase):
         c.add(b2, b1)
         c.reparent(b2, None)
 
+    def test_columnar_matrices(self):
+        """Test updating of matrices in a matrix store"""
+        c = Canvas()
+        c.columnar_matrices = True
+        i = Box()
+        ii = Box()
+        c.add(i)
+        c.add(ii, i)
+
+        i.matrix = (1.0, 0.0, 0.0, 1.0, 5.0, 0.0)
+        ii.matrix = (1.0, 0.0, 0.0, 1.0, 0.0, 8.0)
+
+        updated = c.update_matrices([i])
+
+        self.assertEquals(set([i, ii]), updated)
+        self.assertEquals(None, ii._matrix_i2c)
+        self.assertEquals(c.get_matrix_i2c(i), cairo.Matrix(1, 0, 0, 1, 5, 0))
+        self.assertEquals(c.get_matrix_i2c(ii), cairo.Matrix(1, 0, 0, 1, 5, 8))
+        self.assertEquals(c.get_matrix_c2i(ii), cairo.Matrix(1, 0, 0, 1, -5, -8))
+
+        c.remove(ii)
+        assert ii not in c._matrix_store
+
 # fixme: what about multiple constraints for a handle?
 #        what about 1d projection?
 
@@ -154,6 +177,97 @@ class CanvasTestCase(unittest.TestCase):
         self.assertEquals(6, len(c.solver.constraints))
 
 
+class BatchTestCase(unittest.TestCase):
+
+    def test_setup_deferred(self):
+        """Test items added in a batch are set up when the batch ends"""
+        c = Canvas()
+        b1 = Box()
+        b2 = Box()
+        with c.batch():
+            c.add(b1)
+            c.add(b2)
+            self.assertEquals(None, b1.canvas)
+            self.assertEquals(0, len(c.solver.constraints))
+            c.remove(b2)
+        self.assertEquals(c, b1.canvas)
+        self.assertEquals(None, b2.canvas)
+        self.assertEquals(6, len(c.solver.constraints))
+        self.assertEquals([b1], c.get_all_items())
+
+
+class UpdateViewsTestCase(unittest.TestCase):
+
+    def test_requested_items(self):
+        """
+        Views are told which items requested an update, ancestors of those
+        items are updated too.
+        """
+        class RecordingView(object):
+            items = set()
+            requested_items = set()
+            def request_update(self, items, matrix_only_items=(),
+                               removed_items=(), requested_items=None):
+                self.items.update(items)
+                self.requested_items.update(requested_items)
+
+        canvas = Canvas()
+        parent = Box()
+        child = Box()
+        canvas.add(parent)
+        canvas.add(child, parent)
+        canvas.update_now()
+
+        view = RecordingView()
+        canvas.register_view(view)
+        canvas.request_update(child)
+        canvas.update_now()
+        self.assertEquals(set([parent, child]), view.items)
+        self.assertEquals(set([child]), view.requested_items)
+
+
+class SpatialIndexTestCase(unittest.TestCase):
+
+    def test_find_items(self):
+        c = Canvas()
+        b1 = Box(20, 20)
+        b2 = Box(20, 20)
+        b3 = Box(10, 10)
+        b2.matrix.translate(100, 0)
+        b3.matrix.translate(5, 5)
+        c.add_many([(b1, None), (b2, None), (b3, b2)])
+
+        self.assertEquals((105.0, 5.0, 10.0, 10.0), c.get_item_bounds(b3))
+        self.assertEquals(set([b1]), c.find_intersect((0, 0, 10, 10)))
+        self.assertEquals(set([b2, b3]), c.find_intersect((110, 10, 1, 1)))
+        self.assertEquals(set([b1, b2, b3]), c.find_inside((0, 0, 200, 100)))
+        self.assertEquals(b3, c.find_nearest((110, 10)))
+        self.assertEquals(b2, c.find_nearest((90, 10)))
+        self.assertEquals(None, c.find_nearest((60, 10), distance=10))
+
+    def test_moved_items(self):
+        c = Canvas()
+        b1 = Box(20, 20)
+        b2 = Box(10, 10)
+        c.add_many([(b1, None), (b2, b1)])
+        self.assertEquals(set([b1, b2]), c.find_intersect((0, 0, 10, 10)))
+
+        b1.matrix.translate(500, 500)
+        c.request_matrix_update(b1)
+        self.assertEquals(set(), c.find_intersect((0, 0, 10, 10)))
+        self.assertEquals(set([b1, b2]), c.find_intersect((500, 500, 10, 10)))
+
+        b1.width = 100
+        c.request_update(b1)
+        self.assertEquals(set([b1]), c.find_intersect((590, 500, 10, 10)))
+
+        c.set_item_bounds(b2, (-5, -5, 20, 20))
+        self.assertEquals((495.0, 495.0, 20.0, 20.0), c.get_item_bounds(b2))
+
+        c.remove(b1)
+        self.assertEquals(set(), c.find_inside((0, 0, 1000, 1000)))
+
+
 class ConstraintProjectionTestCase(unittest.TestCase):
 
     def test_line_projection(self):
@@ -243,6 +357,45 @@ class CanvasConstraintTestCase(unittest.TestCase):
 
         # Expecting a class + line connected at one end only
         self.assertEquals(number_cons1 + 1, len(canvas.solver.constraints))
+
+    def test_remove_many(self):
+        canvas = Canvas()
+
+        from gaphas.aspect import Connector, ConnectionSink
+
+        l1 = Line()
+        b1 = Box()
+        b2 = Box()
+        b3 = Box()
+        canvas.add_many([(l1, None), (b1, None), (b2, b1), (b3, None)])
+        number_cons = len(canvas.solver.constraints)
+
+        Connector(l1, l1.handles()[0]).connect(ConnectionSink(b2, b2.ports()[0]))
+        Connector(l1, l1.handles()[1]).connect(ConnectionSink(b3, b3.ports()[0]))
+        self.assertEquals(number_cons + 2, len(canvas.solver.constraints))
+
+        canvas.remove_many([b2, b1])
+
+        self.assertEquals([l1, b3], canvas.get_all_items())
+        self.assertEquals(None, b1.canvas)
+        self.assertEquals(None, b2.canvas)
+        self.assertEquals(None, canvas.get_connection(l1.handles()[0]))
+        assert canvas.get_connection(l1.handles()[1])
+        self.assertEquals(number_cons + 1 - 2 * 6, len(canvas.solver.constraints))
+
+    def test_remove_many_nested(self):
+        """
+        Children of removed items are removed once, whether they're passed
+        as well or not.
+        """
+        canvas = Canvas()
+        b1, b2, b3, b4 = Box(), Box(), Box(), Box()
+        canvas.add_many([(b1, None), (b2, b1), (b3, b2), (b4, None)])
+
+        canvas.remove_many([b3, b1])
+        self.assertEquals([b4], canvas.get_all_items())
+        for item in (b1, b2, b3):
+            self.assertEquals(None, item.canvas)
         
 ###    def test_adding_constraint(self):
 ###        """Test adding canvas constraint"""
@@ -1,7 +1,8 @@
 import unittest
 
 from gaphas.solver import Variable
-from gaphas.constraint import PositionConstraint, LineAlignConstraint
+from gaphas.constraint import PositionConstraint, LineAlignConstraint, \
+    EquationConstraint
 
 class PositionTestCase(unittest.TestCase):
     def test_pos_constraint(self):
@@ -68,4 +69,79 @@ class LineAlignConstraintTestCase(unittest.TestCase):
         self.assertAlmostEqual(16.0, point[0].value, 2)
         self.assertAlmostEqual(12.00, point[1].value, 2)
 
+
+class EquationConstraintTestCase(unittest.TestCase):
+    """
+    Test solving equations.
+    """
+    def test_linear(self):
+        """Test linear equations are solved in one step"""
+        calls = []
+        def f(a, b):
+            calls.append(a)
+            return 3 * a - b * b
+        a, b = Variable(1.0), Variable(2.0)
+        eq = EquationConstraint(f, a=a, b=b)
+        eq.solve_for(a)
+        self.assertAlmostEquals(4.0 / 3, a.value, 9)
+        self.assertEquals(1, eq.iterations)
+        # Value, probe and check
+        self.assertEquals(3, len(calls))
+        for i in range(3, 10):
+            b.value = i
+            eq.solve_for(a)
+            self.assertAlmostEquals(i * i / 3.0, a.value, 9)
+        self.assertEquals(8, eq.iterations)
+        # The slope is not probed again
+        self.assertEquals(3 + 7 * 2, len(calls))
+
+    def test_linear_slope_change(self):
+        """Test linear equations whose slope depends on other arguments"""
+        a, b = Variable(1.0), Variable(2.0)
+        eq = EquationConstraint(lambda a, b: a * b - 6, a=a, b=b)
+        eq.solve_for(a)
+        self.assertAlmostEquals(3.0, a.value, 9)
+        b.value = 4.0
+        eq.solve_for(a)
+        self.assertAlmostEquals(1.5, a.value, 9)
+
+    def test_nonlinear(self):
+        """Test non-linear equations are warm started"""
+        a, b = Variable(1.0), Variable(2.0)
+        eq = EquationConstraint(lambda a, b: a * a - b, a=a, b=b)
+        eq.solve_for(a)
+        self.assertAlmostEquals(2 ** .5, a.value, 5)
+        first = eq.iterations
+        self.assertTrue(first > 1)
+
+        b.value = 2.1
+        eq.solve_for(a)
+        self.assertAlmostEquals(2.1 ** .5, a.value, 5)
+        self.assertTrue(eq.iterations - first < first)
+
+    def test_derivative(self):
+        a, b = Variable(3.0), Variable(2.0)
+        eq = EquationConstraint(lambda a, b: a * a * a - b, a=a, b=b)
+        eq.set_derivative('a', lambda a, b: 3 * a * a)
+        eq.solve_for(a)
+        self.assertAlmostEquals(2 ** (1 / 3.), a.value, 5)
+
+    def test_inverse(self):
+        a, b = Variable(3.0), Variable(2.0)
+        eq = EquationConstraint(lambda a, b: a * a * a - b, a=a, b=b)
+        eq.set_inverse('a', lambda a, b: b ** (1 / 3.))
+        eq.solve_for(a)
+        self.assertAlmostEquals(2 ** (1 / 3.), a.value, 9)
+        self.assertEquals(1, eq.iterations)
+
+        # Other arguments are still solved numerically
+        a.value = 2.0
+        eq.solve_for(b)
+        self.assertAlmostEquals(8.0, b.value, 5)
+
+    def test_unknown_argument(self):
+        a, b = Variable(3.0), Variable(2.0)
+        eq = EquationConstraint(lambda a, b: a - b, a=a, b=b)
+        self.assertRaises(KeyError, eq.set_inverse, 'c', lambda a, b: b)
+
 # vim: sw=4:et:ai
@@ -0,0 +1,87 @@
+"""
+Unit tests for the columnar matrix store.
+"""
+
+import unittest
+import random
+import math
+
+from gaphas.matrixstore import MatrixStore
+
+
+def multiply(a, b):
+    """
+    Multiply two matrices the cairo way, one at a time.
+    """
+    axx, ayx, axy, ayy, ax0, ay0 = a
+    bxx, byx, bxy, byy, bx0, by0 = b
+    return (axx * bxx + ayx * bxy, axx * byx + ayx * byy,
+            axy * bxx + ayy * bxy, axy * byx + ayy * byy,
+            ax0 * bxx + ay0 * bxy + bx0, ax0 * byx + ay0 * byy + by0)
+
+
+def random_matrix(rnd):
+    a = rnd.uniform(0, 2 * math.pi)
+    s = rnd.uniform(0.5, 2)
+    return (s * math.cos(a), s * math.sin(a), -s * math.sin(a), s * math.cos(a),
+            rnd.uniform(-100, 100), rnd.uniform(-100, 100))
+
+
+class MatrixStoreTestCase(unittest.TestCase):
+
+    def assertMatrix(self, m1, m2):
+        for a, b in zip(m1, m2):
+            self.assertAlmostEquals(a, b, 9)
+
+    def test_compose_tree(self):
+        """
+        Compose the matrices of a random tree of 500 items and compare
+        with composing them one by one.
+        """
+        rnd = random.Random(0)
+        items = range(500)
+        matrices = [random_matrix(rnd) for i in items]
+        parents = [-1] + [rnd.randint(-1, i - 1) for i in items[1:]]
+        store = MatrixStore()
+        store.update(items, matrices, parents)
+        self.assertEquals(500, len(store))
+
+        i2c = []
+        for i in items:
+            if parents[i] < 0:
+                i2c.append(matrices[i])
+            else:
+                i2c.append(multiply(matrices[i], i2c[parents[i]]))
+            self.assertMatrix(i2c[i], store.get_i2c(i))
+            self.assertMatrix((1, 0, 0, 1, 0, 0),
+                              multiply(store.get_i2c(i), store.get_c2i(i)))
+
+    def test_bases(self):
+        base = (2, 0, 0, 2, 5, 5)
+        store = MatrixStore()
+        store.update(['a'], [(1, 0, 0, 1, 1, 1)], [-1], {0: base})
+        self.assertMatrix((2, 0, 0, 2, 7, 7), store.get_i2c('a'))
+
+    def test_discard_reuses_rows(self):
+        store = MatrixStore(size=2)
+        store.update(['a', 'b', 'c'], [(1, 0, 0, 1, i, 0) for i in range(3)],
+                     [-1, -1, -1])
+        store.discard('b')
+        store.discard('b')
+        store.update(['d'], [(1, 0, 0, 1, 9, 0)], [-1])
+        self.assertEquals(3, len(store))
+        self.assertEquals(4, len(store._i2c))
+        self.assertMatrix((1, 0, 0, 1, 2, 0), store.get_i2c('c'))
+        self.assertMatrix((1, 0, 0, 1, 9, 0), store.get_i2c('d'))
+
+    def test_factory(self):
+        store = MatrixStore(factory=lambda *m: list(m))
+        store.update(['a'], [(1, 0, 0, 1, 1, 1)], [-1])
+        self.assertEquals([1.0, 0.0, 0.0, 1.0, 1.0, 1.0], store.get_i2c('a'))
+        self.assertRaises(KeyError, store.get_i2c, 'b')
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim:sw=4:et:ai
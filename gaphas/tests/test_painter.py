@@ -0,0 +1,103 @@
+"""
+Test cases for the painters.
+"""
+
+import unittest
+import struct
+import cairo
+
+from gaphas.canvas import Canvas, Context
+from gaphas.examples import Box
+from gaphas.geometry import Rectangle
+from gaphas.painter import ItemPainter, invalidate
+from gaphas.view import View
+
+
+class ItemPainterCacheTestCase(unittest.TestCase):
+    """
+    Test the surface cache of the ItemPainter.
+    """
+    def setUp(self):
+        self.canvas = Canvas()
+        self.view = View(self.canvas)
+        self.box = Box()
+        self.box.matrix.translate(10, 10)
+        self.canvas.add(self.box)
+        self.surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 100, 100)
+        self.view.update_bounding_box(cairo.Context(self.surface))
+
+        self.drawn = []
+        draw = self.box.draw
+        def counting_draw(context):
+            self.drawn.append(context)
+            draw(context)
+        self.box.draw = counting_draw
+
+        self.painter = ItemPainter(self.view)
+        self.painter.cache_size = 1000000
+
+    def paint(self):
+        self.painter.paint(Context(cairo=cairo.Context(self.surface),
+                                   items=[self.box],
+                                   area=Rectangle(0, 0, 100, 100)))
+
+    def alpha(self, x, y):
+        """
+        Return the alpha value of pixel (x, y) of the surface.
+        """
+        surface = self.surface
+        surface.flush()
+        # Pixels are native endian 32 bit ARGB values
+        offset = y * surface.get_stride() + x * 4
+        pixel, = struct.unpack('=I', surface.get_data()[offset:offset + 4])
+        return pixel >> 24
+
+    def test_reuse(self):
+        self.paint()
+        self.paint()
+        self.assertEquals(1, len(self.drawn))
+        self.assertEquals(1, len(self.painter._cache))
+        # The border of the box is painted in place
+        assert self.alpha(10, 15) > 0
+        self.assertEquals(0, self.alpha(5, 15))
+
+    def test_move(self):
+        """Test surfaces are reused when items are moved by whole pixels"""
+        self.paint()
+        self.box.matrix.translate(5, 0)
+        self.canvas.request_matrix_update(self.box)
+        self.canvas.update_now()
+        self.paint()
+        self.assertEquals(1, len(self.drawn))
+
+        self.box.matrix.translate(0.5, 0)
+        self.canvas.request_matrix_update(self.box)
+        self.canvas.update_now()
+        self.paint()
+        self.assertEquals(2, len(self.drawn))
+
+    def test_zoom(self):
+        self.paint()
+        self.view.zoom(2)
+        self.paint()
+        self.assertEquals(2, len(self.drawn))
+        self.assertEquals(1, len(self.painter._cache))
+
+    def test_invalidate(self):
+        self.paint()
+        invalidate(self.painter, [self.box])
+        self.paint()
+        self.assertEquals(2, len(self.drawn))
+
+    def test_invalidate_optional(self):
+        """Test painters do not need to implement invalidate()"""
+        class Painter(object):
+            def paint(self, context):
+                pass
+        invalidate(Painter(), [self.box])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim:sw=4:et:ai
@@ -0,0 +1,82 @@
+"""
+Unit tests for solving constraints in parallel.
+"""
+
+import unittest
+
+from gaphas.solver import Solver, Variable, WEAK
+from gaphas.constraint import EquationConstraint, EqualsConstraint, \
+    LineConstraint
+from gaphas.parallel import solve_parallel
+
+
+def sub(a, b):
+    return a - b
+
+
+def chains(groups, size):
+    """
+    Create a solver with ``groups`` independent chains of points, all
+    marked for solving.
+    """
+    solver = Solver()
+    for g in range(groups):
+        prev = None
+        for i in range(size):
+            x, y = Variable(i * 3), Variable(0, WEAK)
+            solver.add_constraint(EqualsConstraint(x, y, delta=g))
+            if prev:
+                point = Variable(i, WEAK), Variable(i, WEAK)
+                solver.add_constraint(LineConstraint(line=(prev, (x, y)), point=point))
+            prev = x, y
+    return solver
+
+
+def values(solver):
+    return sorted(v.value for c in solver.constraints for v in c.variables())
+
+
+class SolveParallelTestCase(unittest.TestCase):
+
+    def test_same_result_as_solve(self):
+        """Test parallel solving gives the same result as solve()"""
+        solver = chains(3, 20)
+        solver.solve()
+
+        parallel = chains(3, 20)
+        jobs = solve_parallel(parallel, processes=2, min_size=10)
+        self.assertEquals(3, jobs)
+        self.assertEquals(values(solver), values(parallel))
+        self.assertEquals(solver.solved_count, parallel.solved_count)
+        self.assertFalse(parallel._marked_cons)
+
+    def test_small_groups(self):
+        """Test small groups are solved in the current process"""
+        solver = chains(2, 5)
+        self.assertEquals(0, solve_parallel(solver, processes=2))
+        self.assertFalse(solver._marked_cons)
+        self.assertNotEquals(values(chains(2, 5)), values(solver))
+
+    def test_equation(self):
+        """Test equation constraints are pickled"""
+        solver = Solver()
+        a, b, c = Variable(3.0), Variable(0.0, WEAK), Variable(0.0, WEAK)
+        solver.add_constraint(EquationConstraint(sub, a=a, b=b))
+        solver.add_constraint(EqualsConstraint(a, c))
+        self.assertEquals(1, solve_parallel(solver, processes=1, min_size=1))
+        self.assertEquals(3.0, b.value)
+        self.assertEquals(3.0, c.value)
+
+    def test_unpicklable(self):
+        """Test groups that can not be pickled are solved locally"""
+        solver = Solver()
+        a, b = Variable(3.0), Variable(0.0, WEAK)
+        solver.add_constraint(EquationConstraint(lambda a, b: a - b, a=a, b=b))
+        self.assertEquals(0, solve_parallel(solver, processes=1, min_size=1))
+        self.assertEquals(3.0, b.value)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim:sw=4:et:ai
@@ -1,6 +1,6 @@
 
 import unittest
-from gaphas.quadtree import Quadtree
+from gaphas.quadtree import Quadtree, SpatialIndex
 
 class QuadtreeTestCase(unittest.TestCase):
 
@@ -92,6 +92,41 @@ class QuadtreeTestCase(unittest.TestCase):
         self.assertEquals((0, 0, 20, 20), qtree.get_clipped_bounds(1))
 
 
+class SpatialIndexTestCase(unittest.TestCase):
+
+    def test_grow(self):
+        index = SpatialIndex()
+        for i in range(-50, 50):
+            index.add(i, (i * 100, i * 50, 10, 10))
+        self.assertEquals(100, len(index))
+        for i in range(-50, 50):
+            self.assertEquals((i * 100, i * 50, 10, 10), index.get_clipped_bounds(i))
+            self.assertEquals(set([i]), index.find_intersect((i * 100 + 1, i * 50 + 1, 1, 1)))
+
+    def test_move_item(self):
+        index = SpatialIndex()
+        index.add('a', (0, 0, 10, 10))
+        index.add('a', (5000, 5000, 10, 10))
+        self.assertEquals(set(), index.find_intersect((0, 0, 10, 10)))
+        self.assertEquals(set(['a']), index.find_intersect((5000, 5000, 1, 1)))
+        index.remove('a')
+        self.assertEquals(0, len(index))
+
+    def test_find_nearest(self):
+        index = SpatialIndex()
+        self.assertEquals(set(), index.find_nearest((0, 0)))
+        index.add('a', (0, 0, 10, 10))
+        index.add('b', (100, 0, 10, 10))
+        index.add('c', (40, 45, 10, 10))
+        self.assertEquals(set(['a']), index.find_nearest((5, 5)))
+        self.assertEquals(set(['a']), index.find_nearest((-1000, 0)))
+        self.assertEquals(set(['b']), index.find_nearest((1000, 1000)))
+        self.assertEquals(set(['c']), index.find_nearest((30, 30)))
+        self.assertEquals(set(['a', 'c']), index.find_nearest((25, 27.5)))
+        self.assertEquals(set(), index.find_nearest((30, 30), distance=10))
+        self.assertEquals(set(['c']), index.find_nearest((30, 30), distance=30))
+
+
 if __name__ == '__main__':
     unittest.main()
 
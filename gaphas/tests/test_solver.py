@@ -5,7 +5,8 @@ Unit tests for Gaphas' solver.
 import unittest
 from timeit import Timer
 
-from gaphas.solver import Solver, Variable
+from gaphas.solver import Solver, Variable, NORMAL, WEAK, VERY_WEAK, \
+    JuggleError, Instrumentation
 from gaphas.constraint import EquationConstraint, EqualsConstraint, \
     LessThanConstraint
 
@@ -86,6 +87,17 @@ class WeakestVariableTestCase(unittest.TestCase):
         self.assertEqual(c_eq._weakest, [b])
 
 
+    def test_float_strength(self):
+        """Test strengths in between the predefined strengths"""
+        solver = Solver()
+        a = Variable(1, 30.5)
+        b = Variable(2, 30)
+        c_eq = EqualsConstraint(a, b)
+        solver.add_constraint(c_eq)
+        self.assertEqual(30.5, a.strength)
+        self.assertEqual(c_eq.weakest(), b)
+
+
 
 class SizeTestCase(unittest.TestCase):
     """
@@ -137,6 +149,637 @@ class SizeTestCase(unittest.TestCase):
 
 
 
+def chain(solver, n):
+    """
+    Create a chain of ``n`` equals constraints, each constraint
+    solving for a weaker variable than the previous one.
+    """
+    variables = [Variable(0, 100 - i) for i in range(n + 1)]
+    for a, b in zip(variables[:-1], variables[1:]):
+        solver.add_constraint(EqualsConstraint(a, b))
+    return variables
+
+
+class TopologicalTestCase(unittest.TestCase):
+    """
+    Test solving constraints in topological order.
+    """
+    def test_chain(self):
+        """Test a chain is solved once per constraint"""
+        solver = Solver()
+        solver.topological = True
+        variables = chain(solver, 10)
+        solver.solve()
+
+        variables[0].value = 5
+        solver.solved_count = solver.saved_count = 0
+        solver.solve()
+
+        for v in variables:
+            self.assertEquals(5, v)
+        self.assertEquals(10, solver.solved_count)
+
+    def test_chain_marked_in_reverse(self):
+        """Test constraints marked out of order are solved once"""
+        solver = Solver()
+        solver.topological = True
+        variables = chain(solver, 10)
+        solver.solve()
+
+        variables[1].value = 1
+        variables[0].value = 5
+        solver.solved_count = solver.saved_count = 0
+        solver.solve()
+
+        for v in variables:
+            self.assertEquals(5, v)
+        self.assertEquals(10, solver.solved_count)
+        self.assertTrue(solver.saved_count > 0)
+
+    def test_same_result_as_default(self):
+        """Test topological solving yields the same result"""
+        for topological in (False, True):
+            solver = Solver()
+            solver.topological = topological
+            v1 = Variable(0)
+            v2 = Variable(10)
+            v3 = Variable(10)
+            solver.add_constraint(EqualsConstraint(a=v2, b=v3))
+            solver.add_constraint(LessThanConstraint(smaller=v1, bigger=v3, delta=10))
+            solver.solve()
+
+            v3.value = 0
+            solver.solve()
+
+            self.assertEquals(0, v1)
+            self.assertEquals(10, v2)
+            self.assertEquals(10, v3)
+
+
+
+class PriorityTestCase(unittest.TestCase):
+    """
+    Test solving constraints in order of priority.
+    """
+    def test_chain_marked_in_reverse(self):
+        """Test constraints marked out of order are solved once"""
+        solver = Solver()
+        solver.priority = True
+        variables = chain(solver, 10)
+        solver.solve()
+
+        variables[1].value = 1
+        variables[0].value = 5
+        solver.solved_count = solver.saved_count = 0
+        solver.solve()
+
+        for v in variables:
+            self.assertEquals(5, v)
+        self.assertEquals(10, solver.solved_count)
+        self.assertTrue(solver.saved_count > 0)
+
+    def test_same_result_as_default(self):
+        """Test priority solving yields the same result"""
+        results = []
+        for priority in (False, True):
+            solver = Solver()
+            solver.priority = priority
+            v1, v2, v3, v4 = Variable(0), Variable(10), Variable(10), Variable(3, WEAK)
+            solver.add_constraint(LessThanConstraint(smaller=v1, bigger=v3, delta=10))
+            solver.add_constraint(EqualsConstraint(a=v2, b=v3))
+            solver.add_constraint(EqualsConstraint(a=v4, b=v3))
+            solver.solve()
+
+            v3.value = 0
+            solver.solve()
+            results.append((v1.value, v2.value, v3.value, v4.value))
+        self.assertEquals(results[0], results[1])
+
+
+class BatchTestCase(unittest.TestCase):
+    """
+    Test solving constraints with batch kernels.
+    """
+    def _solve(self, batch):
+        solver = Solver()
+        solver.topological = True
+        solver.batch = batch
+        variables = []
+        for i in range(40):
+            a, b, c = Variable(i), Variable(0, WEAK), Variable(i, WEAK - 1)
+            d, e = Variable(i), Variable(i % 7)
+            solver.add_constraint(EqualsConstraint(a, b, delta=1))
+            solver.add_constraint(EqualsConstraint(b, c))
+            solver.add_constraint(LessThanConstraint(smaller=d, bigger=e, delta=i % 3))
+            variables.extend((a, b, c, d, e))
+        solver.solve()
+        return [v.value for v in variables]
+
+    def test_batch(self):
+        """Test batch solving yields the same result"""
+        try:
+            import numpy
+        except ImportError:
+            return
+        self.assertEquals(self._solve(False), self._solve(True))
+
+
+
+class VariableStoreTestCase(unittest.TestCase):
+    """
+    Test storage of variable values in the solver.
+    """
+    def test_add_remove(self):
+        """Test variables are moved in and out of the store"""
+        solver = Solver()
+        a, b, c = Variable(1.0), Variable(2.0), Variable(3.0)
+        c_ab = solver.add_constraint(EqualsConstraint(a, b))
+        c_bc = solver.add_constraint(EqualsConstraint(b, c))
+        self.assertEquals(3, len(solver.store))
+
+        solver.remove_constraint(c_ab)
+        self.assertEquals(2, len(solver.store))
+        self.assertTrue(a not in solver.store)
+        self.assertTrue(b in solver.store)
+        self.assertEquals(1.0, a.value)
+
+        solver.remove_constraint(c_bc)
+        self.assertEquals(0, len(solver.store))
+        self.assertEquals(2.0, b.value)
+        self.assertEquals(3.0, c.value)
+
+    def test_pickle(self):
+        """Test pickling a solver with stored variables"""
+        import pickle
+        solver = Solver()
+        a, b = Variable(1.0), Variable(2.0, WEAK)
+        solver.add_constraint(EqualsConstraint(a, b))
+        solver.solve()
+
+        solver, a, b = pickle.loads(pickle.dumps((solver, a, b)))
+        self.assertTrue(a._store is solver.store)
+        a.value = 4.0
+        solver.solve()
+        self.assertEquals(4.0, b.value)
+        self.assertEquals(WEAK, b.strength)
+
+    def test_bulk_values(self):
+        """Test reading and writing values through store indices"""
+        solver = Solver()
+        a, b = Variable(1.0), Variable(2.0)
+        c, d = Variable(3.0), Variable(3.0)
+        solver.add_constraint(EqualsConstraint(a, b))
+        solver.add_constraint(EqualsConstraint(c, d))
+        solver.solve()
+
+        indices = solver.store.indices([c, a])
+        self.assertEquals([3.0, 2.0], list(solver.get_values(indices)))
+        solver.set_values(indices, [3.0, 8.0])
+        self.assertEquals(8.0, a.value)
+        # Only the constraint of the changed variable is marked
+        self.assertEquals(1, len(solver._marked_cons))
+        solver.solve()
+        self.assertEquals(8.0, b.value)
+
+    def test_bulk_values_without_numpy(self):
+        """Test bulk access to the store if NumPy is not available"""
+        import gaphas.solver
+        numpy = gaphas.solver.numpy
+        gaphas.solver.numpy = None
+        try:
+            self.test_bulk_values()
+        finally:
+            gaphas.solver.numpy = numpy
+
+
+class RelaxationTestCase(unittest.TestCase):
+    """
+    Test solving cyclic constraints by relaxation.
+    """
+    def _cycle(self, solver):
+        a, b = Variable(0.0), Variable(0.0)
+        c1 = EquationConstraint(lambda a, b: b - 0.5 * a, a=a, b=b)
+        c2 = EquationConstraint(lambda a, b: a - 0.5 * b - 1, a=a, b=b)
+        # Solve c1 for b and c2 for a, regardless of the keyword order
+        c1.mark_dirty(a)
+        c2.mark_dirty(b)
+        solver.add_constraint(c1)
+        solver.add_constraint(c2)
+        return a, b
+
+    def test_converges(self):
+        solver = Solver()
+        solver.relaxation = True
+        a, b = self._cycle(solver)
+        solver.solve()
+        self.assertAlmostEquals(4.0 / 3, a.value, 5)
+        self.assertAlmostEquals(2.0 / 3, b.value, 5)
+        residuals = solver.residuals
+        self.assertTrue(residuals[-1] < solver.tolerance)
+        self.assertEquals(sorted(residuals, reverse=True), residuals)
+
+    def test_converges_topological(self):
+        solver = Solver()
+        solver.relaxation = True
+        solver.topological = True
+        a, b = self._cycle(solver)
+        solver.solve()
+        self.assertAlmostEquals(4.0 / 3, a.value, 5)
+        self.assertTrue(solver.residuals[-1] < solver.tolerance)
+
+    def test_tolerance(self):
+        solver = Solver()
+        solver.relaxation = True
+        solver.tolerance = 0.1
+        a, b = self._cycle(solver)
+        solver.solve()
+        residuals = solver.residuals
+        self.assertTrue(residuals[-2] >= 0.1 > residuals[-1], residuals)
+        self.assertFalse(solver._marked_cons)
+
+    def test_budget(self):
+        """Test juggling constraints are solved in bounded time"""
+        solver = Solver()
+        a, b = Variable(1.0), Variable(2.0)
+        solver.add_constraint(EqualsConstraint(a, b))
+        solver.add_constraint(EqualsConstraint(a, b, delta=1.0))
+        if __debug__:
+            self.assertRaises(JuggleError, solver.solve)
+
+        solver.relaxation = True
+        solver.max_iterations = 20
+        a.value = 0.0
+        solver.solve()
+        self.assertEquals(20, len(solver.residuals))
+        self.assertFalse(solver._marked_cons)
+
+
+class DirtyQueueTestCase(unittest.TestCase):
+    """
+    Test the queue of marked constraints.
+    """
+    def test_mark_order(self):
+        """Test marking a constraint again moves it to the end"""
+        solver = Solver()
+        a, b, c = Variable(1.0), Variable(2.0), Variable(3.0)
+        c_ab = solver.add_constraint(EqualsConstraint(a, b))
+        c_c = solver.add_constraint(LessThanConstraint(c, Variable(5.0)))
+        self.assertEquals([c_ab, c_c], list(solver._marked_cons))
+        a.value = 4.0
+        self.assertEquals([c_c, c_ab], list(solver._marked_cons))
+
+    def test_remove_marked(self):
+        solver = Solver()
+        a, b = Variable(1.0), Variable(2.0)
+        c_ab = solver.add_constraint(EqualsConstraint(a, b))
+        solver.remove_constraint(c_ab)
+        self.assertEquals(0, len(solver._marked_cons))
+
+    def test_juggle_counter_reset(self):
+        """Test the juggle counters do not carry over to the next solve"""
+        solver = Solver()
+        a, b = Variable(1.0), Variable(2.0, WEAK)
+        solver.add_constraint(EqualsConstraint(a, b))
+        for i in range(2 * solver.max_iterations):
+            a.value = i
+            solver.solve()
+        self.assertEquals(a.value, b.value)
+
+
+class ConstraintsWithVariableTestCase(unittest.TestCase):
+    """
+    Test looking up constraints by variable.
+    """
+    def test_lookup(self):
+        from gaphas.solver import Projection
+        solver = Solver()
+        a, b, c = Variable(1.0), Variable(1.0), Variable(1.0)
+        c_ab = solver.add_constraint(EqualsConstraint(a, b))
+        c_bc = solver.add_constraint(EqualsConstraint(Projection(b), c))
+        self.assertEquals((b, c), c_bc._solver_variables)
+        self.assertEquals(set([c_ab, c_bc]), set(solver.constraints_with_variable(b)))
+        self.assertEquals([c_bc], list(solver.constraints_with_variable(c, b)))
+        self.assertEquals([], list(solver.constraints_with_variable(a, c)))
+
+        # Constraints can be removed while iterating
+        for cons in solver.constraints_with_variable(b):
+            solver.remove_constraint(cons)
+        self.assertEquals([], list(solver.constraints_with_variable(b)))
+
+
+class InstrumentationTestCase(unittest.TestCase):
+    """
+    Test recording what the solver does.
+    """
+    def _solve(self, **modes):
+        solver = Solver()
+        for mode, value in modes.items():
+            setattr(solver, mode, value)
+        instrumentation = solver.instrumentation = Instrumentation()
+        variables = chain(solver, 20)
+        variables[1].value = 1
+        variables[0].value = 5
+        solver.solve()
+        self.assertEquals(solver.solved_count, instrumentation.report()['calls'])
+        return solver, instrumentation
+
+    def test_modes(self):
+        self._solve()
+        self._solve(topological=True)
+        self._solve(topological=True, batch=True)
+        self._solve(priority=True)
+        self._solve(relaxation=True)
+
+    def test_report(self):
+        solver, instrumentation = self._solve()
+        report = instrumentation.report()
+        self.assertEquals(1, report['solves'])
+        self.assertEquals(20, len(report['constraints']))
+        self.assertEquals(['EqualsConstraint'], report['classes'].keys())
+        marker, marked, n = report['remarks'][0]
+        self.assertTrue(instrumentation.depth[marked] > 0)
+        deepest = instrumentation.top(1, key='depth')[0]
+        chain = instrumentation.chain(deepest['constraint'])
+        self.assertEquals(deepest['depth'] + 1, len(chain))
+        self.assertTrue(instrumentation.summary(5))
+
+    def test_csv(self):
+        from StringIO import StringIO
+        solver, instrumentation = self._solve()
+        f = StringIO()
+        instrumentation.to_csv(f)
+        lines = f.getvalue().splitlines()
+        self.assertEquals('class,constraint,calls,time,changed,remarks,depth', lines[0])
+        self.assertEquals(21, len(lines))
+
+    def test_reset(self):
+        """Test records are reset per solve, unless cumulative"""
+        solver = Solver()
+        solver.instrumentation = Instrumentation()
+        variables = chain(solver, 3)
+        solver.solve()
+        solver.solve()
+        self.assertEquals(0, solver.instrumentation.report()['calls'])
+
+        solver.instrumentation = Instrumentation(cumulative=True)
+        solved_count = solver.solved_count
+        variables[0].value = 7
+        solver.solve()
+        solver.solve()
+        self.assertEquals(2, solver.instrumentation.solves)
+        self.assertEquals(solver.solved_count - solved_count,
+                solver.instrumentation.report()['calls'])
+
+    def test_disabled(self):
+        solver = Solver()
+        chain(solver, 3)
+        solver.solve()
+        self.assertFalse('_solve_one' in solver.__dict__)
+
+
+class CompiledNetworkTestCase(unittest.TestCase):
+    """
+    Test compiled constraint networks.
+    """
+    def test_drag(self):
+        """Test a compiled network gives the same result as solve()"""
+        solver, compiled = Solver(), Solver()
+        variables = chain(solver, 20)
+        compiled_variables = chain(compiled, 20)
+        solver.solve()
+        compiled.solve()
+        network = compiled.compile(compiled.constraints_with_variable(compiled_variables[0]))
+        for i in range(10):
+            variables[0].value = i
+            compiled_variables[0].value = i
+            solver.solve()
+            network()
+            self.assertEquals(0, len(compiled._marked_cons))
+            self.assertEquals([v.value for v in variables],
+                              [v.value for v in compiled_variables])
+        self.assertEquals(20, len(network.constraints))
+
+    def test_invalidate(self):
+        """Test networks are recompiled when the topology changes"""
+        solver = Solver()
+        variables = chain(solver, 3)
+        solver.solve()
+        network = solver.compile(solver.constraints_with_variable(variables[0]))
+        network()
+        self.assertEquals(3, len(network.constraints))
+
+        extra = Variable(0.0, 1)
+        eq = solver.add_constraint(EqualsConstraint(variables[-1], extra))
+        solver.remove_constraint(iter(solver.constraints_with_variable(variables[1], variables[2])).next())
+        variables[0].value = 3.0
+        network()
+        self.assertEquals(1, len(network.constraints))
+        self.assertEquals(3.0, variables[1].value)
+        self.assertEquals(0.0, extra.value)
+
+        # The new constraint is not part of the network, solve() handles it
+        self.assertEquals([eq], list(solver._marked_cons))
+        solver.solve()
+        self.assertEquals(variables[-1].value, extra.value)
+
+    def test_disabled(self):
+        """Test constraints disabled after compiling are not solved"""
+        solver = Solver()
+        variables = chain(solver, 3)
+        solver.solve()
+        network = solver.compile(solver.constraints_with_variable(variables[0]))
+        network()
+
+        c = iter(solver.constraints_with_variable(variables[1], variables[2])).next()
+        c.disabled = True
+        variables[0].value = 3.0
+        network()
+        self.assertEquals(3.0, variables[1].value)
+        self.assertEquals(0.0, variables[2].value)
+
+        c.disabled = False
+        variables[0].value = 4.0
+        network()
+        self.assertEquals(4.0, variables[2].value)
+
+    def test_strength_change(self):
+        """Test the network is compiled again when a strength changes"""
+        solver = Solver()
+        a, b = Variable(1.0), Variable(2.0, WEAK)
+        eq = solver.add_constraint(EqualsConstraint(a, b))
+        solver.solve()
+        network = solver.compile([eq])
+        network()
+
+        # E.g. a handle is connected while it's dragged
+        a.strength = VERY_WEAK
+        b.value = 5.0
+        network()
+        self.assertEquals(5.0, a.value)
+        self.assertEquals(5.0, b.value)
+
+    def test_strength_change_order(self):
+        """Test constraints are solved in order of the new strengths"""
+        solver = Solver()
+        a, b, c = Variable(1.0), Variable(2.0, WEAK), Variable(3.0, VERY_WEAK)
+        eq_a_b = solver.add_constraint(EqualsConstraint(a, b))
+        eq_b_c = solver.add_constraint(EqualsConstraint(b, c))
+        solver.solve()
+        network = solver.compile([eq_a_b, eq_b_c])
+        network()
+
+        # Now eq_b_c should be solved for b before eq_a_b is solved for a
+        a.strength = VERY_WEAK
+        c.strength = NORMAL
+        c.value = 7.0
+        network()
+        self.assertEquals(7.0, b.value)
+        self.assertEquals(7.0, a.value)
+
+    def test_cycle(self):
+        solver = Solver()
+        a, b = Variable(0.0), Variable(0.0)
+        c1 = EquationConstraint(lambda a, b: b - 0.5 * a, a=a, b=b)
+        c2 = EquationConstraint(lambda a, b: a - 0.5 * b - 1, a=a, b=b)
+        # Solve c1 for b and c2 for a, regardless of the keyword order
+        c1.mark_dirty(a)
+        c2.mark_dirty(b)
+        solver.add_constraint(c1)
+        solver.add_constraint(c2)
+        network = solver.compile(solver.constraints)
+        network()
+        self.assertTrue('cycle_0()' in network.source)
+        self.assertAlmostEquals(4.0 / 3, a.value, 5)
+        self.assertAlmostEquals(2.0 / 3, b.value, 5)
+
+
+class PreviewTestCase(unittest.TestCase):
+    """
+    Test dry runs of the solver.
+    """
+    def setUp(self):
+        from gaphas import state
+        self.events = []
+        state.observers.add(state.revert_handler)
+        state.subscribers.add(self._handler)
+
+    def tearDown(self):
+        from gaphas import state
+        state.observers.discard(state.revert_handler)
+        state.subscribers.discard(self._handler)
+
+    def _handler(self, event):
+        self.events.append(event)
+
+    def test_discard(self):
+        solver = Solver()
+        variables = chain(solver, 5)
+        solver.solve()
+        c = solver.add_constraint(LessThanConstraint(variables[0], Variable(10)))
+        del self.events[:]
+
+        with solver.preview() as preview:
+            variables[0].value = 5
+            preview.solve()
+            self.assertEquals(6, len(preview.diff()))
+            self.assertEquals([5] * 6, [v.value for v in variables])
+        self.assertEquals([0] * 6, [v.value for v in variables])
+        self.assertEquals([], self.events)
+        self.assertEquals([c], list(solver._marked_cons))
+
+    def test_discard_bulk(self):
+        """Test values set in bulk are restored"""
+        solver = Solver()
+        variables = chain(solver, 5)
+        solver.solve()
+
+        with solver.preview() as preview:
+            solver.set_values(solver.store.indices(variables[:1]), [5.0])
+            solver.set_values(variables[1:2], [6.0])
+            self.assertEquals(2, len(preview._changed))
+            preview.solve()
+        self.assertEquals([0] * 6, [v.value for v in variables])
+
+    def test_commit(self):
+        from gaphas.state import saveapply
+        solver = Solver()
+        variables = chain(solver, 5)
+        solver.solve()
+        del self.events[:]
+
+        preview = solver.preview()
+        variables[0].value = 5
+        preview.solve()
+        variables[0].value = 6
+        preview.solve()
+        diff = preview.commit()
+        self.assertEquals((0, 6), diff[variables[-1]])
+        self.assertEquals(0, len(solver._marked_cons))
+        self.assertEquals([6] * 6, [v.value for v in variables])
+
+        # One undo event per changed variable
+        self.assertEquals(6, len(self.events))
+        events = list(self.events)
+        for event in reversed(events):
+            saveapply(*event)
+        self.assertEquals([0] * 6, [v.value for v in variables])
+
+    def test_other_changes(self):
+        """Test changes outside the solver are not part of the preview"""
+        solver, other = Solver(), Solver()
+        variables = chain(solver, 2)
+        other_variables = chain(other, 2)
+        free = Variable(1.0)
+        solver.solve()
+        other.solve()
+        del self.events[:]
+
+        with solver.preview() as preview:
+            variables[0].value = 5
+            other_variables[0].value = 5
+            free.value = 5
+            other.solve()
+            preview.solve()
+            self.assertEquals(3, len(preview.diff()))
+        self.assertEquals([0] * 3, [v.value for v in variables])
+        self.assertEquals([5] * 3, [v.value for v in other_variables])
+        self.assertEquals(5, free.value)
+        # Events for the variables of the other solver and the free variable
+        self.assertEquals(4, len(self.events))
+
+    def test_topology_change(self):
+        solver = Solver()
+        variables = chain(solver, 2)
+        with solver.preview() as preview:
+            solver.add_constraint(EqualsConstraint(variables[0], Variable()))
+            self.assertRaises(AssertionError, preview.solve)
+
+
+class PartitionTestCase(unittest.TestCase):
+    """
+    Test partitioning of constraints in independent groups.
+    """
+    def test_partition(self):
+        solver = Solver()
+        a, b, c, d, e = [Variable(i) for i in range(5)]
+        c_ab = solver.add_constraint(EqualsConstraint(a, b))
+        c_de = solver.add_constraint(EqualsConstraint(d, e))
+        c_bc = solver.add_constraint(LessThanConstraint(b, c))
+        groups = solver.partition()
+        self.assertEquals(2, len(groups))
+        groups = sorted(map(frozenset, groups), key=len)
+        self.assertEquals(set([c_de]), groups[0])
+        self.assertEquals(set([c_ab, c_bc]), groups[1])
+
+    def test_partition_subset(self):
+        solver = Solver()
+        a, b, c = Variable(1), Variable(2), Variable(3)
+        c_ab = solver.add_constraint(EqualsConstraint(a, b))
+        c_bc = solver.add_constraint(EqualsConstraint(b, c))
+        self.assertEquals([[c_bc]], solver.partition([c_bc]))
+
+
+
 class SolverSpeedTestCase(unittest.TestCase):
     """
     Solver speed tests.
@@ -0,0 +1,110 @@
+"""
+Unit tests for the tile and surface caches.
+"""
+
+import unittest
+
+from gaphas.tilecache import TileCache, SurfaceCache
+
+
+class TileCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.rendered = []
+
+    def render(self, i, j):
+        self.rendered.append((i, j))
+        return i, j
+
+    def test_reuse_tiles(self):
+        cache = TileCache(size=100)
+        tiles = cache.get_tiles(1.0, (-50, -50, 100, 100), self.render)
+        self.assertEquals([(-1, -1), (0, -1), (-1, 0), (0, 0)], [k for k, t in tiles])
+        self.assertEquals(4, len(self.rendered))
+
+        # Scroll: only new tiles are rendered
+        tiles = cache.get_tiles(1.0, (-10, -50, 150, 100), self.render)
+        self.assertEquals(6, len(tiles))
+        self.assertEquals([(1, -1), (1, 0)], self.rendered[4:])
+
+    def test_invalidate(self):
+        cache = TileCache(size=100)
+        cache.get_tiles(2.0, (0, 0, 400, 400), self.render)
+        self.assertEquals(16, len(cache))
+
+        # Canvas coordinates are scaled
+        cache.invalidate((60, 60, 10, 10))
+        self.assertEquals(15, len(cache))
+        assert (1, 1) not in cache
+
+        # A large area, compared to the number of tiles
+        cache.invalidate((-1000, 110, 5000, 5000))
+        self.assertEquals(7, len(cache))
+        assert (3, 1) in cache
+        assert (3, 2) not in cache
+
+    def test_scale(self):
+        cache = TileCache(size=100)
+        cache.get_tiles(1.0, (0, 0, 100, 100), self.render)
+        cache.get_tiles(1.5, (0, 0, 100, 100), self.render)
+        self.assertEquals(1, len(cache))
+        self.assertEquals(1.5, cache.scale)
+        self.assertEquals([(0, 0), (0, 0)], self.rendered)
+
+    def test_max_tiles(self):
+        cache = TileCache(size=10, max_tiles=4)
+        cache.get_tiles(1.0, (0, 0, 20, 20), self.render)
+        cache.get_tiles(1.0, (0, 0, 10, 10), self.render)
+        cache.get_tiles(1.0, (20, 0, 10, 10), self.render)
+        self.assertEquals(4, len(cache))
+        # Least recently used tile is dropped
+        assert (1, 0) not in cache
+        assert (0, 0) in cache
+
+
+class SurfaceCacheTestCase(unittest.TestCase):
+
+    def test_get(self):
+        cache = SurfaceCache(max_size=100)
+        cache.put('a', (1.0, 0), 'a1', 40)
+        self.assertEquals('a1', cache.get('a', (1.0, 0)))
+        self.assertEquals(None, cache.get('b', (1.0, 0)))
+
+        # Another key drops the surface
+        self.assertEquals(None, cache.get('a', (2.0, 0)))
+        assert 'a' not in cache
+        self.assertEquals(0, cache.size)
+
+    def test_put_replaces(self):
+        cache = SurfaceCache(max_size=100)
+        cache.put('a', 1, 'a1', 40)
+        cache.put('a', 2, 'a2', 50)
+        self.assertEquals(1, len(cache))
+        self.assertEquals(50, cache.size)
+        self.assertEquals('a2', cache.get('a', 2))
+
+    def test_max_size(self):
+        cache = SurfaceCache(max_size=100)
+        cache.put('a', 1, 'a', 40)
+        cache.put('b', 1, 'b', 40)
+        cache.get('a', 1)
+        cache.put('c', 1, 'c', 40)
+        # Least recently used surface is dropped
+        assert 'b' not in cache
+        assert 'a' in cache
+        assert 'c' in cache
+        self.assertEquals(80, cache.size)
+
+    def test_discard(self):
+        cache = SurfaceCache(max_size=100)
+        cache.put('a', 1, 'a', 40)
+        cache.discard('a')
+        cache.discard('b')
+        self.assertEquals(0, len(cache))
+        self.assertEquals(0, cache.size)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# vim:sw=4:et:ai
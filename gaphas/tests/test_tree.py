@@ -1,5 +1,6 @@
 
 import unittest
+import random
 from gaphas.tree import Tree
 
 
@@ -160,4 +161,130 @@ class TreeTestCase(unittest.TestCase):
         assert tree.nodes == [n4, n5, n1, n2, n3], tree.nodes
 
 
+class OrderTestCase(unittest.TestCase):
+
+    def depth_first(self, tree, parent=None):
+        nodes = []
+        for c in tree.get_children(parent):
+            nodes.append(c)
+            nodes.extend(self.depth_first(tree, c))
+        return nodes
+
+    def check(self, tree):
+        nodes = self.depth_first(tree)
+        assert tree.nodes == nodes, (tree.nodes, nodes)
+        keys = map(tree.get_order_key, nodes)
+        assert keys == sorted(keys) and len(set(keys)) == len(keys)
+        assert keys == tree._labels
+        assert tree._tokens == sorted(tree._tokens)
+        assert len(tree._tokens) == 2 * len(nodes)
+        for i, n in enumerate(nodes):
+            assert tree.get_index(n) == i
+            assert list(tree.get_all_children(n)) == self.depth_first(tree, n)
+            for a in tree.get_ancestors(n):
+                assert tree.is_ancestor(a, n)
+                assert not tree.is_ancestor(n, a)
+
+    def test_insert_at_same_position(self):
+        """
+        Labels are spread out when nodes are inserted at the same spot
+        over and over.
+        """
+        tree = Tree()
+        tree.add('a')
+        tree.add('b')
+        for i in range(1, 200):
+            tree.add(i, parent='a', index=0)
+            tree.add(-i, index=1)
+        self.check(tree)
+        assert tree.get_children('a') == range(199, 0, -1)
+
+    def test_random_changes(self):
+        """
+        Add, remove and reparent nodes at random and compare the tree with
+        a depth-first traversal of the children.
+        """
+        rnd = random.Random(0)
+        tree = Tree()
+        nodes = []
+        for i in range(1, 2000):
+            op = rnd.random()
+            if op < 0.6 or len(nodes) < 3:
+                parent = rnd.choice(nodes + [None])
+                siblings = tree.get_children(parent)
+                index = rnd.choice([None, rnd.randint(0, len(siblings))])
+                tree.add(i, parent=parent, index=index)
+                nodes.append(i)
+            elif op < 0.8:
+                node = rnd.choice(nodes)
+                tree.remove(node)
+                nodes = tree.nodes
+            else:
+                node = rnd.choice(nodes)
+                parent = rnd.choice(nodes + [None])
+                if parent == node or parent in tree.get_all_children(node):
+                    continue
+                tree.reparent(node, parent, index=rnd.choice([None, 0]))
+            if i % 100 == 0:
+                self.check(tree)
+                a, b = rnd.choice(nodes), rnd.choice(nodes)
+                assert tree.is_ancestor(a, b) == (a in tree.get_ancestors(b))
+        self.check(tree)
+        selection = rnd.sample(nodes, len(nodes) // 2)
+        assert tree.sort(selection) == [n for n in tree.nodes if n in set(selection)]
+
+    def test_is_ancestor(self):
+        tree = Tree()
+        tree.add('n1')
+        tree.add('n2', parent='n1')
+        tree.add('n3', parent='n2')
+        tree.add('n4', parent='n1')
+        tree.add('n5')
+        assert tree.is_ancestor('n1', 'n3')
+        assert tree.is_ancestor('n2', 'n3')
+        assert not tree.is_ancestor('n2', 'n4')
+        assert not tree.is_ancestor('n1', 'n5')
+        tree.reparent('n2', 'n5')
+        assert not tree.is_ancestor('n1', 'n3')
+        assert tree.is_ancestor('n5', 'n3')
+        assert list(tree.get_all_children('n5')) == ['n2', 'n3']
+        assert list(tree.get_all_children('n1')) == ['n4']
+
+    def test_nodes_view(self):
+        tree = Tree()
+        tree.add('n1')
+        tree.add('n2', parent='n1')
+        view = tree.get_nodes_view()
+        generation = tree.generation
+        assert list(view) == ['n1', 'n2']
+        assert list(reversed(view)) == ['n2', 'n1']
+        assert not view.changed
+        tree.reparent('n2', None)
+        assert view.changed
+        assert tree.generation > generation
+        generation = tree.generation
+        tree.get_all_children('n1')
+        tree.sort(['n2', 'n1'])
+        assert tree.generation == generation
+        tree.remove('n2')
+        assert tree.generation > generation
+        assert list(view) == ['n1'] and 'n2' not in view
+
+    def test_unpickle_without_labels(self):
+        import pickle
+        tree = Tree()
+        tree.add('n1')
+        tree.add('n2', parent='n1')
+        tree.add('n3')
+        state = dict(tree.__dict__)
+        for n in ('_label', '_end', '_labels', '_tokens', '_token_nodes'):
+            del state[n]
+        tree = Tree.__new__(Tree)
+        tree.__setstate__(state)
+        self.check(tree)
+        assert tree.is_ancestor('n1', 'n2')
+        tree = pickle.loads(pickle.dumps(tree))
+        self.check(tree)
+
+
 # vi:sw=4:et:ai
@@ -93,7 +93,70 @@ class UndoTestCase(unittest.TestCase):
 
 #        self.assertEquals(list(canvas.solver.constraints_with_variable(line.handles()[-1].pos.x)))
 #        self.assertTrue(list(canvas.solver.constraints_with_variable(line.handles()[-1].pos.y)))
-        
+
+    def testUndoRemoveMany(self):
+        b1 = Box()
+        b2 = Box()
+        b3 = Box()
+        line = Line()
+
+        canvas = Canvas()
+        canvas.add(b1)
+        canvas.add(b2, b1)
+        canvas.add(line)
+        canvas.add(b3)
+
+        sink = ConnectionSink(b2, b2.ports()[0])
+        connector = Connector(line, line.handles()[0])
+        connector.connect(sink)
+
+        sink = ConnectionSink(b3, b3.ports()[0])
+        connector = Connector(line, line.handles()[-1])
+        connector.connect(sink)
+
+        self.assertEquals(20, len(canvas.solver.constraints))
+
+        del undo_list[:]
+
+        canvas.remove_many([b3, b1])
+
+        self.assertEquals(1, len(undo_list))
+        self.assertEquals([line], canvas.get_all_items())
+        self.assertEquals(0, len(canvas.solver.constraints))
+        self.assertEquals(0, len(list(canvas.get_connections(item=line))))
+
+        undo()
+
+        self.assertEquals([b1, b2, line, b3], canvas.get_all_items())
+        self.assertEquals([b2], canvas.get_children(b1))
+        self.assertEquals(20, len(canvas.solver.constraints))
+
+        cinfo = canvas.get_connection(line.handles()[0])
+        self.assertEquals(b2, cinfo.connected)
+
+        cinfo = canvas.get_connection(line.handles()[-1])
+        self.assertEquals(b3, cinfo.connected)
+
+    def testUndoAddMany(self):
+        b1 = Box()
+        b2 = Box()
+        b3 = Box()
+
+        canvas = Canvas()
+        del undo_list[:]
+
+        canvas.add_many([(b1, None), (b2, b1), (b3, None)])
+
+        self.assertEquals(1, len(undo_list))
+        self.assertEquals([b1, b2, b3], canvas.get_all_items())
+        self.assertEquals(18, len(canvas.solver.constraints))
+
+        undo()
+
+        self.assertEquals([], canvas.get_all_items())
+        self.assertEquals(0, len(canvas.solver.constraints))
+        self.assertEquals(None, b2.canvas)
+
 if __name__ == '__main__':
     unittest.main()
 # vim:sw=4:et:ai
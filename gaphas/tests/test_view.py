@@ -9,6 +9,7 @@ from gaphas.canvas import Canvas, Context
 from gaphas.item import Line
 from gaphas.examples import Box
 from gaphas.tool import HoverTool
+from gaphas.geometry import Rectangle
 
 
 class ViewTestCase(unittest.TestCase):
@@ -55,6 +56,68 @@ class ViewTestCase(unittest.TestCase):
             window1.destroy()
             window2.destroy()
 
+    def test_zoom(self):
+        """
+        Bounding boxes are kept in canvas coordinates, zooming only changes
+        the view matrix.
+        """
+        canvas = Canvas()
+        view = View(canvas)
+        box = Box()
+        box.matrix.translate(10, 10)
+        canvas.add(box)
+
+        self.assertEquals(Rectangle(10, 10, 10, 10), view.get_item_bounding_box(box))
+        self.assertEquals((1, 0, 0, 1, 10, 10), tuple(view.get_matrix_i2v(box)))
+
+        view.zoom(2)
+
+        self.assertEquals((10, 10, 10, 10), canvas.get_item_bounds(box))
+        self.assertEquals(Rectangle(20, 20, 20, 20), view.get_item_bounding_box(box))
+        self.assertEquals((2, 0, 0, 2, 20, 20), tuple(view.get_matrix_i2v(box)))
+        self.assertEquals((-10, -10), view.get_matrix_v2i(box).transform_point(0, 0))
+        assert view.get_item_at_point((35, 35)) is box
+        assert view.get_item_at_point((45, 45)) is None
+
+    def test_matrix_version(self):
+        """
+        Cached item to view matrices are recalculated only after
+        request_matrix_update() or when the view matrix is set.
+        """
+        canvas = Canvas()
+        view = View(canvas)
+        box = Box()
+        canvas.add(box)
+
+        self.assertEquals((1, 0, 0, 1, 0, 0), tuple(view.get_matrix_i2v(box)))
+
+        view.matrix.translate(5, 5)
+        self.assertEquals((1, 0, 0, 1, 0, 0), tuple(view.get_matrix_i2v(box)))
+
+        view.request_matrix_update()
+        self.assertEquals((1, 0, 0, 1, 5, 5), tuple(view.get_matrix_i2v(box)))
+
+        view.matrix = (2, 0, 0, 2, 0, 0)
+        self.assertEquals((2, 0, 0, 2, 0, 0), tuple(view.get_matrix_i2v(box)))
+        self.assertEquals((-5, -5), view.get_matrix_v2i(box).transform_point(-10, -10))
+
+    def test_get_items_in_region(self):
+        """
+        Damaged rectangles are looked up separately, items in between are
+        not drawn.
+        """
+        canvas = Canvas()
+        view = View(canvas)
+        boxes = []
+        for i in range(3):
+            box = Box()
+            box.matrix.translate(i * 100, i * 100)
+            canvas.add(box)
+            boxes.append(box)
+
+        items = view.get_items_in_region([Rectangle(0, 0, 20, 20), Rectangle(200, 200, 20, 20)])
+        self.assertEquals([boxes[0], boxes[2]], items)
+
     def test_get_item_at_point(self):
         """
         Hover tool only reacts on motion-notify events
@@ -76,8 +139,8 @@ class ViewTestCase(unittest.TestCase):
         while gtk.events_pending():
             gtk.main_iteration()
 
-        assert len(view._qtree._ids) == 1
-        assert not view._qtree._bucket.bounds == (0, 0, 0, 0), view._qtree._bucket.bounds
+        assert len(canvas._spatial_index) == 1
+        assert not canvas._spatial_index.bounds == (0, 0, 0, 0), canvas._spatial_index.bounds
 
         assert view.get_item_at_point((10, 10)) is box
         assert view.get_item_at_point((60, 10)) is None
@@ -101,16 +164,101 @@ class ViewTestCase(unittest.TestCase):
         while gtk.events_pending():
             gtk.main_iteration()
 
-        assert len(canvas.get_all_items()) == len(view._qtree)
+        assert len(canvas.get_all_items()) == len(canvas._spatial_index)
 
         view.focused_item = box
         canvas.remove(box)
 
         assert len(canvas.get_all_items()) == 0
-        assert len(view._qtree) == 0
+        assert len(canvas._spatial_index) == 0
+
+        window.destroy()
+
+    def test_static_layer(self):
+        canvas = Canvas()
+        view = GtkView(canvas)
+        view.layered = True
+        window = gtk.Window(gtk.WINDOW_TOPLEVEL)
+        window.add(view)
+        window.show_all()
+
+        box = Box()
+        canvas.add(box)
+        other = Box()
+        other.matrix.translate(100, 100)
+        canvas.add(other)
+        line = Line()
+        canvas.add(line)
+        canvas.connect_item(line, line.handles()[0], box, box.ports()[0], None)
+
+        view.start_static_layer([box])
+        assert view._moving_items == set([box, line])
+
+        while gtk.events_pending():
+            gtk.main_iteration()
+        assert view._static_layer is not None
+
+        # Moving items are drawn on top of the static layer
+        box.matrix.translate(10, 10)
+        canvas.request_matrix_update(box)
+        canvas.update_now()
+        assert view._static_layer is not None
+
+        # A change of any other item invalidates the layer
+        other.width = 40
+        canvas.request_update(other)
+        canvas.update_now()
+        assert view._static_layer is None
+
+        view.stop_static_layer()
+        assert view._moving_items is None
+
+        window.destroy()
+
+
+    def test_static_layer_ancestors(self):
+        canvas = Canvas()
+        view = GtkView(canvas)
+        view.layered = True
+        window = gtk.Window(gtk.WINDOW_TOPLEVEL)
+        window.add(view)
+        window.show_all()
+
+        parent = Box()
+        canvas.add(parent)
+        child = Box()
+        canvas.add(child, parent)
+
+        view.start_static_layer([child])
+
+        while gtk.events_pending():
+            gtk.main_iteration()
+        assert view._static_layer is not None
+
+        # The parent is updated along with the child, its bounds do not
+        # change: the layer is kept
+        child.matrix.translate(10, 10)
+        canvas.request_matrix_update(child)
+        canvas.update_now()
+        assert view._static_layer is not None
+        assert not view._implicit_bounds
+
+        while gtk.events_pending():
+            gtk.main_iteration()
+        assert view._static_layer is not None
+
+        # The parent requested an update itself
+        canvas.request_update(child)
+        canvas.request_update(parent)
+        canvas.update_now()
+        assert view._static_layer is None
+
+        view.stop_static_layer()
+        assert not view._implicit_bounds
 
         window.destroy()
 
+
     def test_view_registration(self):
         canvas = Canvas()
 
@@ -0,0 +1,222 @@
+"""
+Caches for rendered surfaces.
+
+`TileCache` keeps rendered tiles, used by `view.GtkView` to keep what has
+been painted when scrolling. `SurfaceCache` keeps the renderings of single
+items, used by `painter.ItemPainter`.
+"""
+
+__version__ = "$Revision$"
+# $HeadURL$
+
+from collections import OrderedDict
+from math import floor, ceil
+
+
+TILE_SIZE = 256
+
+MAX_TILES = 256
+
+
+class TileCache(object):
+    """
+    Rendered tiles for one scale.
+
+    The canvas is divided in square tiles of ``size`` x ``size`` pixels at a
+    given scale (zoom level). Tile ``(i, j)`` covers the area
+    ``(i * size, j * size, size, size)`` in device coordinates: canvas
+    coordinates multiplied by the scale. Tiles are kept for one scale at a
+    time; when the scale changes, the cache is cleared.
+
+    Tiles are rendered by a function provided by the user of the cache, e.g.
+    in a Cairo image surface. At most ``max_tiles`` tiles are kept; the least
+    recently used tiles are dropped first.
+
+    >>> cache = TileCache(size=100)
+    >>> render = lambda i, j: 'tile %d,%d' % (i, j)
+    >>> cache.get_tiles(1.0, (50, 50, 100, 10), render)
+    [((0, 0), 'tile 0,0'), ((1, 0), 'tile 1,0')]
+
+    Tiles are invalidated by areas in canvas coordinates:
+
+    >>> cache.invalidate((120, 0, 10, 10))
+    >>> cache.get_tiles(1.0, (50, 50, 100, 10), lambda i, j: 'new')
+    [((0, 0), 'tile 0,0'), ((1, 0), 'new')]
+
+    At another scale, new tiles are rendered:
+
+    >>> cache.get_tiles(2.0, (100, 0, 10, 10), render)
+    [((1, 0), 'tile 1,0')]
+    >>> len(cache)
+    1
+    """
+
+    def __init__(self, size=TILE_SIZE, max_tiles=MAX_TILES):
+        self.size = size
+        self.max_tiles = max_tiles
+        self._scale = None
+        self._tiles = OrderedDict()
+
+
+    scale = property(lambda s: s._scale)
+
+
+    def __len__(self):
+        return len(self._tiles)
+
+
+    def __contains__(self, key):
+        return key in self._tiles
+
+
+    def get_tile_range(self, rect):
+        """
+        Return the tiles ``(i, j)`` that overlap with rectangle ``rect``
+        ``(x, y, width, height)`` in device coordinates, row by row.
+
+        >>> TileCache(size=100).get_tile_range((-10, 0, 120, 100))
+        [(-1, 0), (0, 0), (1, 0)]
+        """
+        x, y, w, h = rect
+        size = float(self.size)
+        i0, j0 = int(floor(x / size)), int(floor(y / size))
+        i1 = max(int(ceil((x + w) / size)), i0 + 1)
+        j1 = max(int(ceil((y + h) / size)), j0 + 1)
+        return [(i, j) for j in xrange(j0, j1) for i in xrange(i0, i1)]
+
+
+    def get_tiles(self, scale, rect, render):
+        """
+        Return the tiles covering ``rect`` (in device coordinates) at
+        ``scale``, as ``((i, j), tile)`` tuples. Missing tiles are rendered
+        by calling ``render(i, j)``.
+        """
+        if scale != self._scale:
+            self.clear()
+            self._scale = scale
+        tiles = self._tiles
+        result = []
+        for key in self.get_tile_range(rect):
+            tile = tiles.pop(key, None)
+            if tile is None:
+                tile = render(*key)
+            # (Re)insert, so the tile becomes the most recently used one
+            tiles[key] = tile
+            result.append((key, tile))
+        while len(tiles) > self.max_tiles:
+            tiles.popitem(last=False)
+        return result
+
+
+    def invalidate(self, rect):
+        """
+        Drop the tiles overlapping with ``rect`` ``(x, y, width, height)``
+        in canvas coordinates.
+        """
+        tiles = self._tiles
+        if not tiles:
+            return
+        s = self._scale
+        x, y, w, h = rect
+        keys = self.get_tile_range((x * s, y * s, w * s, h * s))
+        if len(keys) > len(tiles):
+            (i0, j0), (i1, j1) = keys[0], keys[-1]
+            keys = [(i, j) for i, j in tiles if i0 <= i <= i1 and j0 <= j <= j1]
+        for key in keys:
+            tiles.pop(key, None)
+
+
+    def clear(self):
+        """
+        Drop all tiles.
+        """
+        self._tiles.clear()
+
+
+class SurfaceCache(object):
+    """
+    Rendered surfaces of items, within a memory budget of ``max_size``
+    bytes. Each item has one surface, that is valid for a ``key`` (e.g. the
+    zoom level). The least recently used surfaces are dropped first.
+
+    >>> cache = SurfaceCache(max_size=100)
+    >>> cache.put('a', 1, 'surface a', 60)
+    >>> cache.get('a', 1)
+    'surface a'
+    >>> cache.get('a', 2)
+    >>> cache.put('a', 2, 'surface a2', 60)
+    >>> cache.put('b', 1, 'surface b', 30)
+    >>> cache.size
+    90
+    >>> cache.put('c', 1, 'surface c', 30)
+    >>> cache.get('a', 2), cache.get('b', 1), cache.size
+    (None, 'surface b', 60)
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._size = 0
+        # item -> (key, surface, size)
+        self._entries = OrderedDict()
+
+
+    size = property(lambda s: s._size, doc="Memory used, in bytes")
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def __contains__(self, item):
+        return item in self._entries
+
+
+    def get(self, item, key):
+        """
+        Return the surface of ``item``, if it's rendered for ``key``.
+        Otherwise ``None`` is returned and the surface is dropped.
+        """
+        entries = self._entries
+        try:
+            entry = entries.pop(item)
+        except KeyError:
+            return None
+        if entry[0] != key:
+            self._size -= entry[2]
+            return None
+        # Reinsert, so the surface becomes the most recently used one
+        entries[item] = entry
+        return entry[1]
+
+
+    def put(self, item, key, surface, size):
+        """
+        Store the ``surface`` of ``item``, rendered for ``key``. ``size``
+        is the amount of memory used by the surface.
+        """
+        self.discard(item)
+        entries = self._entries
+        entries[item] = (key, surface, size)
+        self._size += size
+        while self._size > self.max_size:
+            self._size -= entries.popitem(last=False)[1][2]
+
+
+    def discard(self, item):
+        """
+        Drop the surface of ``item``.
+        """
+        entry = self._entries.pop(item, None)
+        if entry:
+            self._size -= entry[2]
+
+
+    def clear(self):
+        """
+        Drop all surfaces.
+        """
+        self._entries.clear()
+        self._size = 0
+
+
+# vim:sw=4:et:ai
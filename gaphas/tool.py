@@ -38,7 +38,7 @@ import sys
 
 import cairo
 import gtk
-from gaphas.canvas import Context
+from gaphas.canvas import Context, APPEARANCE
 from gaphas.geometry import Rectangle
 from gaphas.geometry import distance_point_point_fast, distance_line_point
 from gaphas.item import Line
@@ -262,11 +262,15 @@ class ItemTool(Tool):
         Returns InMotion aspects for the items.
         """
         view = self.view
-        get_ancestors = view.canvas.get_ancestors
-        selected_items = set(view.selected_items)
-        for item in selected_items:
+        canvas = view.canvas
+        is_ancestor = canvas.is_ancestor
+        # In depth-first order the subitems of a selected item directly
+        # follow that item
+        top = None
+        for item in canvas.sort(view.selected_items):
             # Do not move subitems of selected items
-            if not set(get_ancestors(item)).intersection(selected_items):
+            if top is None or not is_ancestor(top, item):
+                top = item
                 yield InMotion(item, view)
         
 
@@ -300,6 +304,7 @@ class ItemTool(Tool):
             return False
         for inmotion in self._movable_items:
             inmotion.stop_move()
+        self.view.stop_static_layer()
         self._movable_items.clear()
         return True
 
@@ -314,6 +319,8 @@ class ItemTool(Tool):
                 self._movable_items = set(self.movable_items())
                 for inmotion in self._movable_items:
                     inmotion.start_move((event.x, event.y))
+                if self._movable_items:
+                    self.view.start_static_layer(m.item for m in self._movable_items)
 
             for inmotion in self._movable_items:
                 inmotion.move((event.x, event.y))
@@ -404,7 +411,7 @@ class HandleTool(Tool):
         self.ungrab_handle()
 
         if grabbed_handle:
-            grabbed_item.request_update()
+            grabbed_item.request_update(kind=APPEARANCE)
         return True
 
     def on_motion_notify(self, event):
@@ -499,8 +506,7 @@ class PanTool(Tool):
             dx = self.x1 - self.x0
             dy = self.y1 - self.y0
             view._matrix.translate(dx/view._matrix[0], dy/view._matrix[3])
-            # Make sure everything's updated
-            view.request_update((), view._canvas.get_all_items())
+            view.request_matrix_update()
             self.x0 = self.x1
             self.y0 = self.y1
             return True
@@ -520,7 +526,7 @@ class PanTool(Tool):
             view._matrix.translate(0, self.speed/view._matrix[3])
         elif direction == gdk.SCROLL_DOWN:
             view._matrix.translate(0, -self.speed/view._matrix[3])
-        view.request_update((), view._canvas.get_all_items())
+        view.request_matrix_update()
         return True
 
 
@@ -573,9 +579,7 @@ class ZoomTool(Tool):
                 m.translate(-ox, -oy)
                 m.scale(factor, factor)
                 m.translate(+ox, +oy)
-
-                # Make sure everything's updated
-                view.request_update((), view._canvas.get_all_items())
+                view.request_matrix_update()
 
                 self.lastdiff = dy;
             return True
@@ -593,8 +597,7 @@ class ZoomTool(Tool):
             view._matrix.translate(-ox, -oy)
             view._matrix.scale(factor, factor)
             view._matrix.translate(+ox, +oy)
-            # Make sure everything's updated
-            view.request_update((), view._canvas.get_all_items())
+            view.request_matrix_update()
             return True
 
 
@@ -1,12 +1,75 @@
 """
 Simple class containing the tree structure for the canvas items.
 
+The depth-first order of the nodes is maintained incrementally. Each node
+has two integer labels: one for entering the node (pre-order) and one for
+leaving it (post-order), after all its children. The labels of all nodes
+form an increasing sequence, so the labels of a node are a nested interval
+containing the intervals of its descendants. New nodes get labels in
+between their neighbours. Only if there is no room left, a small range of
+neighbouring labels is spread out again.
+
+This makes adding, removing and moving nodes, as well as comparing the
+position of two nodes, O(log n) operations (apart from moving list
+entries). Checking if a node is an ancestor of another node takes constant
+time and the descendants of a node are a slice of the nodes list.
 """
 
 __version__ = "$Revision$"
 # $HeadURL$
 
 from operator import attrgetter
+from bisect import bisect_left
+
+
+# Distance between labels that are appended.
+LABEL_GAP = 1 << 16
+
+
+class NodesView(object):
+    """
+    Read-only sequence of the nodes in a tree, in depth-first order. No
+    copy is made: the view reflects the changes made to the tree later on.
+    Use ``changed`` to find out if the tree has been changed since the
+    view was created.
+
+    >>> tree = Tree()
+    >>> tree.add('n1')
+    >>> tree.add('n2', parent='n1')
+    >>> view = tree.get_nodes_view()
+    >>> list(view), len(view), view[0], 'n2' in view
+    (['n1', 'n2'], 2, 'n1', True)
+    >>> view.changed
+    False
+    >>> tree.add('n3')
+    >>> view.changed
+    True
+    >>> list(view)
+    ['n1', 'n2', 'n3']
+    """
+
+    __slots__ = ('_tree', '_generation')
+
+    def __init__(self, tree):
+        self._tree = tree
+        self._generation = tree._generation
+
+    changed = property(lambda s: s._generation != s._tree._generation)
+
+    def __len__(self):
+        return len(self._tree._nodes)
+
+    def __iter__(self):
+        return iter(self._tree._nodes)
+
+    def __reversed__(self):
+        return reversed(self._tree._nodes)
+
+    def __getitem__(self, index):
+        return self._tree._nodes[index]
+
+    def __contains__(self, node):
+        return node in self._tree._label
 
 
 class Tree(object):
@@ -29,8 +92,31 @@ class Tree(object):
         # For easy and fast lookups, also maintain a child -> parent mapping
         self._parents = { }
 
+        # Order labels: node -> pre-order label, node -> post-order label
+        # and the pre-order labels sorted like the nodes list
+        self._label = { }
+        self._end = { }
+        self._labels = []
+
+        # All labels, sorted, and the node each label belongs to
+        self._tokens = []
+        self._token_nodes = []
+
+        # Incremented on every change to the tree
+        self._generation = 0
+
     nodes = property(lambda s: list(s._nodes))
 
+    generation = property(lambda s: s._generation,
+                          doc="Incremented each time the tree is changed.")
+
+    def get_nodes_view(self):
+        """
+        Return a read-only view on the nodes (see ``NodesView``). Unlike
+        ``nodes``, no copy of the nodes list is made.
+        """
+        return NodesView(self)
+
     def get_parent(self, node):
         """
         Return the parent item of ``node``.
@@ -87,9 +173,8 @@ class Tree(object):
             ...
         IndexError: list index out of range
         """
-        parent = self.get_parent(node)
-        siblings = self._children[parent]
-        return siblings[siblings.index(node) + 1]
+        siblings = self.get_siblings(node)
+        return siblings[self._sibling_index(siblings, node) + 1]
 
     def get_previous_sibling(self, node):
         """
@@ -106,9 +191,8 @@ class Tree(object):
             ...
         IndexError: list index out of range
         """
-        parent = self.get_parent(node)
-        siblings = self._children[parent]
-        index = siblings.index(node) - 1
+        siblings = self.get_siblings(node)
+        index = self._sibling_index(siblings, node) - 1
         if index < 0:
             raise IndexError('list index out of range')
         return siblings[index]
@@ -121,18 +205,59 @@ class Tree(object):
         >>> tree.add('n1')
         >>> tree.add('n2', parent='n1')
         >>> tree.add('n3', parent='n2')
+        >>> tree.add('n4')
         >>> tree.get_children('n1')
         ['n2']
-        >>> tree.get_all_children('n1') # doctest: +ELLIPSIS
-        <generator object get_all_children at 0x...>
         >>> list(tree.get_all_children('n1'))
         ['n2', 'n3']
+        >>> list(tree.get_all_children(None))
+        ['n1', 'n2', 'n3', 'n4']
+
+        The descendants of a node are a slice of the nodes list.
+        """
+        if node is None:
+            return iter(self.nodes)
+        start = self.get_index(node) + 1
+        end = bisect_left(self._labels, self._end[node], start)
+        return iter(self._nodes[start:end])
+
+    def is_ancestor(self, ancestor, node):
+        """
+        Return True if ``ancestor`` is a parent, grand parent, etc. of
+        ``node``. This is checked in constant time.
+
+        >>> tree = Tree()
+        >>> tree.add('n1')
+        >>> tree.add('n2', parent='n1')
+        >>> tree.add('n3', parent='n2')
+        >>> tree.add('n4')
+        >>> tree.is_ancestor('n1', 'n3')
+        True
+        >>> tree.is_ancestor('n3', 'n1')
+        False
+        >>> tree.is_ancestor('n1', 'n1')
+        False
+        >>> tree.is_ancestor('n1', 'n4')
+        False
+        >>> tree.is_ancestor(None, 'n4')
+        True
+        """
+        if ancestor is None:
+            return node is not None
+        return self._label[ancestor] < self._label[node] < self._end[ancestor]
+
+    def get_sibling_index(self, node):
+        """
+        Return the position of ``node`` in the list of its siblings.
+
+        >>> tree = Tree()
+        >>> tree.add('n1')
+        >>> tree.add('n2')
+        >>> tree.add('n3', parent='n1')
+        >>> tree.get_sibling_index('n2'), tree.get_sibling_index('n3')
+        (1, 0)
         """
-        children = self.get_children(node)
-        for c in children:
-            yield c
-            for cc in self.get_all_children(c):
-                yield cc
+        return self._sibling_index(self.get_siblings(node), node)
 
     def get_ancestors(self, node):
         """
@@ -183,9 +308,40 @@ class Tree(object):
         lnodes = len(nodes)
         map(setattr, nodes, [index_key] * lnodes, xrange(lnodes))
 
-    def sort(self, nodes, index_key, reverse=False):
+    def get_order_key(self, node):
         """
-        Sort a set (or list) of nodes.
+        Return a key for ``node`` that compares like the position of the
+        node in the (depth-first) nodes list. The key is only valid until
+        the tree is changed.
+
+        >>> tree = Tree()
+        >>> tree.add('n1')
+        >>> tree.add('n2')
+        >>> tree.add('n3', parent='n1')
+        >>> tree.nodes
+        ['n1', 'n3', 'n2']
+        >>> tree.get_order_key('n3') < tree.get_order_key('n2')
+        True
+        """
+        return self._label[node]
+
+    def get_index(self, node):
+        """
+        Return the position of ``node`` in the nodes list.
+
+        >>> tree = Tree()
+        >>> tree.add('n1')
+        >>> tree.add('n2')
+        >>> tree.add('n3', parent='n1')
+        >>> tree.get_index('n2')
+        2
+        """
+        return bisect_left(self._labels, self._label[node])
+
+    def sort(self, nodes, index_key=None, reverse=False):
+        """
+        Sort a set (or list) of nodes in the order they appear in the
+        nodes list.
         
         >>> class A(object):
         ...     def __init__(self, n):
@@ -197,55 +353,184 @@ class Tree(object):
         >>> t.add(a)
         >>> t.add(A('b'))
         >>> t.add(A('c'), parent=a)
-        >>> t.nodes    # the series from Tree.index_nodes
+        >>> t.nodes
         [a, c, b]
-        >>> t.index_nodes('my_key')
         >>> selection = (t.nodes[2], t.nodes[1])
-        >>> t.sort(selection, index_key='my_key')
+        >>> t.sort(selection)
         [c, b]
+
+        Sorting on an index attribute (see ``index_nodes()``) is still
+        possible:
+
+        >>> t.index_nodes('my_key')
+        >>> t.sort(selection, index_key='my_key', reverse=True)
+        [b, c]
         """
         if index_key:
             return sorted(nodes, key=attrgetter(index_key), reverse=reverse)
         else:
-            raise NotImplemented('index_key should be provided.')
+            return sorted(nodes, key=self._label.__getitem__, reverse=reverse)
+
+    def _sibling_index(self, siblings, node):
+        """
+        Find the position of ``node`` in the list of ``siblings``.
+        Siblings are ordered by label, so a binary search will do.
+        """
+        label = self._label
+        key = label[node]
+        lo, hi = 0, len(siblings)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if label[siblings[mid]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(siblings) or siblings[lo] != node:
+            raise ValueError('%s is not a sibling' % (node,))
+        return lo
+
+    def _relabel(self, index, room):
+        """
+        Make room for ``room`` new labels in between the labels at
+        position ``index - 1`` and ``index`` in the tokens list. A range of
+        labels around ``index`` is spread out evenly. The range is doubled
+        until the labels in it can be spread out with a gap wider than
+        half the range.
+        """
+        tokens = self._tokens
+        token_nodes = self._token_nodes
+        label = self._label
+        end = self._end
+        n = len(tokens)
+        size = 1
+        while True:
+            lo, hi = max(0, index - size), min(n, index + size)
+            count = hi - lo
+            if hi == n:
+                # No upper bound
+                gap = LABEL_GAP
+                bottom = tokens[lo - 1] if lo else tokens[0] - gap
+            elif lo == 0:
+                # No lower bound
+                gap = LABEL_GAP
+                bottom = tokens[hi] - (count + room + 1) * gap
+            else:
+                bottom = tokens[lo - 1]
+                gap = (tokens[hi] - bottom) // (count + room + 1)
+                if gap <= size:
+                    size *= 2
+                    continue
+            labels = self._labels
+            position = bisect_left(labels, tokens[lo])
+            for i in xrange(lo, hi):
+                node = token_nodes[i]
+                l = bottom + gap * (i - lo + (1 if i < index else room + 1))
+                if end[node] == tokens[i]:
+                    end[node] = l
+                else:
+                    label[node] = l
+                    labels[position] = l
+                    position += 1
+                tokens[i] = l
+            return
+
+    def _insert(self, index, entries):
+        """
+        Insert ``entries`` at position ``index`` in the tokens list. Entries
+        are ``(node, post)`` tuples, ``post`` is True for the post-order
+        label of a node. The nodes are inserted in the nodes list.
+        """
+        self._generation += 1
+        tokens = self._tokens
+        n = len(tokens)
+        room = len(entries)
+        if index == n:
+            gap = LABEL_GAP
+            start = tokens[-1] if n else 0
+        elif index == 0:
+            gap = LABEL_GAP
+            start = tokens[0] - (room + 1) * gap
+        else:
+            gap = (tokens[index] - tokens[index - 1]) // (room + 1)
+            if not gap:
+                self._relabel(index, room)
+                gap = (tokens[index] - tokens[index - 1]) // (room + 1)
+            start = tokens[index - 1]
+
+        new_tokens = range(start + gap, start + gap * (room + 1), gap)
+        tokens[index:index] = new_tokens
+        self._token_nodes[index:index] = [node for node, post in entries]
+
+        label = self._label
+        end = self._end
+        nodes = []
+        labels = []
+        for (node, post), l in zip(entries, new_tokens):
+            if post:
+                end[node] = l
+            else:
+                label[node] = l
+                nodes.append(node)
+                labels.append(l)
+        position = bisect_left(self._labels, new_tokens[0])
+        self._nodes[position:position] = nodes
+        self._labels[position:position] = labels
 
-    def _add_to_nodes(self, node, parent, index=None):
+    def _cut(self, node):
+        """
+        Remove ``node`` and its descendants from the nodes list. The
+        entries (see ``_insert()``) for the subtree are returned.
+        """
+        self._generation += 1
+        tokens = self._tokens
+        token_nodes = self._token_nodes
+        first = bisect_left(tokens, self._label[node])
+        last = bisect_left(tokens, self._end[node], first) + 1
+        end = self._end
+        entries = [(n, end[n] == l) for n, l in zip(token_nodes[first:last],
+                                                    tokens[first:last])]
+        del tokens[first:last]
+        del token_nodes[first:last]
+
+        labels = self._labels
+        first = bisect_left(labels, self._label[node])
+        last = bisect_left(labels, end[node], first)
+        for n in self._nodes[first:last]:
+            del self._label[n]
+            del end[n]
+        del self._nodes[first:last]
+        del labels[first:last]
+        return entries
+
+    def _add_to_nodes(self, node, parent, index=None, entries=None):
         """
         Helper method to place nodes on the right location in the nodes list
-        Called only from add() and reparent()
+        Called only from add() and reparent(). ``entries`` are the
+        entries of a reparented subtree.
         """
-        nodes = self._nodes
         siblings = self._children[parent]
         try:
             atnode = siblings[index]
         except (TypeError, IndexError):
-            index = len(siblings)
-            #self._add_to_nodes(node, parent)
-            if parent:
-                try:
-                    next_uncle = self.get_next_sibling(parent)
-                except IndexError:
-                    # parent has no younger brothers..
-                    # place it before the next uncle of grant_parent:
-                    return self._add_to_nodes(node, self.get_parent(parent))
-                else:
-                    nodes.insert(nodes.index(next_uncle), node)
+            # Place the node at the end of the parent's subtree
+            if parent is None:
+                position = len(self._tokens)
             else:
-                # append to root node:
-                nodes.append(node)
+                position = bisect_left(self._tokens, self._end[parent])
         else:
-            nodes.insert(nodes.index(atnode), node)
+            position = bisect_left(self._tokens, self._label[atnode])
+        self._insert(position, entries or [(node, False), (node, True)])
 
 
-    def _add(self, node, parent=None, index=None):
+    def _add(self, node, parent=None, index=None, entries=None):
         """
         Helper method for both add() and reparent().
         """
-        assert node not in self._nodes
+        assert node not in self._label
 
         siblings = self._children[parent]
 
-        self._add_to_nodes(node, parent, index)
+        self._add_to_nodes(node, parent, index, entries)
         
         # Fix parent-child and child-parent relationship
         try:
@@ -269,40 +554,23 @@ class Tree(object):
         self._children[node] = []
 
 
-    def _remove(self, node):
-        # Remove from parent item
-        self.get_siblings(node).remove(node)
-        # Remove data entries:
-        del self._children[node]
-        self._nodes.remove(node)
-        try:
-            del self._parents[node]
-        except KeyError:
-            pass
-
     def remove(self, node):
         """
-        Remove ``node`` from the tree.
+        Remove ``node`` and its children from the tree.
 
         For usage, see the unit tests.
         """
-        # First remove children:
-        for c in reversed(list(self._children[node])):
-            self.remove(c)
-        self._remove(node)
+        # Remove from parent item
+        siblings = self.get_siblings(node)
+        del siblings[self._sibling_index(siblings, node)]
+        # Remove data entries:
+        children = self._children
+        parents = self._parents
+        for n, post in self._cut(node):
+            if not post:
+                del children[n]
+                parents.pop(n, None)
 
-    def _reparent_nodes(self, node, parent):
-        """
-        Helper for reparent().
-        The _children and _parent trees can be left intact as far as children
-        of the reparented node are concerned. Only the position in the
-        _nodes list changes.
-        """
-        self._nodes.remove(node)
-        self._add_to_nodes(node, parent)
-        for c in self._children[node]:
-            self._reparent_nodes(c, node)
-        
     def reparent(self, node, parent, index=None):
         """
         Set new parent for a ``node``. ``Parent`` can be ``None``, indicating
@@ -338,18 +606,42 @@ class Tree(object):
         if parent is self.get_parent(node):
             return
 
-        # Remove all node references:
+        # Remove all node references. The _children and _parent trees can
+        # be left intact as far as children of the reparented node are
+        # concerned. Only the position in the _nodes list changes.
         old_parent = self.get_parent(node)
-        self._children[old_parent].remove(node)
-        self._nodes.remove(node)
+        siblings = self._children[old_parent]
+        del siblings[self._sibling_index(siblings, node)]
         if old_parent:
             del self._parents[node]
 
-        self._add(node, parent, index)
+        # Move the node and its children in the nodes list
+        self._add(node, parent, index, self._cut(node))
 
-        # reorganize children in nodes list
-        for c in self._children[node]:
-            self._reparent_nodes(c, node)
+    def __setstate__(self, state):
+        """
+        Load persisted state. Trees saved without order labels are
+        labeled.
+        """
+        self.__dict__.update(state)
+        self.__dict__.setdefault('_generation', 0)
+        if '_tokens' not in state:
+            entries = []
+            def visit(node):
+                entries.append((node, False))
+                for c in self._children[node]:
+                    visit(c)
+                entries.append((node, True))
+            for node in self._children[None]:
+                visit(node)
+            self._nodes = []
+            self._label = { }
+            self._end = { }
+            self._labels = []
+            self._tokens = []
+            self._token_nodes = []
+            if entries:
+                self._insert(0, entries)
 
 
 # vi: sw=4:et:ai
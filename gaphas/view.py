@@ -7,12 +7,14 @@ __version__ = "$Revision$"
 
 import gobject
 import gtk
+import cairo
 from cairo import Matrix
 from canvas import Context
-from geometry import Rectangle
-from quadtree import Quadtree
+from geometry import Rectangle, rectangle_transform, rectangle_merge
 from tool import DefaultTool
-from painter import DefaultPainter, BoundingBoxPainter
+from painter import DefaultPainter, BoundingBoxPainter, ItemPainter, \
+        invalidate
+from tilecache import TileCache
 from decorators import async, PRIORITY_HIGH_IDLE
 from decorators import nonrecursive
 
@@ -27,10 +29,18 @@ DEFAULT_CURSOR = gtk.gdk.LEFT_PTR
 class View(object):
     """
     View class for gaphas.Canvas objects. 
+
+    Bounding boxes are kept by the canvas, in canvas coordinates. The view
+    matrix is applied to queries and redraw areas only, so scrolling and
+    zooming do not touch the items. Item to view matrices are cached per
+    item and recalculated when the view matrix has changed (see
+    ``request_matrix_update()``).
     """
 
     def __init__(self, canvas=None):
         self._matrix = Matrix()
+        # Incremented when the view matrix changes
+        self._matrix_version = 0
         self._painter = DefaultPainter(self)
         self._bounding_box_painter = BoundingBoxPainter(self)
 
@@ -42,7 +52,7 @@ class View(object):
         self._dropzone_item = None
         ###/
 
-        self._qtree = Quadtree()
+        # Bounds of all items, in canvas coordinates
         self._bounds = Rectangle(0, 0, 0, 0)
 
         self._canvas = None
@@ -50,7 +60,11 @@ class View(object):
             self._set_canvas(canvas)
 
 
-    matrix = property(lambda s: s._matrix,
+    def _set_matrix(self, matrix):
+        self._matrix = Matrix(*matrix)
+        self.request_matrix_update()
+
+    matrix = property(lambda s: s._matrix, _set_matrix,
                       doc="Canvas to view transformation matrix")
 
 
@@ -60,7 +74,6 @@ class View(object):
         in the view.
         """
         if self._canvas:
-            self._qtree.clear()
             self._selected_items.clear()
             self._focused_item = None
             self._hovered_item = None
@@ -85,6 +98,20 @@ class View(object):
         pass
 
 
+    def start_static_layer(self, items):
+        """
+        Placeholder for layered drawing: ``items`` are about to be moved.
+        """
+        pass
+
+
+    def stop_static_layer(self):
+        """
+        Placeholder for layered drawing: the items are no longer moved.
+        """
+        pass
+
+
     def select_item(self, item):
         """
         Select an item. This adds @item to the set of selected items.
@@ -106,7 +133,7 @@ class View(object):
 
 
     def select_all(self):
-        for item in self.canvas.get_all_items():
+        for item in self.canvas.get_all_items_view():
             self.select_item(item)
 
 
@@ -227,7 +254,7 @@ class View(object):
         Parameters:
          - selected: if False returns first non-selected item
         """
-        items = self._qtree.find_intersect((pos[0], pos[1], 1, 1))
+        items = self._find_items((pos[0], pos[1], 1, 1))
         for item in self._canvas.sort(items, reverse=True):
             if not selected and item in self.selected_items:
                 continue  # skip selected items
@@ -336,24 +363,48 @@ class View(object):
         return item, port, glue_pos
 
 
+    def _find_items(self, rect, intersect=True):
+        """
+        Find the items in rectangle ``rect``, in view coordinates. The
+        rectangle is transformed to canvas coordinates and looked up in
+        the canvas' spatial index.
+        """
+        v2c = Matrix(*self._matrix)
+        v2c.invert()
+        rect = rectangle_transform(v2c, rect)
+        if intersect:
+            return self._canvas.find_intersect(rect)
+        else:
+            return self._canvas.find_inside(rect)
+
+
     def get_items_in_rectangle(self, rect, intersect=True, reverse=False):
         """
         Return the items in the rectangle 'rect'.
         Items are automatically sorted in canvas' processing order.
         """
-        if intersect:
-            items = self._qtree.find_intersect(rect)
-        else:
-            items = self._qtree.find_inside(rect)
+        items = self._find_items(rect, intersect)
         return self._canvas.sort(items, reverse=reverse)
 
 
+    def get_items_in_region(self, rects):
+        """
+        Return the items intersecting with any of the rectangles ``rects``
+        (e.g. the damaged areas of the view). Each rectangle is looked up
+        separately. Items are sorted in canvas' processing order.
+        """
+        items = set()
+        for rect in rects:
+            items.update(self._find_items(rect))
+        return self._canvas.sort(items)
+
+
     def select_in_rectangle(self, rect):
         """
         Select all items who have their bounding box within the
         rectangle @rect.
         """
-        items = self._qtree.find_inside(rect)
+        items = self._find_items(rect, intersect=False)
         map(self.select_item, items)
 
 
@@ -364,9 +415,18 @@ class View(object):
         # TODO: should the scale factor be clipped?
         self._matrix.scale(factor, factor)
 
-        # Make sure everything's updated
-        #map(self.update_matrix, self._canvas.get_all_items())
-        self.request_update((), self._canvas.get_all_items())
+        self.request_matrix_update()
+
+
+    def request_matrix_update(self):
+        """
+        Notify the view its matrix has changed, e.g. after scrolling or
+        zooming. This should be called each time the matrix is changed in
+        place. The items are not updated: bounding boxes are kept in
+        canvas coordinates, only the item to view matrices are calculated
+        again.
+        """
+        self._matrix_version += 1
 
 
     def set_item_bounding_box(self, item, bounds):
@@ -375,23 +435,28 @@ class View(object):
 
         ``bounds`` is in view coordinates.
 
-        Coordinates are calculated back to item coordinates, so matrix-only
-        updates can occur.
+        Coordinates are calculated back to item coordinates and handed to
+        the canvas, so matrix-only updates can occur.
         """
-        v2i = self.get_matrix_v2i(item).transform_point
-        ix0, iy0 = v2i(bounds.x, bounds.y)
-        ix1, iy1 = v2i(bounds.x1, bounds.y1)
-        self._qtree.add(item=item, bounds=bounds, data=Rectangle(ix0, iy0, x1=ix1, y1=iy1))
+        v2i = self.get_matrix_v2i(item)
+        self._canvas.set_item_bounds(item, Rectangle(*rectangle_transform(v2i, bounds)))
 
 
     def get_item_bounding_box(self, item):
         """
         Get the bounding box for the item, in view coordinates.
         """
-        return self._qtree.get_bounds(item)
+        bounds = self._canvas.get_item_bounds(item)
+        return Rectangle(*rectangle_transform(self._matrix, bounds))
 
 
-    bounding_box = property(lambda s: s._bounds)
+    def _get_bounding_box(self):
+        """
+        The bounding box of all items, in view coordinates.
+        """
+        return Rectangle(*rectangle_transform(self._matrix, self._bounds))
+
+    bounding_box = property(_get_bounding_box)
 
 
     def update_bounding_box(self, cr, items=None):
@@ -401,7 +466,7 @@ class View(object):
         """
         painter = self._bounding_box_painter
         if items is None:
-            items = self.canvas.get_all_items()
+            items = self.canvas.get_all_items_view()
 
         # The painter calls set_item_bounding_box() for each rendered item.
         painter.paint(Context(cairo=cr,
@@ -409,12 +474,12 @@ class View(object):
                               area=None))
 
         # Update the view's bounding box with the rest of the items
-        self._bounds = Rectangle(*self._qtree.soft_bounds)
+        self._bounds = Rectangle(*self._canvas.get_bounds())
 
 
     def paint(self, cr):
         self._painter.paint(Context(cairo=cr,
-                                    items=self.canvas.get_all_items(),
+                                    items=self.canvas.get_all_items_view(),
                                     area=None))
 
 
@@ -422,42 +487,54 @@ class View(object):
         """
         Get Item to View matrix for ``item``.
         """
-        if self not in item._matrix_i2v:
-            self.update_matrix(item)
-        return item._matrix_i2v[self]
+        try:
+            version, i2v = item._matrix_i2v[self]
+        except KeyError:
+            version = None
+        if version != self._matrix_version:
+            i2v = self.update_matrix(item)[0]
+        return i2v
 
 
     def get_matrix_v2i(self, item):
         """
         Get View to Item matrix for ``item``.
         """
-        if self not in item._matrix_v2i:
-            self.update_matrix(item)
-        return item._matrix_v2i[self]
+        try:
+            version, v2i = item._matrix_v2i[self]
+        except KeyError:
+            version = None
+        if version != self._matrix_version:
+            v2i = self.update_matrix(item)[1]
+        return v2i
 
 
     def update_matrix(self, item):
         """
-        Update item matrices related to view.
+        Update item matrices related to view. Returns the item to view and
+        view to item matrices.
         """
+        i2c = self._canvas.get_matrix_i2c(item)
         try:
-            i2v = item._matrix_i2c.multiply(self._matrix)
+            i2v = i2c.multiply(self._matrix)
         except AttributeError:
             # Fall back to old behaviour
-            i2v = item._matrix_i2c * self._matrix
-
-        item._matrix_i2v[self] = i2v
+            i2v = i2c * self._matrix
 
         v2i = Matrix(*i2v)
         v2i.invert()
-        item._matrix_v2i[self] = v2i
+
+        version = self._matrix_version
+        item._matrix_i2v[self] = version, i2v
+        item._matrix_v2i[self] = version, v2i
+        return i2v, v2i
 
 
     def _clear_matrices(self):
         """
         Clear registered data in Item's _matrix{i2c|v2i} attributes.
         """
-        for item in self.canvas.get_all_items():
+        for item in self.canvas.get_all_items_view():
             try:
                 del item._matrix_i2v[self]
                 del item._matrix_v2i[self]
@@ -478,6 +555,18 @@ class GtkView(gtk.DrawingArea, View):
     `vadjustment`) to be used for scrollbars.
 
     This view registers itself on the canvas, so it will receive update events.
+
+    If ``tiled`` is set, the items are rendered in tiles (see
+    `tilecache.TileCache`) by the ``tile_painter``. Tiles are reused when
+    scrolling and rendered again when items are redrawn in their area or
+    when the zoom level changes. The ``painter`` is used to draw handles and
+    tools on top of the tiles. It's not provided with any items.
+
+    If ``layered`` is set, the items that are moved by a tool (see
+    ``start_static_layer()``) are drawn on top of a static layer: a surface
+    with all other items, rendered once by the ``tile_painter``. Only the
+    moving items, handles and tools are drawn by the ``painter``. The static
+    layer is rendered again if one of the other items is redrawn.
     """
 
     # Just defined a name to make GTK register this class.
@@ -502,11 +591,21 @@ class GtkView(gtk.DrawingArea, View):
     }
 
 
+    tiled = False
+
+    layered = False
+
     def __init__(self, canvas=None, hadjustment=None, vadjustment=None):
         gtk.DrawingArea.__init__(self)
 
         self._dirty_items = set()
         self._dirty_matrix_items = set()
+        self._tile_cache = TileCache()
+        self._tile_painter = ItemPainter(self)
+        self._moving_items = None
+        # Old bounds of items updated only because their children are dirty
+        self._implicit_bounds = {}
+        self._static_layer = None
 
         View.__init__(self, canvas)
 
@@ -548,12 +647,19 @@ class GtkView(gtk.DrawingArea, View):
         if self._canvas:
             self._clear_matrices()
             self._canvas.unregister_view(self)
+            items = self._canvas.get_all_items()
+            invalidate(self._painter, items)
+            invalidate(self._tile_painter, items)
 
         super(GtkView, self)._set_canvas(canvas)
+        self._tile_cache.clear()
+        self._moving_items = None
+        self._implicit_bounds.clear()
+        self._static_layer = None
         
         if self._canvas:
             self._canvas.register_view(self)
-            self.request_update(self._canvas.get_all_items())
+            self.request_update(self._canvas.get_all_items_view())
         self.queue_draw_refresh()
 
     canvas = property(lambda s: s._canvas, _set_canvas)
@@ -571,6 +677,20 @@ class GtkView(gtk.DrawingArea, View):
     tool = property(lambda s: s._tool, _set_tool)
 
 
+    def _set_tile_painter(self, painter):
+        """
+        Set the painter used to render the items in tiles.
+        """
+        self._tile_painter = painter
+        painter.set_view(self)
+        self._tile_cache.clear()
+        self._static_layer = None
+        self.emit('painter-changed')
+
+
+    tile_painter = property(lambda s: s._tile_painter, _set_tile_painter)
+
+
     hadjustment = property(lambda s: s._hadjustment)
 
 
@@ -597,14 +717,6 @@ class GtkView(gtk.DrawingArea, View):
         self.update_adjustments()
 
 
-    def zoom(self, factor):
-        """
-        Zoom in/out by factor ``factor``.
-        """
-        super(GtkView, self).zoom(factor)
-        self.queue_draw_refresh()
-
-
     @async(single=True)
     def update_adjustments(self, allocation=None):
         if not allocation:
@@ -614,7 +726,7 @@ class GtkView(gtk.DrawingArea, View):
         vadjustment = self._vadjustment
 
         # canvas limits (in view coordinates)
-        c = Rectangle(*self._qtree.soft_bounds)
+        c = self.bounding_box
 
         # view limits
         v = Rectangle(0, 0, self.allocation.width, self.allocation.height)
@@ -653,20 +765,50 @@ class GtkView(gtk.DrawingArea, View):
         item as update areas. Of course with a pythonic flavor: update
         any number of items at once.
 
+        The items are drawn from scratch: painters drop what they have
+        cached for them.
+
         TODO: Should we also create a (sorted) list of items that need redrawal?
         """
-        get_bounds = self._qtree.get_bounds
         items = filter(None, items)
-        try:
-            # create a copy, otherwise we'll change the original rectangle
-            bounds = Rectangle(*get_bounds(items[0]))
-            for item in items[1:]:
-                bounds += get_bounds(item)
-            self.queue_draw_area(*bounds)
-        except IndexError:
-            pass
-        except KeyError:
-            pass # No bounds calculated yet? bummer.
+        if items:
+            invalidate(self._painter, items)
+            invalidate(self._tile_painter, items)
+            self._queue_draw_bounds(items)
+
+
+    def _queue_draw_bounds(self, items):
+        """
+        Queue the bounds of ``items`` for redraw. Unlike
+        ``queue_draw_item()``, cached renderings of the items are kept, so
+        use this if only the position of the items has changed.
+
+        The bounds are not joined in one rectangle: they are merged only if
+        that does not increase the area to redraw (see
+        ``geometry.rectangle_merge()``).
+        """
+        if self._static_layer is not None:
+            moving = self._moving_items
+            implicit = self._implicit_bounds
+            for item in items:
+                if item not in moving and item not in implicit:
+                    self._static_layer = None
+                    break
+
+        get_bounds = self._canvas.get_item_bounds
+        rects = []
+        for item in items:
+            try:
+                bounds = get_bounds(item)
+            except KeyError:
+                continue # No bounds calculated yet? bummer.
+            if bounds:
+                rects.append(tuple(bounds))
+        tiled = self.tiled
+        for rect in rectangle_merge(rects):
+            if tiled:
+                self._tile_cache.invalidate(rect)
+            self.queue_draw_area(*rectangle_transform(self._matrix, rect))
 
 
     def queue_draw_area(self, x, y, w, h):
@@ -688,23 +830,98 @@ class GtkView(gtk.DrawingArea, View):
         a = self.allocation
         super(GtkView, self).queue_draw_area(0, 0, a.width, a.height)
 
-    def request_update(self, items, matrix_only_items=(), removed_items=()):
+
+    def start_static_layer(self, items):
+        """
+        Draw ``items`` (e.g. the items dragged by a tool), their children
+        and the items connected to them on top of a static layer with the
+        other items. Only done if the view is ``layered``.
+
+        Moving items are drawn on top of the other items, regardless of
+        their order in the canvas, until ``stop_static_layer()`` is called.
+
+        The canvas updates the ancestors of moving items too. Such an
+        update keeps the static layer, unless the ancestor itself was
+        requested for update or its bounds changed.
+        """
+        if not self.layered or not self._canvas:
+            return
+        canvas = self._canvas
+        moving = set()
+        for item in items:
+            moving.add(item)
+            moving.update(canvas.get_all_children(item))
+        for item in list(moving):
+            moving.update(c.item for c in canvas.get_connections(connected=item))
+        self._moving_items = moving
+        self._static_layer = None
+
+
+    def stop_static_layer(self):
+        """
+        Draw all items in canvas order again.
+        """
+        moving = self._moving_items
+        if moving is not None:
+            self._moving_items = None
+            self._implicit_bounds.clear()
+            self._static_layer = None
+            self._queue_draw_bounds(moving)
+
+
+    def request_matrix_update(self):
+        """
+        Redraw the view and update the scroll bars after the view matrix
+        has changed.
+        """
+        super(GtkView, self).request_matrix_update()
+        self._static_layer = None
+        self.queue_draw_refresh()
+        self.update_adjustments()
+
+
+    def request_update(self, items, matrix_only_items=(), removed_items=(),
+                       requested_items=None):
         """
         Request update for items. Items will get a full update treatment, while
         ``matrix_only_items`` will only have their bounding box recalculated.
+
+        ``requested_items`` are the items that requested an update
+        themselves; the other ``items`` are only updated because their
+        children are. If omitted, all items requested an update.
+
+        The canvas keeps the old bounds of the items until the views are
+        notified, so the old area is marked for redraw right away.
         """
         if items:
             self._dirty_items.update(items)
+            moving = self._moving_items
+            if moving is not None and requested_items is not None:
+                get_bounds = self._canvas.get_item_bounds
+                implicit = self._implicit_bounds
+                for item in items:
+                    if item in requested_items or item in moving:
+                        implicit.pop(item, None)
+                    elif item not in implicit:
+                        try:
+                            implicit[item] = get_bounds(item)
+                        except KeyError:
+                            pass
+            self.queue_draw_item(*items)
         if matrix_only_items:
             self._dirty_matrix_items.update(matrix_only_items)
+            self._queue_draw_bounds(matrix_only_items)
 
         # Remove removed items:
         if removed_items:
             self._dirty_items.difference_update(removed_items)
             self.queue_draw_item(*removed_items)
 
+            implicit = self._implicit_bounds
+            for item in removed_items:
+                implicit.pop(item, None)
+
             for item in removed_items:
-                self._qtree.remove(item)
                 self.selected_items.discard(item)
 
             if self.focused_item in removed_items:
@@ -728,29 +945,12 @@ class GtkView(gtk.DrawingArea, View):
         dirty_matrix_items = self._dirty_matrix_items
 
         try:
-            self.queue_draw_item(*dirty_items)
-
-            # Mark old bb section for update
-            self.queue_draw_item(*dirty_matrix_items)
+            # Only the matrix has changed: the canvas has calculated the
+            # new bounds from the bounds in item coordinates.
             for i in dirty_matrix_items:
-                if i not in self._qtree:
-                    dirty_items.add(i)
-                    self.update_matrix(i)
-                    continue
-
                 self.update_matrix(i)
 
-                if i not in dirty_items:
-                    # Only matrix has changed, so calculate new bb based
-                    # on quadtree data (= bb in item coordinates).
-                    bounds = self._qtree.get_data(i)
-                    i2v = self.get_matrix_i2v(i).transform_point
-                    x0, y0 = i2v(bounds.x, bounds.y)
-                    x1, y1 = i2v(bounds.x1, bounds.y1)
-                    vbounds = Rectangle(x0, y0, x1=x1, y1=y1)
-                    self._qtree.add(i, vbounds, bounds)
-
-            self.queue_draw_item(*dirty_matrix_items)
+            self._queue_draw_bounds(dirty_matrix_items)
 
             # Request bb recalculation for all 'really' dirty items
             self.update_bounding_box(set(dirty_items))
@@ -773,7 +973,19 @@ class GtkView(gtk.DrawingArea, View):
             super(GtkView, self).update_bounding_box(cr, items)
         finally:
             cr.restore()
+
+        # Ancestors of moving items keep the static layer if their bounds
+        # did not change
+        implicit = self._implicit_bounds
+        if implicit:
+            get_bounds = self._canvas.get_item_bounds
+            for item in items:
+                bounds = implicit.get(item)
+                if bounds is not None and get_bounds(item) != bounds:
+                    self._static_layer = None
         self.queue_draw_item(*items)
+        for item in items:
+            implicit.pop(item, None)
         self.update_adjustments()
 
 
@@ -783,15 +995,15 @@ class GtkView(gtk.DrawingArea, View):
         Allocate the widget size ``(x, y, width, height)``.
         """
         gtk.DrawingArea.do_size_allocate(self, allocation)
+        self._static_layer = None
         self.update_adjustments(allocation)
-        self._qtree.resize((0, 0, allocation.width, allocation.height))
        
 
     def do_realize(self):
         gtk.DrawingArea.do_realize(self)
 
         if self._canvas:
-            self.request_update(self._canvas.get_all_items())
+            self.request_update(self._canvas.get_all_items_view())
 
     def do_unrealize(self):
         if self.canvas:
@@ -799,7 +1011,6 @@ class GtkView(gtk.DrawingArea, View):
             # (weak refs), better do it explicitly to be sure.
             self._clear_matrices()
             self.canvas = None
-        self._qtree.clear()
 
         self._dirty_items.clear()
         self._dirty_matrix_items.clear()
@@ -813,43 +1024,127 @@ class GtkView(gtk.DrawingArea, View):
         if not self._canvas:
             return
 
-        area = event.area
-        x, y, w, h = area.x, area.y, area.width, area.height
+        try:
+            rects = event.region.get_rectangles()
+        except AttributeError:
+            rects = [event.area]
+        rects = [Rectangle(r.x, r.y, r.width, r.height) for r in rects]
         cr = self.window.cairo_create()
 
-        # Draw no more than nessesary.
-        cr.rectangle(x, y, w, h)
+        # Draw no more than nessesary: only the damaged rectangles
+        for r in rects:
+            cr.rectangle(*r)
         cr.clip()
 
-        area = Rectangle(x, y, width=w, height=h)
-        self._painter.paint(Context(cairo=cr,
-                                    items=self.get_items_in_rectangle(area),
-                                    area=area))
+        moving = self._moving_items
+        if moving is not None:
+            self._paint_static_layer(cr)
+            tiles = False
+        else:
+            tiles = self.tiled and self._paint_tiles(cr, rects)
+
+        # Each rectangle is painted with only the items in it, the tiles
+        # contain the items already
+        painter = self._painter
+        for rect in rects:
+            if tiles:
+                items = ()
+            elif moving is not None:
+                items = [i for i in self.get_items_in_rectangle(rect) if i in moving]
+            else:
+                items = self.get_items_in_rectangle(rect)
+            cr.save()
+            try:
+                cr.rectangle(*rect)
+                cr.clip()
+                painter.paint(Context(cairo=cr,
+                                      items=items,
+                                      area=rect))
+            finally:
+                cr.restore()
 
         if DEBUG_DRAW_BOUNDING_BOX:
             cr.save()
             cr.identity_matrix()
             cr.set_source_rgb(0, .8, 0)
             cr.set_line_width(1.0)
-            b = self._bounds
+            b = self.bounding_box
             cr.rectangle(b[0], b[1], b[2], b[3])
             cr.stroke()
             cr.restore()
 
-        # Draw Quadtree structure
+        # Draw Quadtree structure of the canvas
         if DEBUG_DRAW_QUADTREE:
             def draw_qtree_bucket(bucket):
                 cr.rectangle(*bucket.bounds)
-                cr.stroke()
                 for b in bucket._buckets:
                     draw_qtree_bucket(b)
+            cr.save()
+            cr.set_matrix(self._matrix)
+            draw_qtree_bucket(self._canvas._get_spatial_index()._bucket)
+            cr.restore()
             cr.set_source_rgb(0, 0, .8)
             cr.set_line_width(1.0)
-            draw_qtree_bucket(self._qtree._bucket)
+            cr.stroke()
 
         return False
 
 
+    def _paint_static_layer(self, cr):
+        """
+        Paint the static layer: the items that are not moving. The layer
+        covers the whole widget and is rendered if needed.
+        """
+        layer = self._static_layer
+        if layer is None:
+            a = self.allocation
+            layer = cairo.ImageSurface(cairo.FORMAT_ARGB32, a.width, a.height)
+            area = Rectangle(0, 0, a.width, a.height)
+            moving = self._moving_items
+            self._tile_painter.paint(Context(cairo=cairo.Context(layer),
+                    items=[i for i in self.get_items_in_rectangle(area) if i not in moving],
+                    area=area))
+            self._static_layer = layer
+        cr.set_source_surface(layer, 0, 0)
+        cr.paint()
+
+
+    def _paint_tiles(self, cr, rects):
+        """
+        Paint the tiles covering the rectangles ``rects`` (in view
+        coordinates). Tiles can only be used if the view is scaled the same
+        way in both directions and not rotated. Returns ``True`` if the
+        tiles are painted.
+        """
+        xx, yx, xy, yy, x0, y0 = self._matrix
+        if yx or xy or xx != yy:
+            return False
+        size = self._tile_cache.size
+
+        def render(i, j):
+            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, size, size)
+            tcr = cairo.Context(surface)
+            # Device coordinates of the tile are view coordinates without
+            # the scroll offset
+            tx, ty = i * size + x0, j * size + y0
+            tcr.translate(-tx, -ty)
+            tile_area = Rectangle(tx, ty, size, size)
+            self._tile_painter.paint(Context(cairo=tcr,
+                                             items=self.get_items_in_rectangle(tile_area),
+                                             area=tile_area))
+            return surface
+
+        # A tile may cover more than one rectangle, paint it once
+        tiles = {}
+        for r in rects:
+            tiles.update(self._tile_cache.get_tiles(xx, (r.x - x0, r.y - y0,
+                                                         r.width, r.height), render))
+        for (i, j), surface in tiles.iteritems():
+            cr.set_source_surface(surface, i * size + x0, j * size + y0)
+            cr.paint()
+        return True
+
+
     def do_event(self, event):
         """
         Handle GDK events. Events are delegated to a `tool.Tool`.
@@ -877,10 +1172,7 @@ class GtkView(gtk.DrawingArea, View):
             m.translate(0, - adj.value)
         self._matrix *= m
 
-        # Force recalculation of the bounding boxes:
-        self.request_update((), self._canvas.get_all_items())
-
-        self.queue_draw_refresh()
+        self.request_matrix_update()
 
 
 # Set a signal to set adjustments. This way a ScrolledWindow can set its own